@@ -1,7 +1,37 @@
-from .git import GitManager, GitRepoError
-from .docker import DockerUtil
-from .application import ApplicationNotebook
-from .cwl import ProcessCWL, DataStagingCWL
-from .descriptor import Descriptor
+import importlib
 
-from .version import __version__
\ No newline at end of file
+from .version import __version__
+
+# Public names and the submodule defining them, submodules are only imported on first access
+# so that generating CWL does not load docker, git or requests
+_LAZY_ATTRIBUTES = {
+    'GitManager': '.git',
+    'GitMirrorCache': '.git',
+    'GitRepoError': '.git',
+    'DockerUtil': '.docker',
+    'ApplicationNotebook': '.application',
+    'ProcessCWL': '.cwl',
+    'DataStagingCWL': '.cwl',
+    'Descriptor': '.descriptor',
+    'generate_package': '.batch',
+    'generate_packages': '.batch',
+    'GenerationCache': '.cache',
+    'PackageWatcher': '.watch',
+    'GenerationService': '.service',
+}
+
+__all__ = list(_LAZY_ATTRIBUTES) + ['__version__']
+
+def __getattr__(name):
+    module_name = _LAZY_ATTRIBUTES.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(module_name, __name__), name)
+
+    # Later accesses no longer go through this function
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
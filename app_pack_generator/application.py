@@ -1,11 +1,15 @@
+import io
 import os
+import re
+import ast
 import json
 import attrs
 import logging
+import threading
+import tokenize
 
-import papermill
-import jsonschema
-from tabulate import tabulate
+from .instrument import span
+from .loader import load_notebook
 
 logger = logging.getLogger(__name__)
 
@@ -16,69 +20,275 @@ LOCAL_PATH = os.path.dirname(os.path.realpath(__file__))
 SCHEMA_LIST = [os.path.join(LOCAL_PATH,
                             'schemas/nbformat.v4.{v}.schema.json'.format(v=i)) for i in range(0, 6)]
 
+class NotebookSchemaRegistry(object):
+    """Loads and compiles the nbformat v4.X schemas at most once per process.
+
+    Validators are keyed by the schema minor version and picked using the
+    notebook's own nbformat/nbformat_minor fields. Every schema is only tried in
+    turn when the notebook does not validate against the schema it declares.
+    """
+
+    def __init__(self, schema_list=SCHEMA_LIST):
+
+        self.schema_list = list(schema_list)
+
+        # Compiled validators keyed by index into schema_list
+        self._validators = {}
+        self._lock = threading.Lock()
+
+    def validator(self, index):
+        "Returns the compiled validator for schema_list[index], loading it on first use"
+
+        validator = self._validators.get(index)
+        if validator is not None:
+            return validator
+
+        with self._lock:
+            if index not in self._validators:
+                fname = self.schema_list[index]
+                with open(fname, 'r') as f:
+                    schema = json.load(f)
+
+                # Deferred until the first notebook is validated, jsonschema is slow to import
+                import jsonschema
+
+                validator_cls = jsonschema.validators.validator_for(schema)
+                validator_cls.check_schema(schema)
+                self._validators[index] = validator_cls(schema)
+
+            return self._validators[index]
+
+    def preload(self):
+        "Compiles every available schema up front, for long running processes"
+
+        for index, fname in enumerate(self.schema_list):
+            if os.path.exists(fname):
+                self.validator(index)
+
+    def _candidates(self, notebook):
+        "Orders schema indexes so the version declared by the notebook is tried first"
+
+        order = list(range(len(self.schema_list)))
+
+        major = notebook.get('nbformat') if isinstance(notebook, dict) else None
+        minor = notebook.get('nbformat_minor') if isinstance(notebook, dict) else None
+
+        if major == 4 and isinstance(minor, int) and 0 <= minor < len(order):
+            order.remove(minor)
+            order.insert(0, minor)
+
+        return order
+
+    def validate(self, notebook):
+        """Validates notebook against the supported schemas.
+
+        Returns the filename of the schema that validated the notebook or None if
+        validation failed against all of them.
+        """
+
+        import jsonschema
+
+        for index in self._candidates(notebook):
+            fname = self.schema_list[index]
+            if not os.path.exists(fname):
+                logger.error(f'Validation file "{fname}" does not exist.')
+                continue
+
+            try:
+                self.validator(index).validate(notebook)
+                logger.debug(f'Successfully validated using "{os.path.basename(fname)}"')
+                return fname
+            except (jsonschema.exceptions.ValidationError, jsonschema.exceptions.SchemaError) as e:
+                logger.error(f'Failed validation using "{os.path.basename(fname)}"')
+                continue
+
+        return None
+
+# Shared by all notebooks parsed in this process so schemas are only compiled once
+NOTEBOOK_SCHEMAS = NotebookSchemaRegistry()
+
+
+# Tag papermill uses to identify the cell containing notebook parameters
+PARAMETERS_TAG = 'parameters'
+
+# Parses the comment following a parameter, mirrors papermill's Python translator:
+#   name = value # type: <type_name> help text
+PARAMETER_COMMENT_PATTERN = re.compile(r'^#\s*(type:\s*(?P<type_comment>[^\s]*)\s*)?(?P<help>.*)$')
+
+# IPython magics, shell escapes and help requests, which are not Python and hold no parameters
+IPYTHON_LINE_PATTERN = re.compile(r'^(\s*)([%!?].*)$', re.MULTILINE)
+
+def find_parameters_cell(notebook, tag=PARAMETERS_TAG):
+    "Returns the first cell of a loaded notebook tagged with [tag], or None"
+
+    for cell in notebook.get('cells', []):
+        if tag in cell.get('metadata', {}).get('tags', []):
+            return cell
+
+    return None
+
+def cell_source(cell):
+    "Returns the source of a notebook cell as a single string"
+
+    source = cell.get('source', '')
+    if isinstance(source, list):
+        source = ''.join(source)
+
+    return source
+
+def source_segment(source_lines, node):
+    "Same as ast.get_source_segment for source already split into lines, keeping line endings"
+
+    first, last = node.lineno - 1, node.end_lineno - 1
+
+    # Column offsets are in bytes of the UTF-8 encoded line
+    if first == last:
+        return source_lines[first].encode()[node.col_offset:node.end_col_offset].decode()
+
+    segment = [ source_lines[first].encode()[node.col_offset:].decode() ]
+    segment += source_lines[first + 1:last]
+    segment.append(source_lines[last].encode()[:node.end_col_offset].decode())
+
+    return ''.join(segment)
+
+def inspect_parameters(notebook):
+    """Statically extracts the parameters from the parameters cell of an already loaded notebook.
+
+    Returns the same mapping of parameter name to a dictionary of name,
+    inferred_type_name, default and help strings as papermill.inspect_notebook
+    without reading the notebook again or executing any of its code.
+    """
+
+    params = {}
+
+    parameters_cell = find_parameters_cell(notebook)
+    if parameters_cell is None:
+        return params
+
+    source = cell_source(parameters_cell)
+
+    # Split once, ast.get_source_segment splits the whole source on every call
+    source_lines = io.StringIO(source, newline='').readlines()
+
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        # Comment out IPython syntax, as papermill skips it, keeping the lines in place
+        source = IPYTHON_LINE_PATTERN.sub(r'\1# \2', source)
+        try:
+            tree = ast.parse(source)
+        except SyntaxError as e:
+            raise ApplicationError(f"Could not parse notebook parameters cell: {e}")
+
+    try:
+        comments = { tok.start[0]: tok.string
+                     for tok in tokenize.generate_tokens(io.StringIO(source).readline)
+                     if tok.type == tokenize.COMMENT }
+    except tokenize.TokenError as e:
+        raise ApplicationError(f"Could not parse notebook parameters cell: {e}")
+
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            name = node.targets[0].id
+            annotation = None
+        elif isinstance(node, ast.AnnAssign) and isinstance(node.target, ast.Name) and node.value is not None:
+            name = node.target.id
+            annotation = source_segment(source_lines, node.annotation).strip('"\'')
+        else:
+            # Only simple variable assignments are considered parameters
+            continue
+
+        # Only a comment on the last line of the definition is interpreted as help
+        type_comment = None
+        help_text = ""
+        match = PARAMETER_COMMENT_PATTERN.match(comments.get(node.end_lineno, ''))
+        if match is not None:
+            type_comment = match.group('type_comment')
+            help_text = match.group('help') or ""
+
+        params[name] = {
+            'name': name,
+            'inferred_type_name': str(annotation or type_comment or None).strip(),
+            'default': source_segment(source_lines, node.value).strip(),
+            'help': help_text.strip(),
+        }
+
+    return params
+
+# Lower cased inferred type names and the CWL type they convert to
+CWL_TYPE_LOOKUP = {
+    'stage_in': 'string',
+    'stage-in': 'string',
+    'string': 'string',
+    'stage_out': 'File',
+    'stage-out': 'File',
+    'file': 'File',
+    'int': 'int',
+    'integer': 'int',
+    'bool': 'boolean',
+    'boolean': 'boolean',
+    'float': 'float',
+    'double': 'double',
+    'directory': 'Directory',
+    'any': 'Any',
+    'nonetype': 'null',
+}
+
+def convert_cwl_type(inferred_type, default_source):
+    """Converts the inferred type to an equivalent CWL type.
+
+    Otherwise, checks if the source of the default value is a string or can be converted to a float."""
+
+    if inferred_type is not None:
+        cwl_type = CWL_TYPE_LOOKUP.get(inferred_type.lower())
+        if cwl_type is not None:
+            return cwl_type
+
+    if default_source.find('"') != -1 or default_source.find('\'') != -1:
+        return 'string'
+
+    try:
+        float(default_source)
+        return 'float'
+    except ValueError:
+        return 'Any'
 
 class ApplicationParameter(object):
+    """A notebook parameter.
+
+    The default value is evaluated as a Python literal and the CWL type resolved
+    once when the parameter is created. Code in the default is never executed."""
+
+    __slots__ = ('papermill_info', 'name', 'help', 'default', 'inferred_type', 'cwl_type')
+
     def __init__(self, papermill_info):
 
         self.papermill_info = papermill_info
 
-    @property
-    def name(self):
-        return self.papermill_info['name']
+        self.name = papermill_info['name']
+        self.help = papermill_info['help']
 
-    @property
-    def inferred_type(self):
+        # Use papermill version of default when the CWL type can not be inferred
+        # since we massage default into a Python type
+        default_source = papermill_info['default']
 
-        if self.papermill_info['inferred_type_name'] != 'None':
-            return self.papermill_info['inferred_type_name']
+        try:
+            self.default = ast.literal_eval(default_source)
+            default_type = type(self.default).__name__
+        except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+            logger.warning(f'Default value of parameter "{self.name}" is not a Python literal, using None: {default_source}')
+            self.default = None
+            default_type = None
+
+        if papermill_info['inferred_type_name'] != 'None':
+            self.inferred_type = papermill_info['inferred_type_name']
         else:
-            return type(self.default).__name__
-
-    @property
-    def default(self):
-        return eval(self.papermill_info['default'])
-
-    @property
-    def help(self):
-        return self.papermill_info['help'] 
-
-    @property
-    def cwl_type(self):
-        """Attempts to convert the inferred type to an equivalent CWL type.
-
-        Otherwise, checks if a given key's default value is a string or can be converted to a float."""
-
-        inferred_type = self.inferred_type
-
-        # Use papermill version of default since we will massage default into 
-        # a Python type
-        default_val = self.papermill_info['default']
-
-        inferred_type = inferred_type.lower()
-        convert_dict = {
-            'string': ['stage_in', 'stage-in', 'string'],
-            'File': ['stage_out', 'stage-out', 'file'],
-            'int': ['int', 'integer'],
-            'boolean': ['bool', 'boolean'],
-            'float': ['float'],
-            'double': ['double'],
-            'Directory': ['directory'],
-            'Any': ['any'],
-            'null': ['nonetype'],
-        }
-        for key in convert_dict:
-            if inferred_type in convert_dict[key]:
-                return key
+            self.inferred_type = default_type
 
-        if default_val.find('"') != -1 or default_val.find('\'') != -1:
-            return 'string'
-        key_type = 'Any'
-        try:
-            temp = float(default_val)
-            key_type = 'float'
-        except ValueError:
-            pass
-        return key_type
+        self.cwl_type = convert_cwl_type(self.inferred_type, default_source)
+
+    def __repr__(self):
+        return f"ApplicationParameter(name={self.name!r}, cwl_type={self.cwl_type!r}, default={self.default!r})"
 
 class ApplicationError(Exception):
     pass
@@ -94,12 +304,20 @@ class ApplicationInterface(object):
     stage_out_param: ApplicationParameter = None
 
     # Free arguments that are papermill parameters not associated with stage
-    arguments: list[ApplicationParameter] = []
+    arguments: list[ApplicationParameter] = attrs.Factory(list)
 
 class ApplicationNotebook(ApplicationInterface):
-    """Defines a parsed Jupyter Notebook read as a JSON file."""
+    """Defines a parsed Jupyter Notebook read as a JSON file.
+
+    With streaming, cell outputs and attachments are skipped while reading the notebook
+    and are not available in the notebook attribute. By default only notebooks larger than
+    loader.STREAMING_THRESHOLD_BYTES are streamed.
+
+    An already loaded notebook can be supplied as notebook, notebook_filename is then only
+    used to identify it in messages.
+    """
 
-    def __init__(self, notebook_filename):
+    def __init__(self, notebook_filename, streaming=None, notebook=None):
 
         super().__init__()
 
@@ -110,7 +328,13 @@ class ApplicationNotebook(ApplicationInterface):
         self.notebook_parameters = []
 
         self.filename = notebook_filename
-        self.parse_notebook(notebook_filename)
+        self.streaming = streaming
+
+        if notebook is not None:
+            self.notebook = notebook
+            self.parse_loaded_notebook(notebook_filename)
+        else:
+            self.parse_notebook(notebook_filename)
 
     def parse_notebook(self, notebook_filename):
         """Parses validate notebook_filename as a valid, existing Jupyter Notebook to
@@ -120,34 +344,28 @@ class ApplicationNotebook(ApplicationInterface):
             raise ApplicationError(f"Could not find notebook file: {notebook_filename}")
 
         logger.info(f'Reading notebook: "{notebook_filename}"')
-        with open(notebook_filename, 'r') as f:
-            self.notebook = json.load(f)
+        with span('notebook.load', notebook=notebook_filename):
+            self.notebook = load_notebook(notebook_filename, skip_outputs=self.streaming)
+
+        self.parse_loaded_notebook(notebook_filename)
+
+    def parse_loaded_notebook(self, notebook_filename):
+        "Validates the loaded notebook and extracts its parameters"
 
         # Validate the notebook using the list of supported v4.X schemas.
         logger.debug(f'Validating {notebook_filename} as a valid v4.0 - v4.5 Jupyter notebook')
-        validation_success = False
-        for fname in SCHEMA_LIST:
-            if os.path.exists(fname):
-                try:
-                    with open(fname, 'r') as f:
-                        schema = json.load(f)
-                        jsonschema.validate(
-                            instance=self.notebook, schema=schema)
-                        logger.debug(f'Successfully validated using "{os.path.basename(fname)}"')
-                        validation_success = True
-                        break
-                except (jsonschema.exceptions.ValidationError, jsonschema.exceptions.SchemaError) as e:
-                    logger.error(f'Failed validation using "{os.path.basename(fname)}"')
-                    continue
-            else:
-                logger.error(f'Validation file "{fname}" does not exist.')
+        with span('notebook.validate', notebook=notebook_filename):
+            validation_success = NOTEBOOK_SCHEMAS.validate(self.notebook) is not None
 
         if not validation_success:
             raise ApplicationError(f'Failed to validate "{notebook_filename}" as a v4.0 - v4.5 Jupyter Notebook...')
 
-        # Inspect notebook parameters using papermill and parse them into a list.
+        # Extract notebook parameters from the already loaded notebook and parse them into a list.
         self.notebook_parameters = []
-        for papermill_param in papermill.inspect_notebook(notebook_filename).values():
+        with span('notebook.parameters', notebook=notebook_filename):
+            papermill_params = inspect_parameters(self.notebook)
+
+        for papermill_param in papermill_params.values():
             app_param = ApplicationParameter(papermill_param)
             self.notebook_parameters.append(app_param)
 
@@ -168,6 +386,7 @@ class ApplicationNotebook(ApplicationInterface):
                 self.arguments.append(app_param)
 
     def parameter_summary(self):
+        from tabulate import tabulate
 
         headers = [ 'name', 'inferred_type', 'cwl_type', 'default', 'help' ]
 
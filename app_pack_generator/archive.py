@@ -0,0 +1,183 @@
+import json
+import gzip
+import hashlib
+import logging
+import tempfile
+
+import attrs
+
+logger = logging.getLogger(__name__)
+
+# Bytes read at a time from image archives, the same as docker-py uses for image.save()
+ARCHIVE_CHUNK_SIZE = 2 * 1024 * 1024
+
+# Supported archive compressions, zstd requires the zstandard package
+COMPRESSIONS = (None, 'gzip', 'zstd')
+
+# Appended to the archive filename to name its manifest
+MANIFEST_SUFFIX = '.manifest.json'
+
+class ArchiveError(Exception):
+    pass
+
+class ArchiveDigestError(ArchiveError):
+    pass
+
+@attrs.define
+class ArchiveManifest(object):
+    "Describes an exported image archive so it can be verified before being loaded"
+
+    image_reference: str
+    image_id: str
+    compression: str = None
+
+    # Digest and size of the archive file as written, after compression
+    sha256: str = None
+    size: int = 0
+
+    # Size of the docker-archive tarball before compression
+    uncompressed_size: int = 0
+
+    def write(self, fname):
+        with open(fname, 'w') as f:
+            json.dump(attrs.asdict(self), f, indent=4)
+
+    @classmethod
+    def read(cls, fname):
+        with open(fname) as f:
+            return cls(**json.load(f))
+
+class _DigestWriter(object):
+    "File-like object hashing and counting the bytes written through it"
+
+    def __init__(self, output):
+        self.output = output
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.digest.update(data)
+        self.size += len(data)
+        return self.output.write(data)
+
+    def flush(self):
+        if hasattr(self.output, 'flush'):
+            self.output.flush()
+
+def _check_compression(compression):
+    if compression not in COMPRESSIONS:
+        raise ArchiveError(f"Unsupported compression {compression!r}, use one of {COMPRESSIONS}")
+
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise ArchiveError("zstd compression requires the zstandard package")
+        return zstandard
+
+def _compressor(compression, output):
+    "Returns a writer compressing into output and a function finishing the compressed stream"
+
+    zstandard = _check_compression(compression)
+
+    if compression == 'gzip':
+        writer = gzip.GzipFile(fileobj=output, mode='wb', compresslevel=6)
+        return writer, writer.close
+    elif compression == 'zstd':
+        writer = zstandard.ZstdCompressor().stream_writer(output, closefd=False)
+        return writer, writer.close
+
+    return output, lambda: None
+
+def write_archive(chunks, output, compression=None):
+    """Writes the chunks of bytes to the output file object, compressed as it goes.
+
+    Returns the sha256 digest and size of the bytes written to output and the
+    uncompressed size of the chunks. Only one chunk is held in memory at a time.
+    """
+
+    digest_writer = _DigestWriter(output)
+    writer, finish = _compressor(compression, digest_writer)
+
+    uncompressed_size = 0
+    for chunk in chunks:
+        uncompressed_size += len(chunk)
+        writer.write(chunk)
+
+    finish()
+    digest_writer.flush()
+
+    return digest_writer.digest.hexdigest(), digest_writer.size, uncompressed_size
+
+def file_digest(input, chunk_size=ARCHIVE_CHUNK_SIZE):
+    "Returns the sha256 digest and size of the rest of the input file object"
+
+    digest = hashlib.sha256()
+    size = 0
+    while True:
+        data = input.read(chunk_size)
+        if not data:
+            break
+        digest.update(data)
+        size += len(data)
+
+    return digest.hexdigest(), size
+
+def _check_digest(manifest, sha256, size):
+    if sha256 != manifest.sha256 or size != manifest.size:
+        raise ArchiveDigestError(f"Archive of {manifest.image_reference} does not match its manifest: "
+                                 f"sha256 {sha256} and {size} bytes instead of {manifest.sha256} and {manifest.size} bytes")
+
+def verify_archive(input, manifest, chunk_size=ARCHIVE_CHUNK_SIZE):
+    "Raises ArchiveDigestError unless the input file object matches the manifest digest and size"
+
+    _check_digest(manifest, *file_digest(input, chunk_size))
+
+def load_archive(input, manifest, load, chunk_size=ARCHIVE_CHUNK_SIZE):
+    """Verifies the input file object against the manifest digest and size, then passes its
+    decompressed contents to load and returns what load returned.
+
+    Nothing is loaded when the input does not match, ArchiveDigestError is raised instead.
+    Input that can not be seeked back is spooled to a temporary file while it is verified.
+    """
+
+    if getattr(input, 'seekable', lambda: False)():
+        start = input.tell()
+        verify_archive(input, manifest, chunk_size)
+        input.seek(start)
+
+        return load(read_archive(input, manifest.compression, chunk_size))
+
+    with tempfile.TemporaryFile(prefix='app-pack-archive-') as spool:
+        spool_writer = _DigestWriter(spool)
+        while True:
+            data = input.read(chunk_size)
+            if not data:
+                break
+            spool_writer.write(data)
+
+        _check_digest(manifest, spool_writer.digest.hexdigest(), spool_writer.size)
+        spool.seek(0)
+
+        return load(read_archive(spool, manifest.compression, chunk_size))
+
+def read_archive(input, compression=None, chunk_size=ARCHIVE_CHUNK_SIZE):
+    "Yields the decompressed contents of the input file object in chunks"
+
+    zstandard = _check_compression(compression)
+
+    if compression == 'gzip':
+        reader = gzip.GzipFile(fileobj=input, mode='rb')
+    elif compression == 'zstd':
+        reader = zstandard.ZstdDecompressor().stream_reader(input, closefd=False)
+    else:
+        reader = input
+
+    while True:
+        data = reader.read(chunk_size)
+        if not data:
+            break
+        yield data
+
+def manifest_filename(archive_fname):
+    return archive_fname + MANIFEST_SUFFIX
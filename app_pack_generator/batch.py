@@ -0,0 +1,212 @@
+import os
+import logging
+import traceback
+import concurrent.futures
+
+import attrs
+
+from .application import ApplicationNotebook
+from .cwl import ProcessCWL, DataStagingCWL
+from .descriptor import Descriptor
+from .output import OutputSink, RecordingSink
+
+logger = logging.getLogger(__name__)
+
+# Directories that are never searched for notebooks
+IGNORE_DIRECTORIES = ['.git', '.ipynb_checkpoints']
+
+@attrs.define
+class RepositoryInfo(object):
+    """Snapshot of the GitManager properties used for package generation.
+
+    Unlike GitManager it can be sent to worker processes."""
+
+    name: str
+    owner: str = None
+    commit_identifier: str = None
+    commit_message: str = None
+    directory: str = None
+
+    @classmethod
+    def from_git_manager(cls, git_mgr):
+        return cls(name=git_mgr.name,
+                   owner=git_mgr.owner,
+                   commit_identifier=git_mgr.commit_identifier,
+                   commit_message=git_mgr.commit_message,
+                   directory=git_mgr.directory)
+
+@attrs.define
+class PackageResult(object):
+    "Outcome of generating the application package for a single notebook"
+
+    notebook: str
+    outdir: str
+    files: list[str] = attrs.Factory(list)
+    error: str = None
+    traceback: str = None
+
+    @property
+    def success(self):
+        return self.error is None
+
+@attrs.define
+class BatchResult(object):
+    "Outcome of generating application packages for all notebooks of a repository"
+
+    results: list[PackageResult] = attrs.Factory(list)
+
+    @property
+    def succeeded(self):
+        return [ r for r in self.results if r.success ]
+
+    @property
+    def failed(self):
+        return [ r for r in self.results if not r.success ]
+
+    @property
+    def success(self):
+        return len(self.failed) == 0
+
+def discover_notebooks(directory):
+    "Returns the sorted absolute paths of all Jupyter notebooks found below directory"
+
+    notebooks = []
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames[:] = [ d for d in dirnames if d not in IGNORE_DIRECTORIES ]
+
+        for fname in filenames:
+            if fname.endswith('.ipynb'):
+                notebooks.append(os.path.join(os.path.abspath(dirpath), fname))
+
+    return sorted(notebooks)
+
+def notebook_outdir(outdir, directory, notebook_filename):
+    "Output directory for a notebook, mirrors its location relative to the repository directory"
+
+    relpath = os.path.relpath(notebook_filename, directory)
+    return os.path.join(outdir, os.path.splitext(relpath)[0])
+
+def notebook_relpath(notebook_filename, directory):
+    "Path of the notebook relative to the repository directory, None when it is outside of it or unknown"
+
+    if directory is None:
+        return None
+
+    relpath = os.path.relpath(os.path.abspath(notebook_filename), os.path.abspath(directory))
+    if relpath.startswith(os.pardir):
+        return None
+
+    return relpath
+
+def write_package(app, repo, outdir, dockerurl="undefined", template_dir=None):
+    """Generates the CWL files and application descriptor of an already parsed application into outdir.
+
+    outdir is either a directory path or an OutputSink receiving the files.
+
+    Returns the list of all files generated by this function (abs. path), or as identified
+    by the sink.
+    """
+
+    template_args = {} if template_dir is None else {'template_dir': template_dir}
+
+    # The generated process runs the notebook from its location inside the repository
+    notebook_path = notebook_relpath(app.filename, repo.directory)
+
+    generated_files = []
+    generated_files += ProcessCWL(app, notebook_path=notebook_path, **template_args).generate_all(outdir, dockerurl=dockerurl)
+    generated_files += DataStagingCWL(app, **template_args).generate_all(outdir)
+
+    desc_args = {} if template_dir is None else {'templatedir': template_dir}
+    generated_files.append(Descriptor(app, repo, **desc_args).generate_descriptor(outdir, dockerurl))
+
+    return generated_files
+
+def generate_package(notebook_filename, repo, outdir, dockerurl="undefined", template_dir=None, cache=None):
+    """Parses a notebook and generates its CWL files and application descriptor into outdir.
+
+    outdir is either a directory path or an OutputSink receiving the files. When a
+    GenerationCache is supplied, unchanged packages are copied from the cache, or written
+    to the sink, without parsing the notebook or the templates.
+
+    Returns the list of all files generated by this function (abs. path), or as identified
+    by the sink.
+    """
+
+    if cache is not None:
+        cache_key = cache.key(notebook_filename, repo, dockerurl, template_dir)
+
+        generated_files = cache.lookup(cache_key, outdir)
+        if generated_files is not None:
+            return generated_files
+
+        if isinstance(outdir, OutputSink):
+            # Sinks may not keep the files around, record their contents for the cache
+            outdir = RecordingSink(outdir)
+
+    app = ApplicationNotebook(notebook_filename)
+
+    generated_files = write_package(app, repo, outdir, dockerurl=dockerurl, template_dir=template_dir)
+
+    if cache is not None:
+        cache.store(cache_key, outdir.files if isinstance(outdir, RecordingSink) else generated_files)
+
+    return generated_files
+
+def _generate_package_result(notebook_filename, repo, outdir, dockerurl, template_dir, cache):
+    "Worker entry point, reports errors in the result instead of raising them"
+
+    result = PackageResult(notebook=notebook_filename, outdir=outdir)
+    try:
+        result.files = generate_package(notebook_filename, repo, outdir, dockerurl=dockerurl,
+                                        template_dir=template_dir, cache=cache)
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+        result.traceback = traceback.format_exc()
+
+    return result
+
+def generate_packages(git_mgr, outdir, dockerurl="undefined", notebooks=None, template_dir=None, max_workers=None, cache=None):
+    """Generates an application package for each notebook in a repository using a pool of processes.
+
+    Notebooks are discovered in git_mgr.directory unless given explicitly. Each notebook
+    gets its own output directory below outdir mirroring its path inside the repository.
+    A notebook that fails to parse or generate is reported in the returned BatchResult
+    without aborting the others. An optional GenerationCache is shared by all workers.
+    """
+
+    repo = RepositoryInfo.from_git_manager(git_mgr)
+
+    if notebooks is None:
+        notebooks = discover_notebooks(repo.directory)
+    else:
+        notebooks = [ os.path.abspath(os.path.join(repo.directory, nb)) for nb in notebooks ]
+
+    logger.info(f"Generating application packages for {len(notebooks)} notebooks from {repo.directory}")
+
+    batch = BatchResult()
+    if len(notebooks) == 0:
+        return batch
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = []
+        for notebook_filename in notebooks:
+            nb_outdir = notebook_outdir(outdir, repo.directory, notebook_filename)
+            futures.append((notebook_filename, nb_outdir,
+                executor.submit(_generate_package_result, notebook_filename, repo, nb_outdir, dockerurl, template_dir, cache)))
+
+        for notebook_filename, nb_outdir, future in futures:
+            try:
+                result = future.result()
+            except Exception as e:
+                # Failures of the pool itself, such as a worker process dying
+                result = PackageResult(notebook=notebook_filename, outdir=nb_outdir,
+                                       error=f"{type(e).__name__}: {e}")
+
+            if result.success:
+                logger.info(f'Generated application package for "{notebook_filename}" in {nb_outdir}')
+            else:
+                logger.error(f'Failed to generate application package for "{notebook_filename}": {result.error}')
+
+            batch.results.append(result)
+
+    return batch
@@ -0,0 +1,202 @@
+import os
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+
+from .util import FileLock
+from .output import OutputSink
+from .version import __version__
+from .loader import load_notebook
+from .application import find_parameters_cell, cell_source
+from .batch import notebook_relpath
+
+logger = logging.getLogger(__name__)
+
+LOCAL_PATH = os.path.dirname(os.path.realpath(__file__))
+
+# Default upper bound on the size of all cached packages
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Templates that package generation depends on
+TEMPLATE_FILES = ['process.cwl', 'workflow.cwl', 'stage_in.cwl', 'stage_out.cwl', 'app_desc.json']
+
+class GenerationCache(object):
+    """On-disk cache of generated application package files.
+
+    Entries are addressed by a hash of everything that determines the generated
+    output: the notebook parameters cell, the template files, the docker URL and the
+    repository attributes placed in the descriptor (including its commit identifier).
+
+    The least recently used entries are evicted once the cache grows beyond max_bytes.
+    Access is serialized through a lock file so that the same cache directory can be
+    shared by concurrent processes.
+
+    When link is True, cache hits are hard linked into the output directory instead
+    of copied. Linked files share storage with the cache and must not be modified
+    in place. Cache hits for an OutputSink are always written through the sink.
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES, link=False):
+
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.link = link
+
+        self.entries_dir = os.path.join(cache_dir, 'entries')
+        self.lock = FileLock(os.path.join(cache_dir, '.lock'))
+
+    def __getstate__(self):
+        # Locks are per process, recreate rather than pickle them
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = FileLock(os.path.join(self.cache_dir, '.lock'))
+
+    def key(self, notebook_filename, repo, dockerurl, template_dir=None):
+        "Computes the cache key for generating notebook_filename without parsing or validating it"
+
+        if template_dir is None:
+            template_dir = os.path.join(LOCAL_PATH, 'templates')
+
+        # Outputs do not affect generation, do not spend memory decoding them
+        notebook = load_notebook(notebook_filename, skip_outputs=True)
+
+        parameters_cell = find_parameters_cell(notebook)
+
+        key_data = {
+            'version': __version__,
+            'parameters': cell_source(parameters_cell) if parameters_cell is not None else None,
+            'dockerurl': dockerurl,
+            'repo': [ repo.name, repo.owner, repo.commit_identifier, repo.commit_message ],
+
+            # Named in the generated process.cwl, notebooks with the same parameters differ by their path
+            'notebook_path': notebook_relpath(notebook_filename, repo.directory),
+            'templates': {},
+        }
+
+        for template_fname in TEMPLATE_FILES:
+            template_path = os.path.join(template_dir, template_fname)
+            if os.path.exists(template_path):
+                with open(template_path, 'rb') as f:
+                    key_data['templates'][template_fname] = hashlib.sha256(f.read()).hexdigest()
+
+        return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.entries_dir, key)
+
+    def lookup(self, key, outdir):
+        """Places the cached files for key into outdir, a directory path or an OutputSink.
+
+        Returns the list of files placed into outdir (abs. path), or as identified by the
+        sink, or None on a cache miss.
+        """
+
+        entry_dir = self._entry_dir(key)
+
+        with self.lock:
+            if not os.path.isdir(entry_dir):
+                logger.debug(f"Generation cache miss for {key}")
+                return None
+
+            if isinstance(outdir, OutputSink):
+                # Read under the lock, sinks are written to once it is released
+                cached_files = {}
+                for fname in sorted(os.listdir(entry_dir)):
+                    with open(os.path.join(entry_dir, fname), 'rb') as f:
+                        cached_files[fname] = f.read()
+            else:
+                generated_files = self._place_files(entry_dir, outdir)
+
+            # Mark entry as most recently used
+            os.utime(entry_dir)
+
+        if isinstance(outdir, OutputSink):
+            generated_files = [ outdir.write(fname, data) for fname, data in cached_files.items() ]
+
+        logger.info(f"Generation cache hit for {key}, placed {len(generated_files)} files into {outdir}")
+
+        return generated_files
+
+    def _place_files(self, entry_dir, outdir):
+        "Copies or links the files of an entry into outdir, lock must be held"
+
+        if not os.path.isdir(outdir):
+            os.makedirs(outdir)
+
+        generated_files = []
+        for fname in sorted(os.listdir(entry_dir)):
+            dest_fname = os.path.join(outdir, fname)
+            if os.path.lexists(dest_fname):
+                os.remove(dest_fname)
+
+            if self.link:
+                try:
+                    os.link(os.path.join(entry_dir, fname), dest_fname)
+                except OSError:
+                    # Different filesystems
+                    shutil.copyfile(os.path.join(entry_dir, fname), dest_fname)
+            else:
+                shutil.copyfile(os.path.join(entry_dir, fname), dest_fname)
+
+            generated_files.append(os.path.abspath(dest_fname))
+
+        return generated_files
+
+    def store(self, key, generated_files):
+        """Adds generated_files to the cache under key, then evicts entries beyond the size budget.
+
+        generated_files is a list of filenames or a dictionary of filename to contents, as
+        kept by a RecordingSink.
+        """
+
+        os.makedirs(self.entries_dir, exist_ok=True)
+
+        # Stage outside of the lock, then move into place atomically
+        staging_dir = tempfile.mkdtemp(prefix='staging-', dir=self.cache_dir)
+        try:
+            if isinstance(generated_files, dict):
+                for fname, data in generated_files.items():
+                    with open(os.path.join(staging_dir, fname), 'wb') as f:
+                        f.write(data)
+            else:
+                for fname in generated_files:
+                    shutil.copyfile(fname, os.path.join(staging_dir, os.path.basename(fname)))
+
+            with self.lock:
+                if not os.path.isdir(self._entry_dir(key)):
+                    os.rename(staging_dir, self._entry_dir(key))
+                self._evict()
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+    def _entry_size(self, entry_dir):
+        return sum( os.path.getsize(os.path.join(entry_dir, fname)) for fname in os.listdir(entry_dir) )
+
+    def _evict(self):
+        "Removes least recently used entries until the cache fits within max_bytes, lock must be held"
+
+        entries = []
+        for key in os.listdir(self.entries_dir):
+            entry_dir = self._entry_dir(key)
+            entries.append((os.path.getmtime(entry_dir), self._entry_size(entry_dir), entry_dir))
+
+        total_bytes = sum( size for _, size, _ in entries )
+        for _, size, entry_dir in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+
+            logger.debug(f"Evicting generation cache entry {os.path.basename(entry_dir)}")
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total_bytes -= size
+
+    def clear(self):
+        "Removes all cached entries"
+
+        with self.lock:
+            shutil.rmtree(self.entries_dir, ignore_errors=True)
@@ -0,0 +1,253 @@
+import os
+import re
+import shutil
+import fnmatch
+import logging
+
+import attrs
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Files read by repo2docker to set up the image environment
+# https://repo2docker.readthedocs.io/en/latest/config_files.html
+REPO2DOCKER_CONFIG_FILES = [
+    'environment.yml', 'Pipfile', 'Pipfile.lock', 'requirements.txt', 'setup.py', 'Project.toml',
+    'REQUIRE', 'install.R', 'apt.txt', 'DESCRIPTION', 'manifest.xml', 'postBuild', 'start',
+    'runtime.txt', 'default.nix', 'Dockerfile',
+]
+
+# Directories that repo2docker reads configuration files from instead of the repository root
+REPO2DOCKER_CONFIG_DIRECTORIES = ['binder', '.binder']
+
+# Configuration files that make the build use the entire repository, such as setup.py being
+# installed with pip or a Dockerfile copying arbitrary files
+FULL_CONTEXT_FILES = ['setup.py', 'Dockerfile']
+
+# Never part of a minimized build context
+CONTEXT_IGNORE = ['.git', '.ipynb_checkpoints', '__pycache__', '*.pyc']
+
+# Lines of a pip requirements file including another requirements or constraints file
+REQUIREMENT_REFERENCE = re.compile(r'^(-r|--requirement|-c|--constraint)[\s=]*(?P<fname>\S+)')
+
+# Requirements installing a local directory such as the repository itself, ie ".", "-e .[dev]" or "file:.."
+LOCAL_REQUIREMENT = re.compile(r'^((-e|--editable)[\s=]*)?(\.{1,2}(/\S*)?(\[\S*\])?|file:\S+)$')
+
+# Shell commands installing a local directory with pip or running a setup.py
+LOCAL_INSTALL_COMMAND = re.compile(r'\bpip3?\s+install\b[^\n#;&|]*\s((-e|--editable)[\s=]*)?\.{1,2}(/\S*|\[\S*\])?(\s|$)|\bsetup\.py\b')
+
+# Configuration files scanned for installs of the repository itself
+INSTALL_SCANNED_FILES = ['requirements.txt', 'environment.yml', 'postBuild']
+
+# ioctl request cloning a file on Linux filesystems supporting reflinks (btrfs, xfs)
+FICLONE = 0x40049409
+
+@attrs.define
+class BuildContext(object):
+    "A build context staged from a repository along with how much it was reduced"
+
+    source_dir: str
+    context_dir: str
+
+    # Relative paths of the files in the context
+    files: list = attrs.Factory(list)
+
+    source_bytes: int = 0
+    source_files: int = 0
+    context_bytes: int = 0
+
+    # True when the configuration required keeping the entire repository
+    full_context: bool = False
+
+    @property
+    def context_files(self):
+        return len(self.files)
+
+    def summary(self):
+        return f"Build context of {self.source_dir} reduced from {self.source_bytes / 2**20:.1f} MiB in " \
+               f"{self.source_files} files to {self.context_bytes / 2**20:.1f} MiB in {self.context_files} files"
+
+def _matches(relpath, patterns):
+    "True if relpath or any of its parent directories matches one of the gitignore style patterns"
+
+    parts = relpath.split(os.sep)
+    for index in range(len(parts)):
+        prefix = "/".join(parts[:index + 1])
+        name = parts[index]
+
+        for pattern in patterns:
+            pattern = pattern.rstrip('/')
+            if fnmatch.fnmatch(prefix, pattern) or ('/' not in pattern and fnmatch.fnmatch(name, pattern)):
+                return True
+
+    return False
+
+def _walk_files(directory):
+    "Relative paths of all files and symlinks under directory along with their sizes"
+
+    for dirpath, dirnames, filenames in os.walk(directory):
+        for fname in filenames:
+            path = os.path.join(dirpath, fname)
+            try:
+                size = os.lstat(path).st_size
+            except FileNotFoundError:
+                continue
+            yield os.path.relpath(path, directory), size
+
+def _requirement_files(source_dir, requirements_fname, seen=None):
+    """Files referenced through -r and -c lines of a pip requirements file.
+
+    Returns None when the requirements install the repository itself."""
+
+    seen = set() if seen is None else seen
+    seen.add(requirements_fname)
+
+    referenced = []
+    with open(os.path.join(source_dir, requirements_fname)) as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if LOCAL_REQUIREMENT.match(line):
+                return None
+
+            match = REQUIREMENT_REFERENCE.match(line)
+            if match is None:
+                continue
+
+            target = os.path.normpath(os.path.join(os.path.dirname(requirements_fname), match.group('fname')))
+            if target in seen or not os.path.isfile(os.path.join(source_dir, target)):
+                continue
+
+            nested = _requirement_files(source_dir, target, seen)
+            if nested is None:
+                return None
+            referenced += [ target ] + nested
+
+    return referenced
+
+def _installs_repository(source_dir, config_fname):
+    "True if an environment.yml or postBuild configuration file installs the repository itself"
+
+    with open(os.path.join(source_dir, config_fname)) as f:
+        contents = f.read()
+
+    if os.path.basename(config_fname) == 'postBuild':
+        return LOCAL_INSTALL_COMMAND.search(contents) is not None
+
+    # Requirements of the pip section are list items like any other dependency
+    for line in contents.splitlines():
+        line = line.split('#', 1)[0].strip()
+        if line.startswith('-') and LOCAL_REQUIREMENT.match(line[1:].strip().strip('"\'')):
+            return True
+
+    return False
+
+def context_patterns(source_dir, notebooks=(), include=()):
+    """Patterns of the files needed to build source_dir with repo2docker.
+
+    Returns None when the entire repository is needed."""
+
+    config_dirs = [ d for d in REPO2DOCKER_CONFIG_DIRECTORIES if os.path.isdir(os.path.join(source_dir, d)) ]
+
+    # repo2docker only looks for configuration in the binder directory when there is one
+    config_paths = [ os.path.join(config_dirs[0], fname) for fname in REPO2DOCKER_CONFIG_FILES ] if config_dirs \
+                   else REPO2DOCKER_CONFIG_FILES
+
+    patterns = list(config_dirs) + list(notebooks) + list(include)
+    for config_fname in config_paths:
+        if not os.path.isfile(os.path.join(source_dir, config_fname)):
+            continue
+
+        if os.path.basename(config_fname) in FULL_CONTEXT_FILES:
+            logger.debug(f"{config_fname} requires the entire repository in the build context")
+            return None
+
+        patterns.append(config_fname)
+
+        if os.path.basename(config_fname) == 'requirements.txt':
+            referenced = _requirement_files(source_dir, config_fname)
+        elif os.path.basename(config_fname) in INSTALL_SCANNED_FILES:
+            referenced = None if _installs_repository(source_dir, config_fname) else []
+        else:
+            referenced = []
+
+        if referenced is None:
+            logger.debug(f"{config_fname} installs the repository, it is required in the build context")
+            return None
+        patterns += referenced
+
+    return patterns
+
+def _stage_file(source_fname, dest_fname):
+    "Places source_fname at dest_fname as a hard link, a reflink or a copy, in that order of preference"
+
+    if os.path.islink(source_fname):
+        os.symlink(os.readlink(source_fname), dest_fname)
+        return
+
+    try:
+        os.link(source_fname, dest_fname)
+        return
+    except OSError:
+        pass
+
+    if fcntl is not None:
+        try:
+            with open(source_fname, 'rb') as src, open(dest_fname, 'wb') as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            shutil.copystat(source_fname, dest_fname)
+            return
+        except OSError:
+            pass
+
+    shutil.copy2(source_fname, dest_fname)
+
+def prepare_build_context(source_dir, context_dir, notebooks=None, include=(), ignore=CONTEXT_IGNORE):
+    """Stages the files of source_dir needed by repo2docker into context_dir.
+
+    The context consists of the repo2docker configuration files, the notebooks (all of the
+    repository's notebooks when None) and files matching the gitignore style include patterns.
+    Files matching an ignore pattern are always left out. When the configuration needs the
+    whole repository, such as with a setup.py or requirements installing the repository
+    itself, everything but ignored files is staged.
+
+    Files are hard linked when possible, so the context costs almost no disk space.
+    """
+
+    if os.path.exists(context_dir) and len(os.listdir(context_dir)) > 0:
+        raise ValueError(f"Build context directory {context_dir} exists and is not empty")
+
+    all_files = list(_walk_files(source_dir))
+
+    if notebooks is None:
+        notebooks = [ relpath for relpath, _ in all_files if relpath.endswith('.ipynb') ]
+    else:
+        notebooks = [ os.path.relpath(os.path.join(source_dir, nb), source_dir) for nb in notebooks ]
+
+    patterns = context_patterns(source_dir, notebooks, include)
+    context = BuildContext(source_dir=source_dir, context_dir=context_dir, full_context=patterns is None)
+
+    os.makedirs(context_dir, exist_ok=True)
+    for relpath, size in all_files:
+        context.source_bytes += size
+        context.source_files += 1
+
+        if _matches(relpath, ignore):
+            continue
+        if patterns is not None and not _matches(relpath, patterns):
+            continue
+
+        dest_fname = os.path.join(context_dir, relpath)
+        os.makedirs(os.path.dirname(dest_fname), exist_ok=True)
+        _stage_file(os.path.join(source_dir, relpath), dest_fname)
+
+        context.files.append(relpath)
+        context.context_bytes += size
+
+    logger.info(context.summary())
+
+    return context
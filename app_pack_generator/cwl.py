@@ -1,18 +1,58 @@
 import os
 import re
+import posixpath
 import yaml
 import logging
 
+from .output import as_sink
+from .instrument import span
+from .template_store import load_template, copy_structure
+
+try:
+    # Use the libyaml based emitter when available, it is much faster than the pure Python one
+    from yaml import CSafeDumper as BaseDumper
+except ImportError:
+    from yaml import SafeDumper as BaseDumper
+
 logger = logging.getLogger(__name__)
 
 LOCAL_PATH = os.path.dirname(os.path.realpath(__file__))
 
+CWL_HEADER = "#!/usr/bin/env cwl-runner\n"
+
+class CWLDumper(BaseDumper):
+    "Safe YAML dumper for CWL documents, also emits tuple and set defaults as plain sequences"
+
+    def represent_set_list(self, data):
+        try:
+            data = sorted(data)
+        except TypeError:
+            data = list(data)
+        return self.represent_list(data)
+
+CWLDumper.add_representer(tuple, CWLDumper.represent_list)
+CWLDumper.add_representer(set, CWLDumper.represent_set_list)
+CWLDumper.add_representer(frozenset, CWLDumper.represent_set_list)
+
+def dump_cwl(target):
+    """Serializes [target] dictionary into the bytes of a .cwl file.
+
+    Keys are sorted so output is reproducible for the same input. Values the safe dumper
+    cannot represent fall back to the slower full dumper."""
+
+    try:
+        contents = yaml.dump(target, Dumper=CWLDumper, default_flow_style=False, sort_keys=True)
+    except yaml.representer.RepresenterError as e:
+        logger.debug(f"Using the full YAML dumper for a CWL document: {e}")
+        contents = yaml.dump(target, default_flow_style=False, sort_keys=True)
+
+    return (CWL_HEADER + contents).encode('utf-8')
+
 def write_cwl_file(fname, target):
     """Writes [target] dictionary to a .cwl file with filename [fname]."""
 
-    with open(fname, 'w', encoding='utf-8') as f:
-        f.write("#!/usr/bin/env cwl-runner\n")
-        yaml.dump(target, f, default_flow_style=False)
+    with open(fname, 'wb') as f:
+        f.write(dump_cwl(target))
 
 class CWLError(Exception):
     pass
@@ -26,12 +66,13 @@ class BaseCWL(object):
 
     def _read_template(self, app_cwl_fname):
         """Loads the template application CWL."""
-        with open(app_cwl_fname, 'r') as f:
-            return yaml.safe_load(f)
+        return load_template(app_cwl_fname)
 
     def generate_all(self, outdir, **kwargs):
         """Calls all of the application CWL generators as well as the application descriptor generator.
 
+        outdir is either a directory path or an OutputSink, such as a MemorySink, receiving the files.
+
         Returns the list of all files generated by this function (abs. path).
         """
 
@@ -39,10 +80,14 @@ class BaseCWL(object):
 
 class ProcessCWL(BaseCWL):
 
-    def __init__(self, application, **kwargs):
+    def __init__(self, application, notebook_path=None, **kwargs):
 
         super().__init__(application, **kwargs)
 
+        # Path of the notebook relative to the repository root, which is the home directory of the
+        # image built by repo2docker. When None the notebook named in the template is run.
+        self.notebook_path = notebook_path
+
         # Template CWL and descriptor files
         self.process_cwl = self._read_template( os.path.join(self.template_dir, 'process.cwl'))
 
@@ -57,11 +102,23 @@ class ProcessCWL(BaseCWL):
 
         return generated_files
 
-    def _insert_argument_params(self):
+    def _insert_notebook_path(self, process_cwl):
+        "Points the papermill command of the template at the notebook being packaged"
+
+        if self.notebook_path is None:
+            return
+
+        base_command = process_cwl['baseCommand']
+        notebook_index = base_command.index('papermill') + 1
+        image_home = posixpath.dirname(base_command[notebook_index])
+
+        base_command[notebook_index] = posixpath.join(image_home, *self.notebook_path.split(os.sep))
+
+    def _insert_argument_params(self, process_cwl):
         "Connect non stage in/out arguments to papermill parameters"
 
         # Forward the ordinary argument parameters to the process step directly
-        input_dict = self.process_cwl['inputs']
+        input_dict = process_cwl['inputs']
         for param in self.app.arguments:
             name = param.name
 
@@ -70,10 +127,10 @@ class ProcessCWL(BaseCWL):
                 'default': param.default,
             }
 
-    def _insert_input_params(self):
+    def _insert_input_params(self, process_cwl):
         "Connects the special 'input' CWL parameter to the papermill parameter for recieving the stage-in directory location"
 
-        input_dict = self.process_cwl['inputs']
+        input_dict = process_cwl['inputs']
         
         # The input Directory is carried as an input from stage_in to process to
         # make sure that the contents are exposed to the process container
@@ -85,55 +142,57 @@ class ProcessCWL(BaseCWL):
         if self.app.stage_in_param is not None:
             input_dict['input'] = 'Directory'
 
-            self.process_cwl['arguments'] = self.process_cwl.get('arguments', [])
-            self.process_cwl['arguments'] += [
+            process_cwl['arguments'] = process_cwl.get('arguments', [])
+            process_cwl['arguments'] += [
                 '-p', self.app.stage_in_param.name,
                 f'$(inputs.input.path)'
             ]
     
-    def _insert_output_params(self):
+    def _insert_output_params(self, process_cwl):
         "Connects the special 'input' CWL parameter to the papermill parameter for recieving the stage-out directory location"
 
         # Connect the stage-out parameter to the name of the file specified in the template as output
         # That value should contain a full path by using $(runtime.outdir)
-        input_dict = self.process_cwl['inputs']
+        input_dict = process_cwl['inputs']
 
         if self.app.stage_out_param is not None:
-            stage_out_process_dir = self.process_cwl['outputs']['output']['outputBinding']['glob']
+            stage_out_process_dir = process_cwl['outputs']['output']['outputBinding']['glob']
 
             if not re.search('runtime.outdir', stage_out_process_dir):
                 raise CWLError(f"The process CWL template outputs/output path needs to contain $(runtime.outdir) in the path")
 
-            self.process_cwl['arguments'] = self.process_cwl.get('arguments', [])
-            self.process_cwl['arguments'] += [
+            process_cwl['arguments'] = process_cwl.get('arguments', [])
+            process_cwl['arguments'] += [
                 '-p', self.app.stage_out_param.name, 
                 stage_out_process_dir
             ]
 
         else:
-            del self.process_cwl['outputs']['output']
+            del process_cwl['outputs']['output']
 
     def generate_process_cwl(self, outdir, dockerurl):
         """Generates the application CWL.
 
         Returns the absolute path of the file generated by this function.
         """
-        if not os.path.isdir(outdir):
-            os.makedirs(outdir)
+
+        # Work on a copy so the template stays untouched and generation can be repeated
+        process_cwl = copy_structure(self.process_cwl)
 
         # Set correct URL for process Docker container
-        self.process_cwl['requirements']['DockerRequirement']['dockerPull'] = dockerurl
+        process_cwl['requirements']['DockerRequirement']['dockerPull'] = dockerurl
+
+        self._insert_notebook_path(process_cwl)
 
         # Forward the ordinary argument parameters to the process step directly
-        self._insert_argument_params()
+        self._insert_argument_params(process_cwl)
         
         # Handle input and output parameters and their connection to papermill arguments
-        self._insert_input_params()
-        self._insert_output_params()
+        self._insert_input_params(process_cwl)
+        self._insert_output_params(process_cwl)
 
-        fname = os.path.join(outdir, 'process.cwl')
-        write_cwl_file(fname, self.process_cwl)
-        return fname
+        with span('cwl.emit', document='process.cwl'):
+            return as_sink(outdir).write('process.cwl', dump_cwl(process_cwl))
 
 
 class DataStagingCWL(BaseCWL):
@@ -167,11 +226,14 @@ class DataStagingCWL(BaseCWL):
         Returns the absolute path of the file generated by this function.
         """
 
+        # Work on a copy so the template stays untouched and generation can be repeated
+        workflow_cwl = copy_structure(self.workflow_cwl)
+
         # Preocess step section of of workflow
-        process_dict = self.workflow_cwl['steps']['process']
+        process_dict = workflow_cwl['steps']['process']
 
         # Add non stage-in/stage-out inputs to the master CWL input/outputs as parameters
-        args_input_dict = self.workflow_cwl['inputs']['parameters']['type']['fields']
+        args_input_dict = workflow_cwl['inputs']['parameters']['type']['fields']
         for param in self.app.arguments:
             name = param.name
 
@@ -191,42 +253,33 @@ class DataStagingCWL(BaseCWL):
             process_dict['in']['input'] = 'stage_in/stage_in_download_dir'
         else:
             # No stage-in connected to notebook, delete
-            del self.workflow_cwl['steps']['stage_in']
-            del self.workflow_cwl['inputs']['stage_in']
+            del workflow_cwl['steps']['stage_in']
+            del workflow_cwl['inputs']['stage_in']
 
         # Remove stage-out if not defined in the notebook
         # The connection of the parameter given to the notebook is done inside the process.cwl
         if self.app.stage_out_param is None:
-            del self.workflow_cwl['steps']['stage_out']
-            del self.workflow_cwl['inputs']['stage_out']
-            del self.workflow_cwl['outputs']['stage_out_results']
+            del workflow_cwl['steps']['stage_out']
+            del workflow_cwl['inputs']['stage_out']
+            del workflow_cwl['outputs']['stage_out_results']
 
-        fname = os.path.join(outdir, 'workflow.cwl')
-        write_cwl_file(fname, self.workflow_cwl)
-        return fname
+        with span('cwl.emit', document='workflow.cwl'):
+            return as_sink(outdir).write('workflow.cwl', dump_cwl(workflow_cwl))
  
     def generate_stage_in_cwl(self, outdir):
         """Generates the stage-in CWL.
 
         Returns the absolute path of the file generated by this function.
         """
-        if not os.path.isdir(outdir):
-            os.makedirs(outdir)
-
         # Generate the stage-in CWL as is, no need for modification
-        fname = os.path.join(outdir, 'stage_in.cwl')
-        write_cwl_file(fname, self.stage_in_cwl)
-        return fname
+        with span('cwl.emit', document='stage_in.cwl'):
+            return as_sink(outdir).write('stage_in.cwl', dump_cwl(self.stage_in_cwl))
     
     def generate_stage_out_cwl(self, outdir):
         """Generates the stage-in CWL.
 
         Returns the absolute path of the file generated by this function.
         """
-        if not os.path.isdir(outdir):
-            os.makedirs(outdir)
-
         # Generate the outputs CWL as-is, no need for modifications
-        fname = os.path.join(outdir, 'stage_out.cwl')
-        write_cwl_file(fname, self.stage_out_cwl)
-        return fname
\ No newline at end of file
+        with span('cwl.emit', document='stage_out.cwl'):
+            return as_sink(outdir).write('stage_out.cwl', dump_cwl(self.stage_out_cwl))
\ No newline at end of file
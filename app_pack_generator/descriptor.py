@@ -2,10 +2,19 @@ import os
 import json
 import logging
 
+from .output import as_sink
+from .instrument import span
+from .template_store import load_template, copy_structure
+
 logger = logging.getLogger(__name__)
 
 LOCAL_PATH = os.path.dirname(os.path.realpath(__file__))
 
+def dump_descriptor(descriptor):
+    "Serializes an application descriptor dictionary into the bytes of a JSON file"
+
+    return json.dumps(descriptor, ensure_ascii=False, indent=4).encode('utf-8')
+
 class Descriptor(object):
 
     def __init__(self, application, repo, templatedir=os.path.join(LOCAL_PATH, 'templates')):
@@ -19,26 +28,26 @@ class Descriptor(object):
         """Loads the template application descriptor and should validate it to
         ensure an exception is not thrown.
         """
-        with open(desc_fname, 'r') as f:
-            return json.load(f)
+        return load_template(desc_fname)
 
     def generate_descriptor(self, outdir, dockerurl):
         """Generates the application descriptor JSON.
 
+        outdir is either a directory path or an OutputSink receiving the file.
+
         Returns the absolute  path of the file generated by this function.
         """
-        if not os.path.isdir(outdir):
-            os.makedirs(outdir)
         deposit_url = 'https://raw.githubusercontent.com/jplzhan/artifact-deposit-repo'
         tag = self.repo.name
-        proc_dict = self.descriptor['processDescription']['process']
-
-        if self.repo.owner is not None:
-            proc_dict['id'] = self.repo.owner + '.' + \
-                self.repo.name + '.' + self.repo.commit_identifier
-        else:
-            proc_dict['id'] = self.repo.name + '.' + self.repo.commit_identifier
- 
+
+        # Work on a copy so the template stays untouched and generation can be repeated
+        descriptor = copy_structure(self.descriptor)
+        proc_dict = descriptor['processDescription']['process']
+
+        # Owner and commit are left out of the id when unknown
+        id_parts = [ self.repo.owner, self.repo.name, self.repo.commit_identifier ]
+        proc_dict['id'] = '.'.join([ part for part in id_parts if part is not None ])
+
         proc_dict['title'] = self.repo.commit_message
         proc_dict['owsContext']['offering']['content']['href'] = deposit_url + \
             '/main/' + tag + '/workflow.cwl'
@@ -71,9 +80,7 @@ class Descriptor(object):
                 }
             })
 
-        self.descriptor['executionUnit'][0]['href'] = 'docker://' + dockerurl
+        descriptor['executionUnit'][0]['href'] = 'docker://' + dockerurl
 
-        fname = os.path.join(outdir, 'applicationDescriptor.json')
-        with open(fname, 'w', encoding='utf-8') as f:
-            json.dump(self.descriptor, f, ensure_ascii=False, indent=4)
-        return fname
+        with span('descriptor.emit'):
+            return as_sink(outdir).write('applicationDescriptor.json', dump_descriptor(descriptor))
@@ -1,30 +1,378 @@
 import os
+import re
+import json
+import time
+import attrs
+import fnmatch
+import shutil
+import hashlib
 import requests
 import logging
+import tempfile
 import subprocess
+import collections
+import concurrent.futures
 
 import docker
 
-from .util import Util
+from .util import Util, FileLock
+from .instrument import span
+from .context import prepare_build_context, CONTEXT_IGNORE
+from .registry import RegistryClient, RegistryError
+from .archive import ArchiveManifest, ArchiveError, ARCHIVE_CHUNK_SIZE
+from .archive import write_archive, load_archive, manifest_filename
 
 # Default from docker-py is 60 seconds
 # This was found to be to small when dealing with pushing large images to remote repos like ECR
 DOCKER_CLIENT_TIMEOUT = 600
 
+# Number of registries pushed to at the same time by push_images
+DEFAULT_PUSH_WORKERS = 4
+
+# Arguments that determine how repo2docker builds the image, other than the repository contents
+REPO2DOCKER_ARGS = ['--user-id', '1000', '--user-name', 'jovyan']
+
+# Image label holding the content key an image was built from
+CONTENT_KEY_LABEL = 'app_pack_generator.content_key'
+
+# Image label marking images built by this library, only these are evicted by a PrunePolicy
+GENERATED_LABEL = 'app_pack_generator.generated'
+
+# Images used more recently than this many seconds are never evicted by a PrunePolicy
+DEFAULT_PROTECT_SECONDS = 3600
+
+# Repository files that do not affect the built application image in a meaningful way
+CONTENT_KEY_IGNORE = ['*.md', '*.rst', 'docs/*', 'doc/*', 'LICENSE*', '.github/*', '.gitignore']
+
+# Build steps as printed by the classic Docker builder ("Step 3/52 : RUN ...") and BuildKit ("#7 [ 3/36] RUN ...")
+_BUILD_STEP = r'^(Step \d+/\d+ :|#\d+ \[\s*\d+/\d+\])'
+
+# Build phases recognized in repo2docker output, in the order they occur during a build.
+# A phase starts with the first line matching its pattern and lasts until the next phase starts.
+# Patterns are anchored to builder output, with --debug repo2docker first prints the rendered
+# Dockerfile which mentions conda and pip throughout.
+BUILD_PHASES = [
+    ('fetch_base_image', re.compile(_BUILD_STEP + r' FROM |^#\d+ \[internal\] load metadata for |^[\w.-]+: Pulling from ')),
+    ('install_environment', re.compile(_BUILD_STEP + r' RUN .*(conda|mamba|pip|install-base-env)')),
+    ('commit_layers', re.compile(r'^Successfully built |^Successfully tagged |^#\d+ exporting to image')),
+]
+
+# Phase name used for output preceding the first recognized phase
+INITIAL_BUILD_PHASE = 'prepare'
+
+# Number of output lines kept for reporting build failures
+BUILD_TAIL_LINES = 200
+
 logger = logging.getLogger(__name__)
 
+@attrs.define
+class BuildEvent(object):
+    "A line of build output along with the build phase it belongs to"
+
+    line: str
+    phase: str
+
+    # Seconds since the build started
+    elapsed: float
+
+class DockerBuildError(subprocess.CalledProcessError):
+    "Raised when an image build fails, output holds the tail of the build log"
+
+    def __init__(self, returncode, cmd, output=None, phase_times=None):
+        super().__init__(returncode, cmd, output=output)
+        self.phase_times = phase_times if phase_times is not None else {}
+
+class StreamingBuild(object):
+    """Runs a build command, streaming its output line by line as BuildEvent objects.
+
+    Wall clock time spent in each build phase is recorded in phase_times. Only the last
+    tail_lines lines of output are retained, they are attached to the DockerBuildError
+    raised if the command fails.
+    """
+
+    def __init__(self, cmd, phases=BUILD_PHASES, tail_lines=BUILD_TAIL_LINES):
+        self.cmd = cmd
+        self.phases = phases
+        self.tail = collections.deque(maxlen=tail_lines)
+        self.phase_times = {}
+
+    def _next_phase(self, line, phase_index):
+        "Phases only ever advance, returns the index of the phase line belongs to"
+
+        for index in range(phase_index + 1, len(self.phases)):
+            if self.phases[index][1].search(line):
+                return index
+        return phase_index
+
+    def __iter__(self):
+        start_time = time.perf_counter()
+        phase_index = -1
+        phase_name = INITIAL_BUILD_PHASE
+        phase_start = start_time
+
+        proc = subprocess.Popen(self.cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                universal_newlines=True, bufsize=1)
+        try:
+            for line in proc.stdout:
+                line = line.rstrip('\n')
+                self.tail.append(line)
+
+                new_index = self._next_phase(line, phase_index)
+                if new_index != phase_index:
+                    now = time.perf_counter()
+                    self.phase_times[phase_name] = self.phase_times.get(phase_name, 0.0) + now - phase_start
+                    phase_index, phase_name, phase_start = new_index, self.phases[new_index][0], now
+
+                yield BuildEvent(line=line, phase=phase_name, elapsed=time.perf_counter() - start_time)
+
+            returncode = proc.wait()
+        finally:
+            # Do not leave the build running if the consumer stops early
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+            proc.stdout.close()
+
+        now = time.perf_counter()
+        self.phase_times[phase_name] = self.phase_times.get(phase_name, 0.0) + now - phase_start
+
+        if returncode != 0:
+            raise DockerBuildError(returncode, self.cmd, output="\n".join(self.tail), phase_times=self.phase_times)
+
+    def run(self, progress_callback=None):
+        "Runs the build to completion, passing each BuildEvent to progress_callback. Returns phase_times."
+
+        for event in self:
+            if progress_callback is not None:
+                progress_callback(event)
+
+        return self.phase_times
+
+@attrs.define
+class PushResult(object):
+    "Outcome of pushing an image to a single registry"
+
+    registry_url: str
+    destination: str
+    error: str = None
+    seconds: float = 0.0
+
+    # True when the registry already held the same image so nothing was pushed
+    skipped: bool = False
+
+    # Part of seconds spent checking the registry for the image
+    check_seconds: float = 0.0
+
+    @property
+    def success(self):
+        return self.error is None
+
+    @property
+    def status(self):
+        if self.error is not None:
+            return 'failed'
+        return 'skipped' if self.skipped else 'pushed'
+
+class DockerPushError(Exception):
+    "Raised when pushing to one or more registries failed, results holds a PushResult per registry"
+
+    def __init__(self, message, results):
+        super().__init__(message)
+        self.results = results
+
+class PrunePolicy(object):
+    """Keeps the disk space used by Docker images under a byte budget without discarding the build cache.
+
+    Only images labeled as built by this library are evicted, least recently used first, and
+    only while the total image footprint exceeds max_bytes. Base images and any other images
+    are never removed. Images used within the last protect_seconds, or with a tag matching
+    one of the protect patterns, are kept as well.
+
+    Image usage is recorded through touch() and persisted to state_file when given, so that
+    it can be shared between processes on the same builder. Images without recorded usage
+    are ordered by creation time.
+    """
+
+    def __init__(self, max_bytes, protect=(), protect_seconds=DEFAULT_PROTECT_SECONDS, state_file=None):
+
+        self.max_bytes = max_bytes
+        self.protect = list(protect)
+        self.protect_seconds = protect_seconds
+        self.state_file = state_file
+
+        self._last_used = {}
+        self._lock = FileLock(state_file + '.lock') if state_file is not None else None
+
+    def _load_state(self):
+        if self.state_file is not None and os.path.exists(self.state_file):
+            with open(self.state_file, 'r') as f:
+                self._last_used = json.load(f)
+        return self._last_used
+
+    def _save_state(self):
+        if self.state_file is not None:
+            tmp_fname = self.state_file + '.tmp'
+            with open(tmp_fname, 'w') as f:
+                json.dump(self._last_used, f)
+            os.replace(tmp_fname, self.state_file)
+
+    def touch(self, image_id):
+        "Records that an image was just built or used"
+
+        if self._lock is not None:
+            with self._lock:
+                self._load_state()
+                self._last_used[image_id] = time.time()
+                self._save_state()
+        else:
+            self._last_used[image_id] = time.time()
+
+    def _is_protected(self, image_info, last_used, now):
+
+        if now - last_used < self.protect_seconds:
+            return True
+
+        for repo_tag in image_info.get('RepoTags') or []:
+            if any(fnmatch.fnmatch(repo_tag, pattern) for pattern in self.protect):
+                return True
+
+        return False
+
+    def enforce(self, docker_client):
+        """Removes stopped containers and dangling images, then evicts generated images until
+        the image footprint fits within max_bytes.
+
+        Returns the list of evicted image ids.
+        """
+
+        docker_client.containers.prune()
+        docker_client.images.prune()
+
+        usage = docker_client.df()
+        total_bytes = usage.get('LayersSize') or 0
+        if total_bytes <= self.max_bytes:
+            return []
+
+        if self._lock is not None:
+            with self._lock:
+                last_used = dict(self._load_state())
+        else:
+            last_used = dict(self._last_used)
+
+        now = time.time()
+        candidates = []
+        for image_info in usage.get('Images') or []:
+            if GENERATED_LABEL not in (image_info.get('Labels') or {}):
+                continue
+
+            image_last_used = last_used.get(image_info['Id'], image_info.get('Created', 0))
+            if not self._is_protected(image_info, image_last_used, now):
+                candidates.append((image_last_used, image_info))
+
+        evicted = []
+        for _, image_info in sorted(candidates, key=lambda c: c[0]):
+            if total_bytes <= self.max_bytes:
+                break
+
+            logger.info(f"Evicting image {image_info['Id']} {image_info.get('RepoTags')} to stay within Docker disk budget")
+            try:
+                docker_client.images.remove(image_info['Id'], force=True)
+            except docker.errors.APIError as e:
+                logger.error(f"Could not evict image {image_info['Id']}: {e}")
+                continue
+
+            # Layers shared with other images are not freed
+            shared_bytes = max(image_info.get('SharedSize', 0), 0)
+            total_bytes -= image_info.get('Size', 0) - shared_bytes
+            evicted.append(image_info['Id'])
+
+        if total_bytes > self.max_bytes:
+            logger.warning(f"Docker images use {total_bytes} bytes, above the budget of {self.max_bytes} bytes, after evicting all candidates")
+
+        return evicted
+
+def content_key(git_mgr, repo_config=None, ignore=CONTENT_KEY_IGNORE, build_options=None):
+    """Computes a hash identifying the contents of a repo2docker build.
+
+    The key covers the files of the checked out commit's git tree, except those matching
+    an ignore pattern, the repo2docker arguments and the contents of the local repo2docker
+    configuration file if any. Uncommitted changes are not taken into account.
+
+    build_options is a string describing any other option changing the built image.
+    """
+
+    digest = hashlib.sha256()
+    digest.update(" ".join(REPO2DOCKER_ARGS).encode('utf-8') + b"\n")
+    if build_options is not None:
+        digest.update(b"options " + build_options.encode('utf-8') + b"\n")
+
+    for item in git_mgr.repo.head.commit.tree.traverse():
+        # Trees are covered by the paths of their contents
+        if item.type == 'tree':
+            continue
+
+        if any(fnmatch.fnmatch(item.path, pattern) for pattern in ignore):
+            continue
+
+        digest.update(f"{item.mode:o} {item.hexsha} {item.path}\n".encode('utf-8'))
+
+    if repo_config is not None:
+        with open(repo_config, 'rb') as f:
+            digest.update(b"config\n" + f.read())
+
+    return digest.hexdigest()
+
 class DockerUtil:
 
-    def __init__(self, git_mgr, repo_config=None, do_prune=True, use_namespace=None, use_repository=None, use_tag=None):
+    def __init__(self, git_mgr, repo_config=None, do_prune=True, use_namespace=None, use_repository=None, use_tag=None,
+                 use_content_key=False, content_key_ignore=CONTENT_KEY_IGNORE, cache_registry=None, docker_client=None,
+                 prune_policy=None, minimize_context=False, context_notebooks=None, context_include=(),
+                 context_ignore=CONTEXT_IGNORE, context_dir=None, downloader=None, registry_client=None):
         self.git_mgr = git_mgr
         self.repo_config = repo_config
+
+        # download.Downloader used to fetch a repo_config given as a URL, the shared one when None
+        self.downloader = downloader
+
+        # registry.RegistryClient used to check whether registries already hold an image before pushing
+        self.registry_client = registry_client if registry_client is not None else RegistryClient()
+
+        # With a PrunePolicy, pruning keeps the image footprint within a budget instead of
+        # removing everything that is not in use
         self.do_prune = do_prune
+        self.prune_policy = prune_policy
+
+        # When enabled, builds are skipped if an image built from the same content already exists
+        # locally or optionally in the cache_registry
+        self.use_content_key = use_content_key
+        self.content_key_ignore = content_key_ignore
+        self.cache_registry = cache_registry
+        self._content_key = None
 
         self.use_namespace = use_namespace
         self.use_repository = use_repository
         self.use_tag = use_tag
 
-        self.docker_client = docker.from_env(timeout=DOCKER_CLIENT_TIMEOUT)
+        # When enabled, only the files needed by repo2docker are staged into a separate build
+        # context instead of sending the whole repository to the Docker daemon, see
+        # context.prepare_build_context. Staging happens under context_dir, by default next to
+        # the repository so files can be hard linked.
+        self.minimize_context = minimize_context
+        self.context_notebooks = context_notebooks
+        self.context_include = context_include
+        self.context_ignore = context_ignore
+        self.context_dir = context_dir
+
+        # Seconds spent in each phase of the last repo2docker build
+        self.build_phase_times = {}
+
+        # BuildContext of the last build when minimize_context is enabled
+        self.build_context = None
+
+        if docker_client is not None:
+            self.docker_client = docker_client
+        else:
+            self.docker_client = docker.from_env(timeout=DOCKER_CLIENT_TIMEOUT)
 
     @property
     def image_namespace(self):
@@ -74,82 +422,230 @@ class DockerUtil:
         HOST:PORT are added in push_image
         """
 
+        return f"{self.image_name}:{self.image_tag}"
+
+    @property
+    def image_name(self):
+        "Image reference without the tag portion"
+
         if self.image_namespace is not None and self.image_namespace != "":
-            return f"{self.image_namespace}/{self.image_repository}:{self.image_tag}"
+            return f"{self.image_namespace}/{self.image_repository}"
         else:
-            return f"{self.image_repository}:{self.image_tag}"
+            return self.image_repository
+
+    @property
+    def content_key(self):
+        "Hash of the repository content and configuration the image is built from"
+
+        if self._content_key is None:
+            build_options = None
+            if self.minimize_context:
+                build_options = json.dumps([ self.context_notebooks, list(self.context_include), list(self.context_ignore) ])
 
-    def repo2docker(self):
+            self._content_key = content_key(self.git_mgr, self._local_repo_config(), ignore=self.content_key_ignore,
+                                            build_options=build_options)
+
+        return self._content_key
+
+    @property
+    def content_image_reference(self):
+        "Image reference with a tag derived from the content key, used to share builds through a registry"
+
+        return f"{self.image_name}:content-{self.content_key}"
+
+    def _local_repo_config(self):
+        "Returns the path to the repo2docker config file, downloading it first if it is a URL"
+
+        if self.repo_config is None:
+            return None
+
+        # If the repo2docker config file does not exist inside the repo already, assume it is a URL
+        # and try to download it
+        if not os.path.exists(self.repo_config):
+            repo_config_local = os.path.join(self.git_mgr.directory, os.path.basename(self.repo_config))
+
+            response = Util.DownloadLink(self.repo_config, downloader=self.downloader)
+            if response is not None:
+                with open(os.path.join(repo_config_local), 'w') as f:
+                    f.write(response.text)
+            else:
+                msg = 'Failed to download the specified configuration file: ' + self.repo_config
+                raise RuntimeError(msg)
+        else:
+            repo_config_local = self.repo_config
+
+        return repo_config_local
+
+    def find_content_image(self):
+        """Looks for an image already built from the same content key.
+
+        Checks the local daemon for an image labeled with the content key, then the
+        cache_registry if one was supplied. Returns the image or None if none was found.
+        """
+
+        images = self.docker_client.images.list(filters={'label': f"{CONTENT_KEY_LABEL}={self.content_key}"})
+        if len(images) > 0:
+            logger.info(f"Found local image {images[0].short_id} built from content key {self.content_key}")
+            return images[0]
+
+        if self.cache_registry is not None:
+            registry_reference = f"{self.cache_registry}/{self.content_image_reference}"
+            try:
+                image = self.docker_client.images.pull(registry_reference)
+            except docker.errors.APIError as e:
+                logger.debug(f"No image found for {registry_reference}: {e}")
+                return None
+
+            if image.labels.get(CONTENT_KEY_LABEL) == self.content_key:
+                logger.info(f"Pulled {registry_reference} built from content key {self.content_key}")
+                return image
+
+        return None
+
+    def repo2docker(self, progress_callback=None):
         """Calls repo2docker on the local git directory to generate the Docker image.
 
-        No further modifications are made to the docker image.
+        Build output is logged as it is produced and each line is passed to the optional
+        progress_callback as a BuildEvent. No further modifications are made to the docker image.
         """
 
-        # Prune all dangling containers and images to reclaim space and prevent cache usage.
+        # Prune all dangling containers and images to reclaim space and prevent cache usage,
+        # a prune policy instead keeps the build cache within its disk budget
         if self.do_prune:
-            try:
-                self.docker_client.containers.prune()
-                self.docker_client.images.prune()
-            except requests.exceptions.ReadTimeout as e:
-                logger.error('An error occurred while pruning: {}'.format(e.what()))
+            self._prune()
 
         logger.info(f"Building Docker image named {self.image_reference}")
 
         # Build initial repo2docker command line arguments
-        cmd = ['jupyter-repo2docker', '--user-id', '1000', '--user-name', 'jovyan',
-               '--no-run', '--debug', '--image-name', self.image_reference]
-
-        if self.repo_config is not None:
-            # If the repo2docker config file does not exist inside the repo already, assume it is a URL
-            # and try to download it
-            if not os.path.exists(self.repo_config):
-                repo_config_local = os.path.join(self.git_mgr.directory, os.path.basename(self.repo_config))
-
-                response = Util.DownloadLink(self.repo_config)
-                if response is not None:
-                    with open(os.path.join(repo_config_local), 'w') as f:
-                        f.write(response.text)
-                else:
-                    msg = 'Failed to download the specified configuration file: ' + self.repo_config
-                    raise RuntimeError(msg)
-            else:
-                repo_config_local = self.repo_config
+        cmd = ['jupyter-repo2docker'] + REPO2DOCKER_ARGS + \
+              ['--no-run', '--debug', '--image-name', self.image_reference]
 
+        repo_config_local = self._local_repo_config()
+        if repo_config_local is not None:
             cmd += ['--config', repo_config_local]
 
+        cmd += ['--label', f"{GENERATED_LABEL}=true"]
+        if self.use_content_key:
+            cmd += ['--label', f"{CONTENT_KEY_LABEL}={self.content_key}"]
+
+        staging_dir = None
+        build_dir = self.git_mgr.directory
+        if self.minimize_context:
+            staging_dir = self._prepare_context()
+            build_dir = staging_dir
+
         # The repository must be the last argument to repo2docker
-        cmd += [self.git_mgr.directory]
+        cmd += [build_dir]
 
         #, self.git_mgr.directory]
         logger.debug("Executing repo2docker with command line:")
         logger.debug(" ".join(cmd))
 
-        try:
-            r2d_output = subprocess.check_output(cmd, stderr=subprocess.STDOUT, universal_newlines=True)
-            logger.debug(r2d_output)
-        except subprocess.CalledProcessError as exc:
-            logger.error(exc.output)
-            raise exc
+        def log_progress(event):
+            logger.debug(event.line)
+            if progress_callback is not None:
+                progress_callback(event)
+
+        build = StreamingBuild(cmd)
+        with span('docker.repo2docker', image=self.image_reference) as build_span:
+            try:
+                self.build_phase_times = build.run(log_progress)
+            except DockerBuildError as exc:
+                self.build_phase_times = exc.phase_times
+                logger.error(exc.output)
+                raise exc
+            finally:
+                if build_span is not None:
+                    build_span.attributes['phase_times'] = self.build_phase_times
+
+                if staging_dir is not None:
+                    shutil.rmtree(staging_dir, ignore_errors=True)
+
+        logger.info("repo2docker phase times: " +
+            ", ".join([ f"{phase}: {seconds:.1f}s" for phase, seconds in self.build_phase_times.items() ]))
+
+        if self.use_content_key or self.prune_policy is not None:
+            image = self.docker_client.images.get(self.image_reference)
+
+            if self.use_content_key:
+                image.tag(self.image_name, f"content-{self.content_key}")
+
+                if self.cache_registry is not None:
+                    self._push_content_image(image)
+
+            if self.prune_policy is not None:
+                self.prune_policy.touch(image.id)
 
         return self.image_reference
 
-    def build_image(self):
-        "Use instead of calling the repo2docker function since it could possibly be deprecated in the future"
+    def _push_content_image(self, image):
+        "Shares a new build through the cache_registry under its content key tag, failures only cost the reuse"
 
-        return self.repo2docker()
+        destination = self._tag_for_registry(image, self.cache_registry, self.content_image_reference)
 
-    def push_image(self, registry_url, image_reference=None):
-        "Pushes the Docker image created by the build_image command into a remote registry with an optional different image reference string"
+        result = self._push_tagged(PushResult(registry_url=self.cache_registry, destination=destination),
+                                   self.content_image_reference, image, skip_existing=True)
+        if not result.success:
+            logger.warning(f"Could not share the build through the cache registry: {result.error}")
 
-        if image_reference is None:
-            image_reference = self.image_reference
+    def _prepare_context(self):
+        "Stages a minimized build context for the repository, returns its directory"
 
-        # Save the newly created image to a tarball if the build succeeded.
-        image = self.docker_client.images.get(image_reference)
+        repo_dir = os.path.abspath(self.git_mgr.directory)
+        parent_dir = self.context_dir if self.context_dir is not None else os.path.dirname(repo_dir)
+        os.makedirs(parent_dir, exist_ok=True)
 
-        reg_image_dest = f"{registry_url}/{image_reference}"
+        staging_dir = tempfile.mkdtemp(prefix=f".{os.path.basename(repo_dir)}-context-", dir=parent_dir)
+        try:
+            with span('docker.context', source=repo_dir) as context_span:
+                self.build_context = prepare_build_context(repo_dir, staging_dir, notebooks=self.context_notebooks,
+                    include=self.context_include, ignore=self.context_ignore)
+
+                if context_span is not None:
+                    context_span.attributes.update(source_bytes=self.build_context.source_bytes,
+                                                   context_bytes=self.build_context.context_bytes)
+        except BaseException:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+
+        return staging_dir
+
+    def build_image(self, progress_callback=None):
+        """Use instead of calling the repo2docker function since it could possibly be deprecated in the future
+
+        When use_content_key is enabled, an existing image built from the same content is
+        tagged as image_reference instead of building a new one."""
+
+        if self.use_content_key:
+            image = self.find_content_image()
+            if image is not None:
+                logger.info(f"Reusing image {image.short_id} as {self.image_reference}")
+                image.tag(self.image_name, self.image_tag)
 
-        logger.info(f"Pushing {image_reference} to {reg_image_dest}")
+                if self.prune_policy is not None:
+                    self.prune_policy.touch(image.id)
+                return self.image_reference
+
+        return self.repo2docker(progress_callback=progress_callback)
+
+    def _prune(self):
+        "Prune all dangling containers and images to reclaim space, or apply the prune policy if set"
+
+        with span('docker.prune', policy=self.prune_policy is not None):
+            try:
+                if self.prune_policy is not None:
+                    self.prune_policy.enforce(self.docker_client)
+                    return
+
+                self.docker_client.containers.prune()
+                self.docker_client.images.prune()
+            except requests.exceptions.ReadTimeout as e:
+                logger.error('An error occurred while pruning: {}'.format(e))
+
+    def _tag_for_registry(self, image, registry_url, image_reference):
+        "Tags image for pushing to registry_url, returns the registry image reference"
+
+        reg_image_dest = f"{registry_url}/{image_reference}"
 
         # Use two argument call to .tag() per the API documentation
         # The Docker API is more lenient that Podman and will
@@ -166,17 +662,196 @@ class DockerUtil:
         else:
             image.tag(reg_image_dest)
 
-        for line in self.docker_client.images.push(reg_image_dest, stream=True, decode=True):
-            logger.info(line)
-            if 'errorDetail' in line:
-                raise Exception(f"Error pushing {image_reference} to {reg_image_dest}:" + line['errorDetail']['message'])
+        return reg_image_dest
 
-        if self.do_prune:
-            self.docker_client.images.remove(image.id, force=True)
-            try:
-                self.docker_client.containers.prune()
-                self.docker_client.images.prune()
-            except requests.exceptions.ReadTimeout as e:
-                logger.error('An error occurred while pruning: {}'.format(e.what()))
+    def registry_has_image(self, image, destination):
+        """True if the registry already holds image under the destination reference.
+
+        The digest of the remote manifest is compared with the digests the image was pushed
+        with before, then the remote image configuration with the image id. Registries that
+        can not be asked are treated as not holding the image.
+        """
+
+        try:
+            remote_digest = self.registry_client.manifest_digest(destination)
+            if remote_digest is None:
+                return False
+
+            local_digests = [ repo_digest.partition('@')[2] for repo_digest in image.attrs.get('RepoDigests') or [] ]
+            if remote_digest in local_digests or remote_digest == image.id:
+                return True
+
+            return self.registry_client.config_digest(destination) == image.id
+        except (RegistryError, requests.exceptions.RequestException, ValueError) as e:
+            logger.warning(f"Could not check whether {destination} already exists, pushing it: {e}")
+            return False
+
+    def _push_tagged(self, result, image_reference, image=None, skip_existing=False):
+        "Pushes an already tagged image, recording the outcome in result"
+
+        start_time = time.perf_counter()
+        with span('docker.push', destination=result.destination) as push_span:
+            if skip_existing and image is not None:
+                result.skipped = self.registry_has_image(image, result.destination)
+                result.check_seconds = time.perf_counter() - start_time
+
+            if push_span is not None:
+                push_span.attributes['skipped'] = result.skipped
+
+            if result.skipped:
+                logger.info(f"Skipping push of {image_reference}, {result.destination} already holds the same image")
+            else:
+                logger.info(f"Pushing {image_reference} to {result.destination}")
+
+                try:
+                    for line in self.docker_client.images.push(result.destination, stream=True, decode=True):
+                        logger.info(line)
+                        if 'errorDetail' in line:
+                            result.error = f"Error pushing {image_reference} to {result.destination}:" + line['errorDetail']['message']
+                            break
+                except (docker.errors.APIError, requests.exceptions.RequestException) as e:
+                    result.error = f"Error pushing {image_reference} to {result.destination}: {e}"
+
+            if push_span is not None and result.error is not None:
+                push_span.error = 'DockerPushError'
+
+        result.seconds = time.perf_counter() - start_time
+
+        return result
+
+    def push_images(self, registry_urls, image_reference=None, max_workers=DEFAULT_PUSH_WORKERS, raise_on_error=True,
+                    skip_existing=False):
+        """Pushes the Docker image created by the build_image command into several remote registries concurrently.
+
+        The image is tagged once per registry, then at most max_workers pushes run at the same time.
+        With skip_existing, registries already holding the same image under the reference are not
+        pushed to again. Cleanup of the image when do_prune is set only happens once every push has
+        finished successfully.
+
+        Returns a list of PushResult, one per registry. If any push failed a DockerPushError holding
+        the results is raised unless raise_on_error is False.
+        """
+
+        if image_reference is None:
+            image_reference = self.image_reference
+
+        image = self.docker_client.images.get(image_reference)
+
+        results = []
+        for registry_url in registry_urls:
+            reg_image_dest = self._tag_for_registry(image, registry_url, image_reference)
+            results.append(PushResult(registry_url=registry_url, destination=reg_image_dest))
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(lambda result: self._push_tagged(result, image_reference, image, skip_existing), results))
+
+        for result in results:
+            logger.info(f"{result.destination}: {result.status} in {result.seconds:.1f} seconds")
+
+        failures = [ r for r in results if not r.success ]
+
+        if self.do_prune and len(failures) == 0:
+            if self.prune_policy is not None:
+                # Keep the pushed image around for reuse, the policy evicts it when space is needed
+                self.prune_policy.touch(image.id)
+            else:
+                self.docker_client.images.remove(image.id, force=True)
+            self._prune()
+
+        if len(failures) > 0 and raise_on_error:
+            raise DockerPushError("\n".join([ r.error for r in failures ]), results)
+
+        return results
+
+    def push_image(self, registry_url, image_reference=None, skip_existing=False):
+        "Pushes the Docker image created by the build_image command into a remote registry with an optional different image reference string"
+
+        return self.push_images([registry_url], image_reference=image_reference, skip_existing=skip_existing)[0].destination
+
+    def export_image(self, output, image_reference=None, compression='gzip', manifest_fname=None):
+        """Saves the Docker image created by the build_image command as a docker-archive tarball,
+        for moving images into venues without access to a registry.
+
+        output is a filename or a binary file object. Chunks returned by the Docker daemon are
+        compressed with gzip, zstd or not at all and written as they arrive, so the image is never
+        held in memory. The returned ArchiveManifest is written to manifest_fname, by default next
+        to an output filename.
+        """
+
+        if image_reference is None:
+            image_reference = self.image_reference
+
+        image = self.docker_client.images.get(image_reference)
+
+        # Saved without repository tags, import_image only tags the image once its archive is verified
+        chunks = image.save(chunk_size=ARCHIVE_CHUNK_SIZE, named=False)
+
+        logger.info(f"Exporting {image_reference} to {output}")
+        with span('docker.export', image=image_reference, compression=compression):
+            if isinstance(output, str):
+                partial_fname = output + '.partial'
+                try:
+                    with open(partial_fname, 'wb') as f:
+                        sha256, size, uncompressed_size = write_archive(chunks, f, compression)
+                    os.replace(partial_fname, output)
+                finally:
+                    if os.path.exists(partial_fname):
+                        os.remove(partial_fname)
+
+                if manifest_fname is None:
+                    manifest_fname = manifest_filename(output)
+            else:
+                sha256, size, uncompressed_size = write_archive(chunks, output, compression)
+
+        manifest = ArchiveManifest(image_reference=image_reference, image_id=image.id, compression=compression,
+                                   sha256=sha256, size=size, uncompressed_size=uncompressed_size)
+
+        if manifest_fname is not None:
+            manifest.write(manifest_fname)
+
+        logger.info(f"Exported {image_reference} as {size} bytes ({uncompressed_size} uncompressed) with sha256 {sha256}")
+
+        return manifest
+
+    def import_image(self, input, manifest=None, image_reference=None):
+        """Loads an image archive written by export_image and tags it as image_reference,
+        by default the reference it was exported from.
+
+        input is a filename or a binary file object. manifest is an ArchiveManifest or the
+        filename of one, by default read from next to an input filename. The archive is
+        verified against the manifest digest before anything is loaded.
+
+        Returns the loaded image.
+        """
+
+        if manifest is None:
+            if not isinstance(input, str):
+                raise ArchiveError("A manifest is required to import an image from a file object")
+            manifest = manifest_filename(input)
+
+        if isinstance(manifest, str):
+            manifest = ArchiveManifest.read(manifest)
+
+        if image_reference is None:
+            image_reference = manifest.image_reference
+
+        logger.info(f"Importing {image_reference} from {input}")
+        with span('docker.import', image=image_reference, compression=manifest.compression):
+            if isinstance(input, str):
+                with open(input, 'rb') as f:
+                    images = load_archive(f, manifest, self.docker_client.images.load)
+            else:
+                images = load_archive(input, manifest, self.docker_client.images.load)
+
+        matching = [ image for image in images if image.id == manifest.image_id ]
+        if len(matching) == 0:
+            raise ArchiveError(f"Archive did not contain image {manifest.image_id} of {manifest.image_reference}")
+        image = matching[0]
+
+        # Only a colon after the last slash separates a tag, others belong to a registry port
+        repository, _, tag = image_reference.rpartition(':')
+        if repository == '' or '/' in tag:
+            repository, tag = image_reference, None
+        image.tag(repository, tag)
 
-        return reg_image_dest
\ No newline at end of file
+        return image
@@ -0,0 +1,225 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for a connection and then for each read from the server
+DEFAULT_TIMEOUT = (10, 60)
+
+# Number of times a failed request is retried, waiting DEFAULT_BACKOFF * 2^n seconds in between
+DEFAULT_RETRIES = 3
+DEFAULT_BACKOFF = 0.5
+
+# Response statuses that are retried
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Connections kept open per host by the shared session
+DEFAULT_POOL_SIZE = 10
+
+# On-disk HTTP cache shared by all downloads, can be moved with an environment variable
+DEFAULT_CACHE_DIR = os.environ.get('APP_PACK_GENERATOR_HTTP_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'app_pack_generator', 'http'))
+
+# Response headers kept with cached bodies
+CACHED_HEADERS = ['Content-Type', 'ETag', 'Last-Modified', 'Cache-Control']
+
+_MAX_AGE = re.compile(r'max-age=(\d+)')
+
+class HTTPCache(object):
+    """Keeps the bodies of downloaded files on disk along with their validators.
+
+    Cached files are revalidated with conditional requests using their ETag and Last-Modified
+    headers, or used without any request while fresh according to Cache-Control max-age.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def _entry_fname(self, url):
+        return os.path.join(self.cache_dir, hashlib.sha256(url.encode('utf-8')).hexdigest())
+
+    def lookup(self, url):
+        "Returns the metadata of the cached url and its body filename, or None when not cached"
+
+        entry_fname = self._entry_fname(url)
+        try:
+            with open(entry_fname + '.json') as f:
+                metadata = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if metadata.get('url') != url or not os.path.exists(entry_fname + '.body'):
+            return None
+
+        return metadata, entry_fname + '.body'
+
+    def is_fresh(self, metadata):
+        return metadata.get('expires_at') is not None and time.time() < metadata['expires_at']
+
+    def conditional_headers(self, metadata):
+        headers = {}
+        if metadata['headers'].get('ETag') is not None:
+            headers['If-None-Match'] = metadata['headers']['ETag']
+        if metadata['headers'].get('Last-Modified') is not None:
+            headers['If-Modified-Since'] = metadata['headers']['Last-Modified']
+        return headers
+
+    def response(self, url, metadata, body_fname):
+        "Builds a requests Response for a cached file"
+
+        import requests
+        from requests.structures import CaseInsensitiveDict
+
+        response = requests.Response()
+        response.url = url
+        response.status_code = 200
+        response.headers = CaseInsensitiveDict(metadata['headers'])
+        response.encoding = metadata.get('encoding')
+        with open(body_fname, 'rb') as f:
+            response._content = f.read()
+
+        response.from_cache = True
+        return response
+
+    def store(self, url, response):
+        "Caches a successful response if it can be revalidated or has a lifetime"
+
+        cache_control = response.headers.get('Cache-Control', '')
+        max_age = _MAX_AGE.search(cache_control)
+
+        if 'no-store' in cache_control:
+            return
+        if max_age is None and 'ETag' not in response.headers and 'Last-Modified' not in response.headers:
+            return
+
+        metadata = {
+            'url': url,
+            'encoding': response.encoding,
+            'headers': { name: response.headers[name] for name in CACHED_HEADERS if name in response.headers },
+            'expires_at': time.time() + int(max_age.group(1)) if max_age is not None and 'no-cache' not in cache_control else None,
+        }
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entry_fname = self._entry_fname(url)
+        self._replace(entry_fname + '.body', response.content)
+        self._replace(entry_fname + '.json', json.dumps(metadata).encode('utf-8'))
+
+    def _replace(self, fname, data):
+        "Writes to a temporary file first so concurrent readers never see partial files"
+
+        fd, tmp_fname = tempfile.mkstemp(dir=self.cache_dir)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_fname, fname)
+
+    def touch(self, url, metadata, response):
+        "Updates the lifetime of a cached entry after a 304 Not Modified response"
+
+        max_age = _MAX_AGE.search(response.headers.get('Cache-Control', ''))
+        if max_age is None:
+            return
+
+        metadata['expires_at'] = time.time() + int(max_age.group(1))
+        self._replace(self._entry_fname(url) + '.json', json.dumps(metadata).encode('utf-8'))
+
+class Downloader(object):
+    """Downloads files through a pooled requests session with timeouts and retries,
+    answering repeated downloads from an HTTPCache when cache_dir is not None.
+
+    Files in the cache are served when the server can not be reached.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES, backoff=DEFAULT_BACKOFF,
+                 cache_dir=DEFAULT_CACHE_DIR, pool_size=DEFAULT_POOL_SIZE):
+
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.cache = HTTPCache(cache_dir) if cache_dir is not None else None
+
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        "Shared session, created on first use so that requests is only imported when needed"
+
+        with self._lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                from urllib3.util.retry import Retry
+
+                retry = Retry(total=self.retries, backoff_factor=self.backoff, status_forcelist=RETRY_STATUSES,
+                              allowed_methods=['GET', 'HEAD'])
+                adapter = HTTPAdapter(max_retries=retry, pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._session = session
+
+            return self._session
+
+    def get(self, url):
+        """Downloads url, returns a requests Response.
+
+        Responses answered from the cache have a from_cache attribute set to True.
+        """
+
+        import requests
+
+        cached = self.cache.lookup(url) if self.cache is not None else None
+
+        headers = {}
+        if cached is not None:
+            metadata, body_fname = cached
+            if self.cache.is_fresh(metadata):
+                logger.debug(f"Using cached {url}")
+                return self.cache.response(url, metadata, body_fname)
+            headers = self.cache.conditional_headers(metadata)
+
+        try:
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            if cached is None:
+                raise
+            logger.warning(f"Using cached {url} since it could not be downloaded: {e}")
+            return self.cache.response(url, *cached)
+
+        if response.status_code == 304 and cached is not None:
+            logger.debug(f"Cached {url} is not modified")
+            self.cache.touch(url, cached[0], response)
+            return self.cache.response(url, *cached)
+
+        if response.status_code == 200 and self.cache is not None:
+            self.cache.store(url, response)
+
+        response.from_cache = False
+        return response
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+_default_downloader = None
+_default_downloader_lock = threading.Lock()
+
+def default_downloader():
+    "Downloader shared by the whole process"
+
+    global _default_downloader
+
+    with _default_downloader_lock:
+        if _default_downloader is None:
+            _default_downloader = Downloader()
+        return _default_downloader
@@ -0,0 +1,370 @@
+"""Packages a fleet of application repositories listed in a manifest file.
+
+The manifest is a YAML or JSON document such as:
+
+    workdir: build                  # Clones and packages are placed here, relative to the manifest
+    mirror_cache: mirrors           # Optional GitMirrorCache directory shared between runs
+    stage_limits: {clone: 8}        # Optional overrides of the per stage concurrency limits
+    retries: {build: 1}             # Optional overrides of the per stage retry counts
+    defaults:                       # Values used by every repository unless overridden
+        registries: [registry.example.com]
+    repositories:
+        - source: https://github.com/unity-sds/unity-example-application
+          ref: v1.0.0
+          notebook: process.ipynb
+        - name: other-notebook      # Names must be unique, they default to the source name
+          source: https://github.com/unity-sds/unity-example-application
+          notebook: other.ipynb
+
+The outcome of each repository is saved in a state file as soon as it finishes, so that
+running again after an interruption only processes repositories that did not succeed or
+whose manifest entry changed.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import argparse
+import tempfile
+
+import attrs
+import yaml
+
+from .git import GitMirrorCache
+from .pipeline import AsyncPackager, PackagingJob, STAGES
+
+logger = logging.getLogger(__name__)
+
+# Resources a single repo2docker build is assumed to use when deciding how many builds run at once
+BUILD_CPUS = 2
+BUILD_MEMORY_BYTES = 4 * 1024 ** 3
+
+# Name of the state file inside the work directory
+DEFAULT_STATE_FILENAME = 'fleet-state.json'
+
+# Entry status values saved in the state file
+STATUS_SUCCEEDED = 'succeeded'
+STATUS_FAILED = 'failed'
+
+class FleetError(Exception):
+    pass
+
+def available_cpus():
+    "Number of CPUs this process may run on"
+
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def available_memory_bytes():
+    "Physical memory of the machine, None if it can not be determined"
+
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def build_concurrency(cpus=None, memory_bytes=None):
+    "Number of repo2docker builds that fit on this machine at once, at least one"
+
+    cpus = cpus if cpus is not None else available_cpus()
+    memory_bytes = memory_bytes if memory_bytes is not None else available_memory_bytes()
+
+    limit = max(1, cpus // BUILD_CPUS)
+    if memory_bytes is not None:
+        limit = min(limit, max(1, memory_bytes // BUILD_MEMORY_BYTES))
+
+    return limit
+
+@attrs.define
+class FleetEntry(object):
+    "A repository notebook listed in a fleet manifest"
+
+    name: str
+    source: str
+    ref: str = None
+    notebook: str = 'process.ipynb'
+    registries: list = attrs.Factory(list)
+    dockerurl: str = None
+    build: bool = True
+    template_dir: str = None
+
+    # Additional keyword arguments for GitManager and DockerUtil
+    git_args: dict = attrs.Factory(dict)
+    docker_args: dict = attrs.Factory(dict)
+
+    def fingerprint(self):
+        "Hash of the entry, a changed entry is processed again even if it succeeded before"
+
+        return hashlib.sha256(json.dumps(attrs.asdict(self), sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+@attrs.define
+class FleetManifest(object):
+    "Parsed contents of a fleet manifest file"
+
+    entries: list
+    workdir: str
+    mirror_cache: str = None
+    stage_limits: dict = attrs.Factory(dict)
+    stage_retries: dict = attrs.Factory(dict)
+
+    @classmethod
+    def read(cls, manifest_fname):
+        with open(manifest_fname) as f:
+            # YAML is a superset of JSON so this reads either
+            contents = yaml.safe_load(f) or {}
+
+        base_dir = os.path.dirname(os.path.abspath(manifest_fname))
+        def manifest_path(path):
+            return os.path.join(base_dir, path) if path is not None else None
+
+        defaults = contents.get('defaults', {})
+        fields = set([ field.name for field in attrs.fields(FleetEntry) ])
+
+        entries = []
+        for index, repository in enumerate(contents.get('repositories', [])):
+            entry_args = dict(defaults, **repository)
+
+            if 'source' not in entry_args:
+                raise FleetError(f"Repository {index} of {manifest_fname} has no source")
+
+            unknown = set(entry_args) - fields
+            if unknown:
+                raise FleetError(f"Unknown keys {sorted(unknown)} for repository {index} of {manifest_fname}")
+
+            if 'name' not in entry_args:
+                name = os.path.basename(entry_args['source'].rstrip('/'))
+                entry_args['name'] = name[:-len('.git')] if name.endswith('.git') else name
+
+            # Names become directories inside the work directory
+            name = entry_args['name']
+            if not isinstance(name, str) or name in ('', '.', '..') or '/' in name or '\\' in name:
+                raise FleetError(f"Repository {index} of {manifest_fname} has name {name!r}, names can not be paths")
+
+            if entry_args.get('template_dir') is not None:
+                entry_args['template_dir'] = manifest_path(entry_args['template_dir'])
+
+            entries.append(FleetEntry(**entry_args))
+
+        names = [ entry.name for entry in entries ]
+        duplicates = set([ name for name in names if names.count(name) > 1 ])
+        if duplicates:
+            raise FleetError(f"Repository names must be unique, give a name to the entries for {sorted(duplicates)}")
+
+        return cls(entries=entries,
+                   workdir=manifest_path(contents.get('workdir', 'fleet')),
+                   mirror_cache=manifest_path(contents.get('mirror_cache')),
+                   stage_limits=contents.get('stage_limits', {}),
+                   stage_retries=contents.get('retries', {}))
+
+class FleetState(object):
+    "Outcome of every manifest entry processed so far, saved to a JSON file whenever one finishes"
+
+    def __init__(self, state_fname):
+        self.state_fname = state_fname
+
+        if os.path.exists(state_fname):
+            with open(state_fname) as f:
+                self.entries = json.load(f)
+        else:
+            self.entries = {}
+
+    def finished(self, entry):
+        "True if entry succeeded in a previous run and has not changed since"
+
+        record = self.entries.get(entry.name)
+        return record is not None and record['status'] == STATUS_SUCCEEDED and record['fingerprint'] == entry.fingerprint()
+
+    def record(self, entry, run):
+        stages = {}
+        for stage, task in run.tasks.items():
+            result = task.result()
+            if result is None:
+                continue
+
+            stages[stage] = {
+                'seconds': round(result.seconds, 3),
+                'attempts': result.attempts,
+                'error': None if result.success else f"{type(result.error).__name__}: {result.error}",
+            }
+
+        record = {
+            'status': STATUS_SUCCEEDED if run.success else STATUS_FAILED,
+            'fingerprint': entry.fingerprint(),
+            'finished_at': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            'stages': stages,
+        }
+
+        build_result = run.tasks['build'].result()
+        if build_result is not None and build_result.success:
+            record['image_reference'] = build_result.value
+
+        push_result = run.tasks['push'].result() if 'push' in run.tasks else None
+        if push_result is not None and push_result.success and push_result.value is not None:
+            record['pushes'] = { r.destination: r.status for r in push_result.value }
+
+        self.entries[entry.name] = record
+        self.save()
+
+    def save(self):
+        "Replaces the state file atomically so an interrupted run never leaves it truncated"
+
+        state_dir = os.path.dirname(os.path.abspath(self.state_fname))
+        os.makedirs(state_dir, exist_ok=True)
+
+        fd, tmp_fname = tempfile.mkstemp(prefix='.fleet-state-', dir=state_dir)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.entries, f, indent=4, sort_keys=True)
+            os.replace(tmp_fname, self.state_fname)
+        except BaseException:
+            os.remove(tmp_fname)
+            raise
+
+class FleetBuilder(object):
+    """Clones, generates, builds and pushes every repository of a FleetManifest.
+
+    Stages of all repositories are scheduled on an AsyncPackager. Unless given, the number
+    of concurrent builds is derived from the CPUs and memory of the machine. Entries that
+    already succeeded according to the state file are skipped unless force is set.
+    """
+
+    def __init__(self, manifest, state_fname=None, stage_limits=None, stage_retries=None, force=False):
+
+        self.manifest = manifest
+        self.force = force
+
+        self.stage_limits = { 'build': build_concurrency() }
+        self.stage_limits.update(manifest.stage_limits)
+        if stage_limits is not None:
+            self.stage_limits.update(stage_limits)
+
+        self.stage_retries = dict(manifest.stage_retries)
+        if stage_retries is not None:
+            self.stage_retries.update(stage_retries)
+
+        if state_fname is None:
+            state_fname = os.path.join(manifest.workdir, DEFAULT_STATE_FILENAME)
+        self.state = FleetState(state_fname)
+
+        self.mirror_cache = GitMirrorCache(manifest.mirror_cache) if manifest.mirror_cache is not None else None
+
+    def pending(self):
+        "Entries that still need to be processed"
+
+        pending = []
+        for entry in self.manifest.entries:
+            if not self.force and self.state.finished(entry):
+                logger.info(f"Skipping {entry.name}, it was packaged by a previous run")
+            else:
+                pending.append(entry)
+
+        return pending
+
+    def job(self, entry):
+        git_args = dict(entry.git_args)
+        if self.mirror_cache is not None:
+            git_args.setdefault('mirror_cache', self.mirror_cache)
+
+        return PackagingJob(source=entry.source,
+                            dest=os.path.join(self.manifest.workdir, 'repos', entry.name),
+                            outdir=os.path.join(self.manifest.workdir, 'packages', entry.name),
+                            ref=entry.ref,
+                            notebook=entry.notebook,
+                            registries=list(entry.registries),
+                            dockerurl=entry.dockerurl,
+                            build=entry.build,
+                            template_dir=entry.template_dir,
+                            git_args=git_args,
+                            docker_args=dict(entry.docker_args))
+
+    async def run_async(self):
+        "Processes pending entries, returns a dictionary of entry name to PackagingRun"
+
+        pending = self.pending()
+        logger.info(f"Packaging {len(pending)} of {len(self.manifest.entries)} repositories with stage limits {self.stage_limits}")
+
+        packager = AsyncPackager(stage_limits=self.stage_limits, stage_retries=self.stage_retries)
+
+        async def run_entry(entry):
+            run = packager.submit(self.job(entry))
+            await run
+
+            # Saved as each entry finishes so that an interrupted run keeps its progress
+            self.state.record(entry, run)
+            logger.info(f"Packaging {entry.name} {'succeeded' if run.success else 'failed'}")
+
+            return run
+
+        try:
+            runs = await asyncio.gather(*[ run_entry(entry) for entry in pending ])
+        finally:
+            packager.shutdown()
+
+        return { entry.name: run for entry, run in zip(pending, runs) }
+
+    def run(self):
+        "Blocking wrapper around run_async for callers without an event loop"
+
+        return asyncio.run(self.run_async())
+
+    def summary(self):
+        "Table of the state of every manifest entry"
+
+        from tabulate import tabulate
+
+        rows = []
+        for entry in self.manifest.entries:
+            record = self.state.entries.get(entry.name, {})
+            stages = record.get('stages', {})
+            errors = [ f"{stage}: {s['error']}" for stage, s in stages.items() if s['error'] is not None ]
+
+            rows.append([ entry.name, record.get('status', 'pending') ] +
+                        [ stages[stage]['seconds'] if stage in stages else '' for stage in STAGES ] +
+                        [ errors[0] if errors else '' ])
+
+        return tabulate(rows, headers=[ 'name', 'status' ] + STAGES + [ 'error' ])
+
+def parse_stage_values(values):
+    "Parses stage=count command line arguments into a dictionary"
+
+    parsed = {}
+    for value in values or []:
+        stage, _, count = value.partition('=')
+        if stage not in STAGES or not count.isdigit():
+            raise argparse.ArgumentTypeError(f"Expected stage=count with a stage in {STAGES}, got {value}")
+        parsed[stage] = int(count)
+
+    return parsed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("manifest", help="YAML or JSON manifest of the repositories to package")
+    parser.add_argument("--state", help=f"State file recording finished repositories, {DEFAULT_STATE_FILENAME} in the work directory by default")
+    parser.add_argument("--limit", action="append", metavar="STAGE=COUNT", help="Maximum number of repositories in a stage at once")
+    parser.add_argument("--retries", action="append", metavar="STAGE=COUNT", help="Number of times a failed stage is attempted again")
+    parser.add_argument("--force", action="store_true", help="Package all repositories, including those finished by a previous run")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Log debug messages")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    try:
+        builder = FleetBuilder(FleetManifest.read(args.manifest), state_fname=args.state,
+                               stage_limits=parse_stage_values(args.limit), stage_retries=parse_stage_values(args.retries),
+                               force=args.force)
+    except (FleetError, argparse.ArgumentTypeError, OSError, yaml.YAMLError) as e:
+        parser.error(str(e))
+
+    runs = builder.run()
+    print(builder.summary())
+
+    return 0 if all(run.success for run in runs.values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
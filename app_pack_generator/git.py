@@ -1,25 +1,125 @@
 import os
+import re
+import hashlib
 import logging
 
 import git
 from giturlparse import parse as parse_giturl
 
-from .util import Util
+from .util import FileLock
+from .instrument import span
 
 HEX_SHA_LENGTH = 8
 
+# Full commit hashes, the only refs that can never point to a different commit
+FULL_HEX_SHA = re.compile(r'^[0-9a-f]{40}$')
+
 logger = logging.getLogger(__name__)
 
 class GitRepoError(Exception):
     pass
 
+class GitMirrorCache(object):
+    """Keeps one bare mirror repository per source URL in cache_dir.
+
+    Clones made through the cache borrow objects from the mirror through git alternates
+    so they do not transfer any data over the network. A mirror is fetched from its source
+    when a requested ref is missing or when a refresh is asked for. Access to each mirror is
+    serialized through a lock file so that the cache can be shared by concurrent processes.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def mirror_path(self, source):
+        "Location of the bare mirror for source inside the cache directory"
+
+        source_hash = hashlib.sha256(source.encode('utf-8')).hexdigest()[:16]
+        source_name = re.sub(r'[^\w.-]', '_', os.path.basename(source.rstrip('/')))
+        if not source_name.endswith('.git'):
+            source_name += '.git'
+
+        return os.path.join(self.cache_dir, f"{source_hash}-{source_name}")
+
+    def _has_ref(self, mirror_repo, ref):
+        try:
+            mirror_repo.git.rev_parse('--verify', '--quiet', f'{ref}^{{commit}}')
+            return True
+        except git.GitCommandError:
+            return False
+
+    def ensure(self, source, ref=None, refresh=False):
+        """Creates the mirror for source if needed and makes sure it contains ref.
+
+        With refresh, an existing mirror is fetched from its source even if it has ref so
+        that branches move to their latest commits.
+
+        Returns the path to the mirror repository.
+        """
+
+        mirror_path = self.mirror_path(source)
+
+        with FileLock(mirror_path + '.lock'):
+            if not os.path.exists(mirror_path):
+                logger.info(f"Creating mirror of {source} in {mirror_path}")
+                mirror_repo = git.Repo.clone_from(source, mirror_path, mirror=True)
+
+                # Clones share objects with the mirror, they must never be garbage collected
+                with mirror_repo.config_writer() as config:
+                    config.set_value('gc', 'auto', '0')
+
+            elif refresh:
+                logger.info(f"Updating mirror of {source}")
+                mirror_repo = git.Repo(mirror_path)
+                mirror_repo.git.fetch('--prune', 'origin')
+
+                if ref is not None and not self._has_ref(mirror_repo, ref):
+                    mirror_repo.git.fetch('origin', ref)
+
+            elif ref is not None:
+                mirror_repo = git.Repo(mirror_path)
+
+                if not self._has_ref(mirror_repo, ref):
+                    logger.info(f"Updating mirror of {source} to find {ref}")
+                    mirror_repo.git.fetch('--prune', 'origin')
+
+                    # Commits that are not reachable from any branch or tag
+                    if not self._has_ref(mirror_repo, ref):
+                        mirror_repo.git.fetch('origin', ref)
+
+        return mirror_path
+
+def ref_may_move(ref):
+    "Whether ref can point to another commit later, true for branches, tags and abbreviated hashes"
+
+    return ref is None or FULL_HEX_SHA.match(ref) is None
+
 class GitManager(object):
-    def __init__(self, source, dest=None):
-        """Manages a information about a git repository for application notebooks"""
+    def __init__(self, source, dest=None, depth=None, blob_filter=None, sparse_paths=None, mirror_cache=None,
+                 refresh_mirror=None):
+        """Manages a information about a git repository for application notebooks
+
+        When cloning, the amount of data transferred can be reduced for large repositories:
+        depth creates a shallow clone with that many commits of history, blob_filter creates a
+        partial clone (ie "blob:none" fetches file contents only when they are checked out) and
+        sparse_paths limits the working tree to the given gitignore style patterns.
+
+        Local sources must be given as file:// URLs for depth and blob_filter to take effect.
+
+        With a GitMirrorCache, clones are made from a local mirror of the source instead,
+        in which case depth and blob_filter are unnecessary and ignored. The mirror is
+        refreshed from the source before cloning the default branch and before checking out
+        any ref other than a full commit hash, unless refresh_mirror is False. When True, the
+        mirror is refreshed for every clone and checkout.
+        """
 
         self.source_location = source
         self.source_attrs = parse_giturl(self.source_location)
 
+        self.clone_depth = depth
+        self.mirror_cache = mirror_cache
+        self.refresh_mirror = refresh_mirror
+
         if dest is None:
             # If destination is none allow for source to be an existing directory with a git repository
 
@@ -47,7 +147,33 @@ class GitManager(object):
             # is an empty or non existent directory
             logger.info(f"Cloning Git repository from {source} to {dest}")
 
-            self.repo = git.Repo.clone_from(source, dest)
+            with span('git.clone', source=source, mirror=mirror_cache is not None):
+                clone_args = {}
+                if sparse_paths is not None:
+                    clone_args['sparse'] = True
+
+                if mirror_cache is not None:
+                    if depth is not None or blob_filter is not None:
+                        logger.warning("Clone depth and blob filter are ignored when cloning from a mirror")
+                    self.clone_depth = None
+
+                    # The default branch is checked out, which may have moved since the mirror was fetched
+                    mirror_path = mirror_cache.ensure(source, refresh=self._should_refresh(None))
+
+                    logger.debug(f"Cloning from mirror {mirror_path}")
+                    self.repo = git.Repo.clone_from(mirror_path, dest, shared=True, **clone_args)
+                    self.repo.remote('origin').set_url(source)
+                else:
+                    if depth is not None:
+                        clone_args['depth'] = depth
+                    if blob_filter is not None:
+                        clone_args['filter'] = blob_filter
+
+                    self.repo = git.Repo.clone_from(source, dest, **clone_args)
+
+                if sparse_paths is not None:
+                    logger.debug(f"Limiting checkout of {dest} to {sparse_paths}")
+                    self.repo.git.sparse_checkout('set', '--no-cone', *sparse_paths)
 
     @property
     def directory(self):
@@ -70,6 +196,10 @@ class GitManager(object):
         else:
             return os.path.basename(self.directory.rstrip("/"))
 
+    @property
+    def is_shallow(self):
+        return os.path.exists(os.path.join(self.repo.git_dir, "shallow"))
+
     @property
     def commit_identifier(self):
 
@@ -80,11 +210,73 @@ class GitManager(object):
 
         return self.repo.commit().message
 
+    def _should_refresh(self, ref):
+        if self.refresh_mirror is None:
+            return ref_may_move(ref)
+        return self.refresh_mirror
+
+    def _mirror_has_branch(self, arg):
+        mirror_repo = git.Repo(self.mirror_cache.mirror_path(self.source_location))
+        try:
+            mirror_repo.git.show_ref('--verify', '--quiet', f'refs/heads/{arg}')
+            return True
+        except git.GitCommandError:
+            return False
+
+    def fetch(self, arg, refresh=False):
+        """Fetches a single commit hash, tag or branch name from the origin remote or mirror cache
+
+        With refresh, the mirror is updated from the source before fetching from it.
+        """
+
+        if self.mirror_cache is not None:
+            mirror_path = self.mirror_cache.ensure(self.source_location, arg, refresh=refresh)
+
+            logger.info(f"Fetching {arg} from mirror {mirror_path}")
+            self.repo.git.fetch(mirror_path, arg)
+            return
+
+        fetch_args = []
+        if self.clone_depth is not None:
+            fetch_args.append(f'--depth={self.clone_depth}')
+
+        logger.info(f"Fetching {arg} from origin")
+        self.repo.git.fetch(*fetch_args, 'origin', arg)
+
     def checkout(self, arg):
         """Runs the checkout command on this repository.
 
         'arg' is either a commit hash, a tag, or a branch name.
-        Initializes any new submodules as well.
+        If it is not available locally, as is common for shallow clones, it is fetched from
+        the origin remote or the mirror cache first. With a mirror cache, refs that may have
+        moved are always fetched from a refreshed mirror, branches are then checked out as local
+        branches tracking the remote ones. Initializes any new submodules as well.
         """
-        self.repo.git.checkout(arg)
-        self.repo.git.submodule('update', '--init')
+        with span('git.checkout', ref=arg):
+            if self.mirror_cache is not None and self._should_refresh(arg):
+                self.fetch(arg, refresh=True)
+
+                if self._mirror_has_branch(arg):
+                    # As for a branch of a regular clone, end on a local branch tracking the remote one
+                    self.repo.git.update_ref(f'refs/remotes/origin/{arg}', 'FETCH_HEAD')
+                    self.repo.git.checkout('--track', '-B', arg, f'origin/{arg}')
+                else:
+                    self.repo.git.checkout('FETCH_HEAD')
+            else:
+                try:
+                    self.repo.git.checkout(arg)
+                except git.GitCommandError:
+                    if 'origin' not in [ remote.name for remote in self.repo.remotes ]:
+                        raise
+
+                    self.fetch(arg)
+                    self.repo.git.checkout('FETCH_HEAD')
+
+            self._update_submodules()
+
+    def _update_submodules(self):
+        submodule_args = ['update', '--init']
+        if self.clone_depth is not None:
+            submodule_args.append(f'--depth={self.clone_depth}')
+
+        self.repo.git.submodule(*submodule_args)
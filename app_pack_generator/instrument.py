@@ -0,0 +1,218 @@
+import json
+import time
+import logging
+import threading
+import functools
+import itertools
+import contextlib
+import contextvars
+
+import attrs
+
+logger = logging.getLogger(__name__)
+
+@attrs.define
+class Span(object):
+    "Timing of a named stage of the library, possibly nested inside another span"
+
+    name: str
+    span_id: int
+    parent_id: int = None
+    depth: int = 0
+    start_ns: int = 0
+    duration_ns: int = 0
+    attributes: dict = attrs.Factory(dict)
+
+    # Name of the exception that ended the span, if any
+    error: str = None
+
+    # Filled in when profiling was enabled for the span name
+    profile: str = None
+    memory_peak_bytes: int = None
+
+    @property
+    def seconds(self):
+        return self.duration_ns / 1e9
+
+    def as_dict(self):
+        return attrs.asdict(self)
+
+class SpanSink(object):
+    "Receives every finished span"
+
+    def record(self, span):
+        raise NotImplementedError("Only subclasses of this class implement this method")
+
+class LoggingSink(SpanSink):
+    "Logs finished spans through the logging module"
+
+    def __init__(self, level=logging.INFO):
+        self.level = level
+
+    def record(self, span):
+        indent = "  " * span.depth
+        status = f" failed with {span.error}" if span.error is not None else ""
+        logger.log(self.level, f"{indent}{span.name} took {span.duration_ns / 1e6:.3f} ms{status} {span.attributes or ''}".rstrip())
+
+class JsonLinesSink(SpanSink):
+    "Writes finished spans as one JSON object per line to a filename or file object"
+
+    def __init__(self, output):
+        if isinstance(output, str):
+            output = open(output, 'a', encoding='utf-8')
+        self.output = output
+        self._lock = threading.Lock()
+
+    def record(self, span):
+        line = json.dumps(span.as_dict(), default=str)
+        with self._lock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+class MemoryCollector(SpanSink):
+    "Keeps finished spans in memory, useful for tests and services reporting timings"
+
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def record(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def by_name(self, name):
+        return [ s for s in self.spans if s.name == name ]
+
+    def total_seconds(self):
+        "Seconds spent per span name"
+
+        totals = {}
+        for s in self.spans:
+            totals[s.name] = totals.get(s.name, 0.0) + s.seconds
+        return totals
+
+    def clear(self):
+        with self._lock:
+            self.spans = []
+
+_sinks = []
+_profiled = {}
+_span_ids = itertools.count(1)
+_current_span = contextvars.ContextVar('app_pack_generator_span', default=None)
+_profiler_active = contextvars.ContextVar('app_pack_generator_profiler', default=False)
+
+def add_sink(sink):
+    "Starts sending finished spans to sink, returns the sink"
+
+    _sinks.append(sink)
+    return sink
+
+def remove_sink(sink):
+    _sinks.remove(sink)
+
+def enable_profiling(name, cpu=True, memory=False):
+    """Profiles every span called name with cProfile (cpu) and/or tracemalloc (memory).
+
+    Results are attached to the span as the text of the cProfile statistics and the
+    peak traced memory in bytes.
+    """
+
+    _profiled[name] = (cpu, memory)
+
+def disable_profiling(name=None):
+    "Stops profiling spans called name, or all spans when name is None"
+
+    if name is None:
+        _profiled.clear()
+    else:
+        _profiled.pop(name, None)
+
+@contextlib.contextmanager
+def _profile(span, cpu, memory):
+
+    # Profiling is opt-in, keep its modules out of the import of the library
+    import io
+    import pstats
+    import cProfile
+    import tracemalloc
+
+    # Only one profiler may be active at a time, nested profiled spans are covered by the outer one
+    profiler = None
+    if cpu and not _profiler_active.get():
+        profiler = cProfile.Profile()
+    token = _profiler_active.set(True) if profiler is not None else None
+
+    started_tracing = memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            _profiler_active.reset(token)
+
+            stats_output = io.StringIO()
+            pstats.Stats(profiler, stream=stats_output).sort_stats('cumulative').print_stats(25)
+            span.profile = stats_output.getvalue()
+
+        if memory:
+            span.memory_peak_bytes = tracemalloc.get_traced_memory()[1]
+            if started_tracing:
+                tracemalloc.stop()
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """Records the time spent inside the context as a Span named name.
+
+    Spans are nested according to the calling context and sent to all registered sinks
+    once finished. When no sink is registered this does nothing.
+    """
+
+    if len(_sinks) == 0:
+        yield None
+        return
+
+    parent = _current_span.get()
+    current = Span(name=name,
+                   span_id=next(_span_ids),
+                   parent_id=parent.span_id if parent is not None else None,
+                   depth=parent.depth + 1 if parent is not None else 0,
+                   attributes=attributes)
+
+    token = _current_span.set(current)
+    profiling = _profiled.get(name)
+    current.start_ns = time.perf_counter_ns()
+    try:
+        if profiling is not None:
+            with _profile(current, *profiling):
+                yield current
+        else:
+            yield current
+    except BaseException as e:
+        current.error = type(e).__name__
+        raise
+    finally:
+        current.duration_ns = time.perf_counter_ns() - current.start_ns
+        _current_span.reset(token)
+
+        for sink in list(_sinks):
+            try:
+                sink.record(current)
+            except Exception as e:
+                logger.error(f"Failed to record span {name}: {e}")
+
+def traced(name):
+    "Decorator recording each call of the decorated function as a span"
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
@@ -0,0 +1,247 @@
+import os
+import re
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Characters read from the notebook file at a time when streaming
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# Notebooks larger than this are streamed when the loading mode is not given explicitly
+STREAMING_THRESHOLD_BYTES = 16 * 1024 * 1024
+
+# Cell keys whose values are skipped without being decoded, and what replaces them.
+# Code cells must have outputs to validate, attachments are optional.
+SKIPPED_CELL_KEYS = {
+    'outputs': lambda: [],
+    'attachments': None,
+}
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_STRUCTURE = re.compile(r'["\[\]{}]')
+_STRING_END = re.compile(r'["\\]')
+
+class NotebookLoadError(ValueError):
+    pass
+
+class _StreamingReader(object):
+    "Incremental reader over a JSON document that only keeps a window of the file in memory"
+
+    def __init__(self, fileobj, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self, size=None):
+        "Drops the consumed part of the buffer and reads more of the file, returns False at the end of the file"
+
+        if self.eof:
+            return False
+
+        data = self.fileobj.read(size or self.chunk_size)
+        if not data:
+            self.eof = True
+            return False
+
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self):
+        "Returns the next character that is not whitespace without consuming it"
+
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                raise NotebookLoadError("Unexpected end of notebook file")
+
+    def at_end(self):
+        "True when only whitespace is left in the file"
+
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return False
+            if not self._fill():
+                return True
+
+    def expect(self, characters):
+        char = self.peek()
+        if char not in characters:
+            raise NotebookLoadError(f"Expected one of {characters!r} but found {char!r} in notebook file")
+        self.pos += 1
+        return char
+
+    def decode_value(self):
+        "Decodes the next complete JSON value"
+
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+
+                # A number ending at the end of the buffer may continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError as e:
+                if self.eof:
+                    raise NotebookLoadError(f"Invalid JSON in notebook file: {e}")
+
+            # Grow reads geometrically so large values are not decoded over and over
+            self._fill(max(self.chunk_size, len(self.buffer) - self.pos))
+
+    def _skip_string(self):
+        self.pos += 1
+        while True:
+            match = _STRING_END.search(self.buffer, self.pos)
+            if match is None or match.end() >= len(self.buffer) and match.group() == '\\':
+                self.pos = len(self.buffer) if match is None else match.start()
+                if not self._fill():
+                    raise NotebookLoadError("Unterminated string in notebook file")
+                continue
+
+            if match.group() == '\\':
+                self.pos = match.end() + 1
+            else:
+                self.pos = match.end()
+                return
+
+    def skip_value(self):
+        "Moves past the next JSON value without decoding it"
+
+        char = self.peek()
+        if char == '"':
+            self._skip_string()
+            return
+        if char not in '[{':
+            self.decode_value()
+            return
+
+        depth = 0
+        while True:
+            match = _STRUCTURE.search(self.buffer, self.pos)
+            if match is None:
+                self.pos = len(self.buffer)
+                if not self._fill():
+                    raise NotebookLoadError("Unexpected end of notebook file")
+                continue
+
+            self.pos = match.start()
+            char = match.group()
+            if char == '"':
+                self._skip_string()
+                continue
+
+            self.pos += 1
+            if char in '[{':
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return
+
+    def members(self):
+        "Iterates over the keys of the object starting at the current position, leaving values unread"
+
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+
+        while True:
+            key = self.decode_value()
+            if not isinstance(key, str):
+                raise NotebookLoadError("Expected an object key in notebook file")
+            self.expect(':')
+
+            yield key
+
+            if self.expect(',}') == '}':
+                return
+
+    def elements(self):
+        "Iterates over the elements of the array starting at the current position, leaving them unread"
+
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+
+        while True:
+            yield
+
+            if self.expect(',]') == ']':
+                return
+
+def _read_cell(reader):
+    if reader.peek() != '{':
+        return reader.decode_value()
+
+    cell = {}
+    for key in reader.members():
+        if key in SKIPPED_CELL_KEYS:
+            reader.skip_value()
+
+            replacement = SKIPPED_CELL_KEYS[key]
+            if replacement is not None:
+                cell[key] = replacement()
+        else:
+            cell[key] = reader.decode_value()
+
+    return cell
+
+def _read_cells(reader):
+    if reader.peek() != '[':
+        return reader.decode_value()
+
+    return [ _read_cell(reader) for _ in reader.elements() ]
+
+def stream_notebook(fileobj, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Reads a notebook from a text file object without decoding cell outputs and attachments.
+
+    Cell outputs are replaced with empty lists and attachments are dropped, so that the
+    reduced notebook still validates. Only a window of about chunk_size characters
+    of the file, plus the largest kept value, is held in memory at a time.
+    """
+
+    reader = _StreamingReader(fileobj, chunk_size)
+
+    if reader.peek() != '{':
+        raise NotebookLoadError("Notebook file does not contain a JSON object")
+
+    notebook = {}
+    for key in reader.members():
+        if key == 'cells':
+            notebook[key] = _read_cells(reader)
+        else:
+            notebook[key] = reader.decode_value()
+
+    if not reader.at_end():
+        raise NotebookLoadError("Extra data after the notebook in notebook file")
+
+    return notebook
+
+def load_notebook(notebook_filename, skip_outputs=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Loads the JSON of a notebook file.
+
+    With skip_outputs the notebook is streamed through stream_notebook, otherwise it is
+    decoded entirely. When skip_outputs is None notebooks larger than
+    STREAMING_THRESHOLD_BYTES are streamed.
+    """
+
+    if skip_outputs is None:
+        skip_outputs = os.path.getsize(notebook_filename) > STREAMING_THRESHOLD_BYTES
+
+    with open(notebook_filename, 'r', encoding='utf-8') as f:
+        if skip_outputs:
+            logger.debug(f'Streaming notebook "{notebook_filename}" without cell outputs')
+            return stream_notebook(f, chunk_size)
+
+        return json.load(f)
@@ -0,0 +1,108 @@
+import io
+import os
+import time
+import tarfile
+
+class OutputSink(object):
+    "Destination for generated application package files"
+
+    def write(self, name, data):
+        """Writes the bytes data as the file name.
+
+        Returns how the written file is identified by this sink.
+        """
+
+        raise NotImplementedError("Only subclasses of this class implement this method")
+
+class DirectorySink(OutputSink):
+    "Writes generated files into a directory, created if missing, returning their absolute paths"
+
+    def __init__(self, outdir):
+        self.outdir = outdir
+
+    def write(self, name, data):
+        if not os.path.isdir(self.outdir):
+            os.makedirs(self.outdir)
+
+        fname = os.path.abspath(os.path.join(self.outdir, name))
+        with open(fname, 'wb') as f:
+            f.write(data)
+
+        return fname
+
+class IncrementalDirectorySink(DirectorySink):
+    """Writes generated files into a directory, leaving files whose contents did not change
+    untouched so their modification times are preserved.
+
+    Names of the files actually written are collected in the written list."""
+
+    def __init__(self, outdir):
+        super().__init__(outdir)
+        self.written = []
+
+    def write(self, name, data):
+        fname = os.path.abspath(os.path.join(self.outdir, name))
+
+        if os.path.isfile(fname) and os.path.getsize(fname) == len(data):
+            with open(fname, 'rb') as f:
+                if f.read() == data:
+                    return fname
+
+        self.written.append(name)
+        return super().write(name, data)
+
+class MemorySink(OutputSink):
+    "Keeps generated files in memory as a dictionary of filename to bytes"
+
+    def __init__(self):
+        self.files = {}
+
+    def write(self, name, data):
+        self.files[name] = data
+        return name
+
+class RecordingSink(OutputSink):
+    "Passes generated files on to another sink, keeping their contents in the files dictionary"
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.files = {}
+
+    def write(self, name, data):
+        self.files[name] = data
+        return self.sink.write(name, data)
+
+class ZipSink(OutputSink):
+    "Writes generated files into an open zipfile.ZipFile"
+
+    def __init__(self, zip_file, prefix=""):
+        self.zip_file = zip_file
+        self.prefix = prefix
+
+    def write(self, name, data):
+        arcname = self.prefix + name
+        self.zip_file.writestr(arcname, data)
+        return arcname
+
+class TarSink(OutputSink):
+    "Writes generated files into an open tarfile.TarFile"
+
+    def __init__(self, tar_file, prefix=""):
+        self.tar_file = tar_file
+        self.prefix = prefix
+
+    def write(self, name, data):
+        info = tarfile.TarInfo(self.prefix + name)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        info.mode = 0o644
+        self.tar_file.addfile(info, io.BytesIO(data))
+        return info.name
+
+def as_sink(outdir):
+    "Returns outdir if it already is an OutputSink, otherwise a DirectorySink for the outdir path"
+
+    if isinstance(outdir, OutputSink):
+        return outdir
+
+    return DirectorySink(outdir)
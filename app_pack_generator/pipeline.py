@@ -0,0 +1,323 @@
+import os
+import time
+import asyncio
+import logging
+import functools
+import contextvars
+import concurrent.futures
+
+import attrs
+
+from .git import GitManager
+from .application import ApplicationNotebook
+from .batch import write_package
+
+logger = logging.getLogger(__name__)
+
+# Stages of packaging a repository, in the order they are started
+STAGES = ['clone', 'parse', 'generate', 'build', 'push']
+
+# Default number of jobs allowed in each stage at the same time
+DEFAULT_STAGE_LIMITS = {
+    'clone': 4,
+    'parse': 4,
+    'generate': 4,
+    'build': 1,
+    'push': 2,
+}
+
+# Default number of times a failed stage is attempted again, clones and pushes
+# mostly fail because of transient network errors
+DEFAULT_STAGE_RETRIES = {
+    'clone': 2,
+    'push': 2,
+}
+
+# Seconds waited before the first retry of a stage, doubled for every further retry
+DEFAULT_RETRY_DELAY = 5.0
+
+class StageSkipped(Exception):
+    "Raised for stages that can not run because a stage they depend on failed"
+    pass
+
+@attrs.define
+class PackagingJob(object):
+    "Describes packaging the notebook of one repository"
+
+    # Git source and the directory it is cloned into
+    source: str
+    dest: str
+
+    # Directory receiving the generated CWL files and descriptor, or an OutputSink
+    outdir: object
+
+    # Commit hash, tag or branch to check out, the default branch when None
+    ref: str = None
+
+    # Notebook path relative to the repository directory
+    notebook: str = 'process.ipynb'
+
+    # Registries the built image is pushed to
+    registries: list[str] = attrs.Factory(list)
+
+    # Docker image URL placed in the generated files, derived from the first registry and
+    # the built image reference when None
+    dockerurl: str = None
+
+    # Whether to build and push a Docker image with repo2docker
+    build: bool = True
+
+    template_dir: str = None
+
+    # Additional keyword arguments for GitManager and DockerUtil
+    git_args: dict = attrs.Factory(dict)
+    docker_args: dict = attrs.Factory(dict)
+
+@attrs.define
+class StageResult(object):
+    "Outcome and wall clock duration of a single stage"
+
+    stage: str
+    value: object = None
+    error: BaseException = None
+    seconds: float = 0.0
+
+    # Number of times the stage was run
+    attempts: int = 1
+
+    @property
+    def success(self):
+        return self.error is None
+
+class PackagingRun(object):
+    """Progress of a PackagingJob inside an AsyncPackager.
+
+    Each stage is exposed as an asyncio task resolving to its StageResult, stages that do not
+    apply to the job resolve to None. Awaiting the run itself waits for every stage and returns
+    the dictionary of stage name to StageResult.
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self.tasks = {}
+
+    def __getattr__(self, name):
+        if name in STAGES:
+            return self.tasks[name]
+        raise AttributeError(name)
+
+    async def wait(self):
+        results = await asyncio.gather(*[ self.tasks[stage] for stage in STAGES ])
+        return { stage: result for stage, result in zip(STAGES, results) if result is not None }
+
+    def __await__(self):
+        return self.wait().__await__()
+
+    @property
+    def timings(self):
+        "Seconds spent in each finished stage"
+
+        return { stage: task.result().seconds for stage, task in self.tasks.items()
+                 if task.done() and task.result() is not None }
+
+    @property
+    def success(self):
+        return all( task.result() is None or task.result().success for task in self.tasks.values() )
+
+class AsyncPackager(object):
+    """Runs the blocking packaging stages of many repositories concurrently from asyncio.
+
+    Stages run in a thread pool so independent work overlaps: CWL and descriptor generation
+    run while repo2docker builds the image of the same repository, and stages of different
+    repositories are pipelined. stage_limits bounds how many jobs may be in each stage at once.
+
+    A failed stage is attempted again up to the number of times given for it in stage_retries,
+    waiting retry_delay seconds before the first retry and twice as long before each further one.
+    """
+
+    def __init__(self, stage_limits=None, executor=None, stage_retries=None, retry_delay=DEFAULT_RETRY_DELAY):
+
+        self.stage_limits = dict(DEFAULT_STAGE_LIMITS)
+        if stage_limits is not None:
+            self.stage_limits.update(stage_limits)
+
+        self.stage_retries = dict(DEFAULT_STAGE_RETRIES)
+        if stage_retries is not None:
+            self.stage_retries.update(stage_retries)
+        self.retry_delay = retry_delay
+
+        if executor is None:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=sum(self.stage_limits.values()))
+        self.executor = executor
+
+        # Created on first use so they belong to the running event loop
+        self._semaphores = None
+
+    def _semaphore(self, stage):
+        "Concurrency limit for stage, None for internal steps that are not limited"
+
+        if self._semaphores is None:
+            self._semaphores = { stage: asyncio.Semaphore(limit) for stage, limit in self.stage_limits.items() }
+        return self._semaphores.get(stage)
+
+    async def _call(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+
+        # Executor threads do not inherit context variables, copy them so spans keep their parent
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self.executor, functools.partial(context.run, func, *args, **kwargs))
+
+    async def _run_stage(self, stage, job, coro_func, *dependencies):
+        "Runs coro_func once its dependencies succeeded, within the stage concurrency limit"
+
+        dependency_results = []
+        for dependency in dependencies:
+            dependency_result = await dependency
+            if dependency_result is None or not dependency_result.success:
+                dependency_name = dependency_result.stage if dependency_result is not None else "dependency"
+                return StageResult(stage=stage, error=StageSkipped(f"Skipped because {dependency_name} did not succeed"))
+            dependency_results.append(dependency_result.value)
+
+        semaphore = self._semaphore(stage)
+        max_attempts = self.stage_retries.get(stage, 0) + 1
+
+        start_time = time.perf_counter()
+        for attempt in range(1, max_attempts + 1):
+            if semaphore is not None:
+                await semaphore.acquire()
+
+            logger.info(f"Starting {stage} of {job.source}" + (f", attempt {attempt}" if attempt > 1 else ""))
+            try:
+                value = await coro_func(*dependency_results)
+                error = None
+            except Exception as e:
+                logger.error(f"Failed {stage} of {job.source}: {e}")
+                value = None
+                error = e
+            finally:
+                if semaphore is not None:
+                    semaphore.release()
+
+            if error is None or attempt == max_attempts:
+                break
+
+            # Wait outside of the concurrency limit so other jobs can use the stage meanwhile
+            await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+
+        return StageResult(stage=stage, value=value, error=error, seconds=time.perf_counter() - start_time,
+                           attempts=attempt)
+
+    async def _not_applicable(self):
+        return None
+
+    def _clone(self, job):
+        git_mgr = GitManager(job.source, job.dest, **job.git_args)
+        if job.ref is not None:
+            git_mgr.checkout(job.ref)
+        return git_mgr
+
+    def _docker_util(self, job, git_mgr):
+        # Imported here so that jobs without builds do not require docker
+        from .docker import DockerUtil
+        return DockerUtil(git_mgr, **job.docker_args)
+
+    def _push(self, job, docker_util, image_reference, push_results):
+        """Pushes to the registries of job that have no successful result in push_results yet.
+
+        push_results maps registry URLs to their latest PushResult and is updated in place, so
+        retries of the push stage only push to the registries that failed.
+        """
+        from .docker import DockerPushError
+
+        remaining = [ registry_url for registry_url in job.registries
+                      if registry_url not in push_results or not push_results[registry_url].success ]
+
+        results = docker_util.push_images(remaining, image_reference=image_reference, raise_on_error=False)
+        push_results.update({ result.registry_url: result for result in results })
+
+        results = [ push_results[registry_url] for registry_url in job.registries ]
+        failures = [ result for result in results if not result.success ]
+        if len(failures) > 0:
+            raise DockerPushError("\n".join([ result.error for result in failures ]), results)
+
+        return results
+
+    def _dockerurl(self, job, docker_util):
+        if job.dockerurl is not None:
+            return job.dockerurl
+        elif docker_util is None:
+            return "undefined"
+        elif len(job.registries) > 0:
+            return f"{job.registries[0]}/{docker_util.image_reference}"
+        else:
+            return docker_util.image_reference
+
+    def submit(self, job):
+        "Schedules all stages of job, must be called from within a running event loop"
+
+        run = PackagingRun(job)
+        tasks = run.tasks
+
+        async def clone():
+            return await self._call(self._clone, job)
+
+        async def parse(git_mgr):
+            return await self._call(ApplicationNotebook, os.path.join(git_mgr.directory, job.notebook))
+
+        async def docker_util(git_mgr):
+            if not job.build:
+                return None
+            return await self._call(self._docker_util, job, git_mgr)
+
+        async def generate(app, git_mgr, docker_util_result):
+            return await self._call(write_package, app, git_mgr, job.outdir,
+                                    dockerurl=self._dockerurl(job, docker_util_result), template_dir=job.template_dir)
+
+        async def build(docker_util_result):
+            return await self._call(docker_util_result.build_image)
+
+        # Results of the pushes to each registry, kept between attempts of the push stage
+        push_results = {}
+
+        async def push(image_reference, docker_util_result):
+            return await self._call(self._push, job, docker_util_result, image_reference, push_results)
+
+        tasks['clone'] = asyncio.ensure_future(self._run_stage('clone', job, clone))
+        tasks['parse'] = asyncio.ensure_future(self._run_stage('parse', job, parse, tasks['clone']))
+
+        # Connecting to Docker is not a stage of its own but must happen before builds and generation
+        docker_task = asyncio.ensure_future(self._run_stage('docker', job, docker_util, tasks['clone']))
+
+        tasks['generate'] = asyncio.ensure_future(
+            self._run_stage('generate', job, generate, tasks['parse'], tasks['clone'], docker_task))
+
+        if job.build:
+            tasks['build'] = asyncio.ensure_future(self._run_stage('build', job, build, docker_task))
+        else:
+            tasks['build'] = asyncio.ensure_future(self._not_applicable())
+
+        if job.build and len(job.registries) > 0:
+            tasks['push'] = asyncio.ensure_future(self._run_stage('push', job, push, tasks['build'], docker_task))
+        else:
+            tasks['push'] = asyncio.ensure_future(self._not_applicable())
+
+        return run
+
+    async def run(self, jobs):
+        "Packages all jobs concurrently, returns their PackagingRun objects once every stage has finished"
+
+        runs = [ self.submit(job) for job in jobs ]
+        await asyncio.gather(*[ run.wait() for run in runs ])
+        return runs
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+def package_repositories(jobs, stage_limits=None, stage_retries=None):
+    "Blocking wrapper around AsyncPackager.run for callers without an event loop"
+
+    packager = AsyncPackager(stage_limits=stage_limits, stage_retries=stage_retries)
+    try:
+        return asyncio.run(packager.run(jobs))
+    finally:
+        packager.shutdown()
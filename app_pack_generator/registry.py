@@ -0,0 +1,187 @@
+import re
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for a connection and then for each read from the registry
+DEFAULT_TIMEOUT = (5, 30)
+
+# Manifest media types accepted from registries, single image manifests and multi-platform indexes
+# https://distribution.github.io/distribution/spec/manifest-v2-2/
+MANIFEST_MEDIA_TYPES = [
+    'application/vnd.docker.distribution.manifest.v2+json',
+    'application/vnd.docker.distribution.manifest.list.v2+json',
+    'application/vnd.oci.image.manifest.v1+json',
+    'application/vnd.oci.image.index.v1+json',
+]
+
+# Manifest media types that list the manifests of other images instead of describing one
+INDEX_MEDIA_TYPES = [
+    'application/vnd.docker.distribution.manifest.list.v2+json',
+    'application/vnd.oci.image.index.v1+json',
+]
+
+# Registries the Docker daemon also talks to over plain http, tried with https first
+LOCAL_REGISTRY_HOSTS = ['localhost', '127.0.0.1', '[::1]']
+
+# Registry API host serving references without a registry host
+DOCKER_HUB_HOST = 'registry-1.docker.io'
+
+_AUTH_PARAM = re.compile(r'(\w+)="([^"]*)"')
+
+class RegistryError(Exception):
+    pass
+
+def parse_reference(reference):
+    """Splits an image reference into its registry host, repository and tag.
+
+    References without a registry host refer to Docker Hub.
+    """
+
+    name, _, tag = reference.rpartition(':')
+    if not name or '/' in tag:
+        name, tag = reference, 'latest'
+
+    host, _, repository = name.partition('/')
+    if not repository or ('.' not in host and ':' not in host and host != 'localhost'):
+        host, repository = DOCKER_HUB_HOST, name
+        if '/' not in repository:
+            repository = f"library/{repository}"
+    elif host in ('docker.io', 'index.docker.io'):
+        host = DOCKER_HUB_HOST
+
+    return host, repository, tag
+
+def _host_name(host):
+    return host.rsplit(':', 1)[0] if not host.endswith(']') else host
+
+class RegistryClient(object):
+    """Asks registries implementing the Docker Registry HTTP API V2 about the images they hold.
+
+    Anonymous bearer tokens are requested when a registry asks for them, registries needing
+    credentials are reported through a RegistryError. Registries on the local host are
+    contacted over http when https fails, as the Docker daemon does for them, as are any
+    hosts listed in insecure_registries.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, insecure_registries=()):
+        self.timeout = timeout
+        self.insecure_registries = list(insecure_registries)
+
+        self._session = None
+        self._schemes = {}
+        self._tokens = {}
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        "Session created on first use, requests are not retried since checks only save work"
+
+        with self._lock:
+            if self._session is None:
+                import requests
+                self._session = requests.Session()
+            return self._session
+
+    def _candidate_schemes(self, host):
+        if host in self._schemes:
+            return [ self._schemes[host] ]
+        if _host_name(host) in LOCAL_REGISTRY_HOSTS or host in self.insecure_registries:
+            return ['https', 'http']
+        return ['https']
+
+    def _token(self, challenge, repository):
+        "Requests an anonymous bearer token as described by a WWW-Authenticate challenge"
+
+        scheme, _, params = challenge.partition(' ')
+        if scheme.lower() != 'bearer':
+            raise RegistryError(f"Unsupported registry authentication: {challenge}")
+
+        params = dict(_AUTH_PARAM.findall(params))
+        if 'realm' not in params:
+            raise RegistryError(f"Registry authentication challenge without a realm: {challenge}")
+
+        query = { 'scope': params.get('scope', f"repository:{repository}:pull") }
+        if 'service' in params:
+            query['service'] = params['service']
+
+        response = self.session.get(params['realm'], params=query, timeout=self.timeout)
+        if response.status_code != 200:
+            raise RegistryError(f"Could not get a token for {repository} from {params['realm']}: HTTP {response.status_code}")
+
+        body = response.json()
+        token = body.get('token') or body.get('access_token')
+        if not token:
+            raise RegistryError(f"No token for {repository} in the response from {params['realm']}")
+
+        return token
+
+    def _request(self, method, host, repository, path):
+        import requests
+
+        headers = { 'Accept': ", ".join(MANIFEST_MEDIA_TYPES) }
+
+        schemes = self._candidate_schemes(host)
+        for scheme in schemes:
+            url = f"{scheme}://{host}/v2/{repository}/{path}"
+
+            token = self._tokens.get((host, repository))
+            if token is not None:
+                headers['Authorization'] = f"Bearer {token}"
+
+            try:
+                response = self.session.request(method, url, headers=headers, timeout=self.timeout)
+
+                if response.status_code == 401 and 'WWW-Authenticate' in response.headers:
+                    token = self._token(response.headers['WWW-Authenticate'], repository)
+                    self._tokens[(host, repository)] = token
+                    headers['Authorization'] = f"Bearer {token}"
+                    response = self.session.request(method, url, headers=headers, timeout=self.timeout)
+
+            except requests.exceptions.ConnectionError as e:
+                if scheme == schemes[-1]:
+                    raise RegistryError(f"Could not connect to registry {host}: {e}")
+                logger.debug(f"Could not connect to {url}, trying the next scheme: {e}")
+                continue
+
+            self._schemes[host] = scheme
+            return response
+
+    def manifest_digest(self, reference):
+        "Returns the digest of the manifest the registry holds for the image reference, None if it has none"
+
+        host, repository, tag = parse_reference(reference)
+        response = self._request('HEAD', host, repository, f"manifests/{tag}")
+
+        if response.status_code == 404:
+            return None
+        if response.status_code != 200:
+            raise RegistryError(f"Could not check {reference}: HTTP {response.status_code}")
+
+        digest = response.headers.get('Docker-Content-Digest')
+        if digest is None:
+            raise RegistryError(f"Registry {host} did not return a digest for {reference}")
+
+        return digest
+
+    def config_digest(self, reference):
+        """Returns the digest of the image configuration of the image reference in the registry.
+
+        The configuration digest is the image id used by the Docker daemon. Returns None if the
+        registry does not hold the reference or holds a multi-platform index for it.
+        """
+
+        host, repository, tag = parse_reference(reference)
+        response = self._request('GET', host, repository, f"manifests/{tag}")
+
+        if response.status_code == 404:
+            return None
+        if response.status_code != 200:
+            raise RegistryError(f"Could not get the manifest of {reference}: HTTP {response.status_code}")
+
+        manifest = response.json()
+        if manifest.get('mediaType', response.headers.get('Content-Type')) in INDEX_MEDIA_TYPES:
+            return None
+
+        return manifest.get('config', {}).get('digest')
@@ -0,0 +1,666 @@
+"""Serves application package generation from a long running process over HTTP.
+
+Compiled notebook schemas, parsed templates, git mirrors and the Docker client are kept
+between requests, so generating the CWL files and descriptor of a notebook only takes a
+fraction of a second. The service listens on a TCP port or on a Unix socket.
+
+Endpoints, exchanging JSON unless noted:
+
+    GET    /health                        Service status and number of jobs per status
+    POST   /generate                      Runs a job and waits for it, the response holds the generated files
+    POST   /jobs                          Queues a job, answered with the job and status 202
+    GET    /jobs                          All jobs known to the service
+    GET    /jobs/<id>                     A single job
+    GET    /jobs/<id>/events              Job events as JSON lines, streamed until the job finishes
+    GET    /jobs/<id>/artifacts/<name>    A generated file
+    GET    /jobs/<id>/package.zip         All generated files as a zip archive
+    DELETE /jobs/<id>                     Forgets a finished job
+
+A job either supplies the notebook itself or the repository holding it:
+
+    {"notebook": {... nbformat JSON ...}, "name": "my-app", "owner": "my-org", "commit": "v1.0",
+     "commit_message": "First release", "dockerurl": "registry.example.com/my-app:1.0"}
+
+    {"source": "https://github.com/unity-sds/unity-example-application", "ref": "v1.0.0",
+     "notebook": "process.ipynb", "build": true, "registries": ["registry.example.com"]}
+
+The name, owner, commit and commit message of a notebook supplied in the request are placed
+in its application descriptor, commit defaults to a digest of the notebook. Only jobs giving
+a repository source can build and push a Docker image. Sources must be remote repositories
+unless the service is started with --allow-local-sources, and notebook paths must stay
+inside the repository.
+"""
+
+import io
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import zipfile
+import logging
+import argparse
+import tempfile
+import threading
+import http.server
+import socketserver
+import collections
+import concurrent.futures
+
+import attrs
+
+from .version import __version__
+from .git import GitManager, GitMirrorCache, ref_may_move
+from .application import ApplicationNotebook, NOTEBOOK_SCHEMAS
+from .batch import RepositoryInfo, write_package
+from .output import MemorySink, ZipSink
+from .template_store import TEMPLATE_STORE
+
+logger = logging.getLogger(__name__)
+
+LOCAL_PATH = os.path.dirname(os.path.realpath(__file__))
+
+# Address the service listens on by default, only reachable from the local host
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8750
+
+# Number of jobs running at the same time
+DEFAULT_MAX_JOBS = 4
+
+# Number of jobs waiting for a free slot before new jobs are refused
+DEFAULT_MAX_QUEUED = 64
+
+# Number of finished jobs kept along with their files, the oldest are forgotten first
+DEFAULT_MAX_FINISHED = 100
+
+# Seconds after which the git mirror of a repository is fetched again before cloning it, so
+# that branches are up to date without fetching for every job
+DEFAULT_MIRROR_REFRESH_SECONDS = 60.0
+
+# Seconds an events stream waits for a new event before checking the connection again
+EVENTS_POLL_SECONDS = 15.0
+
+# Job status values
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_SUCCEEDED = 'succeeded'
+STATUS_FAILED = 'failed'
+
+# Keys accepted in job requests
+JOB_REQUEST_KEYS = ['notebook', 'name', 'owner', 'commit', 'commit_message', 'source', 'ref', 'dockerurl', 'build', 'registries']
+
+# Keys describing the repository of notebooks supplied in the request, only allowed without a source
+INLINE_REPOSITORY_KEYS = ['name', 'owner', 'commit', 'commit_message']
+
+# URL schemes of sources cloned over the network, anything else is a path on the service host
+REMOTE_SOURCE_SCHEMES = ['https', 'http', 'ssh', 'git']
+
+# Remote sources in the scp-like syntax of git, ie git@github.com:org/repo.git
+_SCP_LIKE_SOURCE = re.compile(r'^[\w.-]+@[\w.-]+:')
+
+class ServiceError(Exception):
+    "Raised for requests the service can not accept, status is the HTTP status to answer with"
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+@attrs.define
+class ServiceJob(object):
+    "A generation job along with its progress and generated files"
+
+    job_id: str
+    request: dict
+    status: str = STATUS_QUEUED
+
+    created: float = attrs.Factory(time.time)
+    started: float = None
+    finished: float = None
+
+    # Generated files as a dictionary of filename to bytes
+    files: dict = attrs.Factory(dict)
+
+    dockerurl: str = None
+    image_reference: str = None
+
+    # Status of the push to each registry destination
+    pushes: dict = attrs.Factory(dict)
+
+    error: str = None
+
+    # Progress of the job as a list of dictionaries, see event()
+    events: list = attrs.Factory(list)
+    condition: threading.Condition = attrs.field(factory=threading.Condition, repr=False, eq=False)
+
+    @property
+    def done(self):
+        return self.status in (STATUS_SUCCEEDED, STATUS_FAILED)
+
+    def event(self, event, **fields):
+        "Records an event and wakes up anyone streaming the events of this job"
+
+        with self.condition:
+            self.events.append(dict(time=time.time(), event=event, **fields))
+            self.condition.notify_all()
+
+    def wait_events(self, start, timeout=None):
+        """Returns the events from index start on, waiting up to timeout seconds for one if there are none.
+
+        Also returns whether the job had finished, in which case no further events follow."""
+
+        with self.condition:
+            if len(self.events) <= start and not self.done:
+                self.condition.wait(timeout)
+            return self.events[start:], self.done
+
+    def as_dict(self):
+        return {
+            'job_id': self.job_id,
+            'status': self.status,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            'seconds': self.finished - self.started if self.finished is not None and self.started is not None else None,
+            'files': sorted(self.files),
+            'dockerurl': self.dockerurl,
+            'image_reference': self.image_reference,
+            'pushes': self.pushes,
+            'error': self.error,
+        }
+
+def is_local_source(source):
+    "Whether the git source is a path or file:// URL on this host rather than a remote repository"
+
+    scheme, separator, _ = source.partition('://')
+    if separator:
+        return scheme.lower() not in REMOTE_SOURCE_SCHEMES
+    return _SCP_LIKE_SOURCE.match(source) is None
+
+def check_job_request(request, allow_local_sources=False):
+    """Raises a ServiceError unless request describes a job the service can run.
+
+    Local sources are refused unless allow_local_sources is set, they give access to any
+    repository readable by the service.
+    """
+
+    if not isinstance(request, dict):
+        raise ServiceError("Job requests must be JSON objects")
+
+    unknown = sorted(set(request) - set(JOB_REQUEST_KEYS))
+    if unknown:
+        raise ServiceError(f"Unknown job request keys: {', '.join(unknown)}")
+
+    notebook = request.get('notebook')
+    source = request.get('source')
+
+    if isinstance(notebook, dict):
+        if source is not None:
+            raise ServiceError("Give either a notebook or a repository source, not both")
+        if request.get('build'):
+            raise ServiceError("Building an image requires a repository source")
+    elif not isinstance(source, str):
+        raise ServiceError("Job requests need a notebook object or a repository source")
+    elif any(key in request for key in INLINE_REPOSITORY_KEYS):
+        raise ServiceError(f"{', '.join(INLINE_REPOSITORY_KEYS)} are taken from the repository source")
+    elif notebook is not None and not isinstance(notebook, str):
+        raise ServiceError("With a repository source, notebook is the path of the notebook inside the repository")
+    elif notebook is not None and (os.path.isabs(notebook) or '..' in re.split(r'[/\\]', notebook)):
+        raise ServiceError("notebook must be a relative path inside the repository")
+    elif not allow_local_sources and is_local_source(source):
+        raise ServiceError(f"Local sources are not allowed, give the URL of a remote repository instead of {source}")
+
+    if not isinstance(request.get('registries', []), list):
+        raise ServiceError("registries must be a list of registry URLs")
+
+class GenerationService(object):
+    """Runs generation jobs in a pool of threads while keeping everything reusable loaded.
+
+    At most max_jobs run at the same time and at most max_queued wait for their turn.
+    Repositories are cloned through a GitMirrorCache, by default inside workdir, so only
+    the first job for a repository fetches it over the network. Sources on the local host
+    are only accepted with allow_local_sources. The Docker client is connected on the first
+    build and shared by all later builds.
+    """
+
+    def __init__(self, workdir=None, max_jobs=DEFAULT_MAX_JOBS, max_queued=DEFAULT_MAX_QUEUED,
+                 max_finished=DEFAULT_MAX_FINISHED, mirror_cache=None, template_dir=None,
+                 docker_client=None, docker_args=None, mirror_refresh=DEFAULT_MIRROR_REFRESH_SECONDS,
+                 allow_local_sources=False):
+
+        self.workdir = os.path.abspath(workdir if workdir is not None else tempfile.mkdtemp(prefix='app-pack-service-'))
+        self.template_dir = os.path.abspath(template_dir or os.path.join(LOCAL_PATH, 'templates'))
+
+        if mirror_cache is None:
+            mirror_cache = GitMirrorCache(os.path.join(self.workdir, 'mirrors'))
+        self.mirror_cache = mirror_cache
+        self.mirror_refresh = mirror_refresh
+        self.allow_local_sources = allow_local_sources
+
+        # Time each source was last fetched into its mirror
+        self._mirror_fetched = {}
+
+        self.max_jobs = max_jobs
+        self.max_queued = max_queued
+        self.max_finished = max_finished
+
+        # Additional keyword arguments for DockerUtil
+        self.docker_args = dict(docker_args or {})
+
+        self.jobs = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix='app-pack-job')
+
+        self._docker_client = docker_client
+        self._docker_lock = threading.Lock()
+
+    @property
+    def docker_client(self):
+        "Docker client shared by all builds, connected on first use"
+
+        with self._docker_lock:
+            if self._docker_client is None:
+                import docker
+                from .docker import DOCKER_CLIENT_TIMEOUT
+                self._docker_client = docker.from_env(timeout=DOCKER_CLIENT_TIMEOUT)
+            return self._docker_client
+
+    def warm(self):
+        "Compiles the notebook schemas and parses the templates ahead of the first job"
+
+        start_time = time.perf_counter()
+
+        NOTEBOOK_SCHEMAS.preload()
+        TEMPLATE_STORE.preload(self.template_dir)
+
+        logger.info(f"Loaded schemas and templates in {time.perf_counter() - start_time:.3f} seconds")
+
+    def counts(self):
+        "Number of jobs per status"
+
+        with self._lock:
+            return dict(collections.Counter(job.status for job in self.jobs.values()))
+
+    def _forget_finished(self):
+        "Drops the oldest finished jobs beyond max_finished, called with the lock held"
+
+        finished = [ job_id for job_id, job in self.jobs.items() if job.done ]
+        for job_id in finished[:max(len(finished) - self.max_finished, 0)]:
+            del self.jobs[job_id]
+
+    def submit(self, request):
+        "Queues a job for request, returns the ServiceJob and a future resolving to it once it finished"
+
+        check_job_request(request, allow_local_sources=self.allow_local_sources)
+
+        with self._lock:
+            queued = sum(1 for job in self.jobs.values() if job.status == STATUS_QUEUED)
+            if queued >= self.max_queued:
+                raise ServiceError("Too many queued jobs, try again later", status=503)
+
+            job = ServiceJob(job_id=uuid.uuid4().hex, request=request)
+            self.jobs[job.job_id] = job
+            self._forget_finished()
+
+        job.event(STATUS_QUEUED)
+        future = self._executor.submit(self._run, job)
+
+        return job, future
+
+    def generate(self, request, timeout=None):
+        "Runs a job for request and waits for it to finish, returns the ServiceJob"
+
+        job, future = self.submit(request)
+        return future.result(timeout)
+
+    def list_jobs(self):
+        with self._lock:
+            return list(self.jobs.values())
+
+    def get(self, job_id):
+        with self._lock:
+            job = self.jobs.get(job_id)
+
+        if job is None:
+            raise ServiceError(f"No job {job_id}", status=404)
+
+        return job
+
+    def forget(self, job_id):
+        job = self.get(job_id)
+        if not job.done:
+            raise ServiceError(f"Job {job_id} has not finished", status=409)
+
+        with self._lock:
+            self.jobs.pop(job_id, None)
+
+    def _run(self, job):
+        "Worker entry point, reports errors in the job instead of raising them"
+
+        job.started = time.time()
+        job.status = STATUS_RUNNING
+        job.event(STATUS_RUNNING)
+
+        job_dir = os.path.join(self.workdir, 'jobs', job.job_id)
+        try:
+            self._execute(job, job_dir)
+            status = STATUS_SUCCEEDED
+        except Exception as e:
+            logger.error(f"Job {job.job_id} failed: {e}")
+            job.error = f"{type(e).__name__}: {e}"
+            status = STATUS_FAILED
+        finally:
+            shutil.rmtree(job_dir, ignore_errors=True)
+
+        job.finished = time.time()
+        job.status = status
+        job.event(status, error=job.error, seconds=job.finished - job.started)
+
+        return job
+
+    def _refresh_mirror(self, source, ref):
+        "Fetches the mirror of source unless it was fetched within mirror_refresh seconds or ref is a commit hash"
+
+        if not ref_may_move(ref):
+            return
+
+        with self._lock:
+            last_fetched = self._mirror_fetched.get(source)
+            if last_fetched is not None and time.monotonic() - last_fetched < self.mirror_refresh:
+                return
+
+        # Failed fetches are not recorded so the next job tries again
+        fetch_started = time.monotonic()
+        self.mirror_cache.ensure(source, refresh=True)
+
+        with self._lock:
+            self._mirror_fetched[source] = fetch_started
+
+    def _execute(self, job, job_dir):
+        request = job.request
+
+        if isinstance(request.get('notebook'), dict):
+            name = request.get('name', 'notebook')
+            app = ApplicationNotebook(f"{name}.ipynb", notebook=request['notebook'])
+
+            commit = request.get('commit')
+            if commit is None:
+                notebook_digest = hashlib.sha256(json.dumps(request['notebook'], sort_keys=True).encode('utf-8'))
+                commit = notebook_digest.hexdigest()[:8]
+
+            repo = RepositoryInfo(name=name, owner=request.get('owner'), commit_identifier=commit,
+                                  commit_message=request.get('commit_message', name))
+        else:
+            self._refresh_mirror(request['source'], request.get('ref'))
+
+            # Mirror refreshes are rate limited by the service rather than made for every clone
+            repo = GitManager(request['source'], os.path.join(job_dir, 'repo'), mirror_cache=self.mirror_cache,
+                              refresh_mirror=False)
+            if request.get('ref') is not None:
+                repo.checkout(request['ref'])
+            job.event('cloned', commit=repo.commit_identifier)
+
+            app = ApplicationNotebook(os.path.join(repo.directory, request.get('notebook', 'process.ipynb')))
+
+        job.event('parsed', parameters=[ param.name for param in app.notebook_parameters ])
+
+        job.dockerurl = request.get('dockerurl')
+        if request.get('build'):
+            self._build(job, repo)
+        if job.dockerurl is None:
+            job.dockerurl = "undefined"
+
+        sink = MemorySink()
+        write_package(app, repo, sink, dockerurl=job.dockerurl, template_dir=self.template_dir)
+        job.files = sink.files
+
+        job.event('generated', files=sorted(job.files))
+
+    def _build(self, job, git_mgr):
+        from .docker import DockerUtil
+
+        docker_util = DockerUtil(git_mgr, docker_client=self.docker_client, **self.docker_args)
+
+        job.image_reference = docker_util.build_image(
+            progress_callback=lambda build_event: job.event('build', phase=build_event.phase, line=build_event.line))
+        job.event('built', image_reference=job.image_reference)
+
+        registries = job.request.get('registries', [])
+        if len(registries) > 0:
+            # Jobs for an unchanged repository find their image already pushed
+            results = docker_util.push_images(registries, image_reference=job.image_reference, skip_existing=True)
+            job.pushes = { result.destination: result.status for result in results }
+            job.event('pushed', pushes=job.pushes)
+
+        if job.dockerurl is None:
+            job.dockerurl = f"{registries[0]}/{job.image_reference}" if len(registries) > 0 else job.image_reference
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+class ServiceRequestHandler(http.server.BaseHTTPRequestHandler):
+    "Maps the HTTP endpoints onto the GenerationService of the server"
+
+    server_version = f"app-pack-generator/{__version__}"
+
+    ROUTES = [
+        ('GET', re.compile(r'^/health$'), 'health'),
+        ('POST', re.compile(r'^/generate$'), 'generate'),
+        ('GET', re.compile(r'^/jobs$'), 'list_jobs'),
+        ('POST', re.compile(r'^/jobs$'), 'submit_job'),
+        ('GET', re.compile(r'^/jobs/(?P<job_id>\w+)$'), 'get_job'),
+        ('DELETE', re.compile(r'^/jobs/(?P<job_id>\w+)$'), 'forget_job'),
+        ('GET', re.compile(r'^/jobs/(?P<job_id>\w+)/events$'), 'job_events'),
+        ('GET', re.compile(r'^/jobs/(?P<job_id>\w+)/artifacts/(?P<name>[^/]+)$'), 'job_artifact'),
+        ('GET', re.compile(r'^/jobs/(?P<job_id>\w+)/package\.zip$'), 'job_package'),
+    ]
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def address_string(self):
+        # Clients of Unix sockets have no address
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, value):
+        self._send(status, json.dumps(value).encode('utf-8'), 'application/json')
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            return json.loads(self.rfile.read(length))
+        except ValueError as e:
+            raise ServiceError(f"Request body is not valid JSON: {e}")
+
+    def _dispatch(self, method):
+        path = self.path.split('?', 1)[0]
+
+        allowed = []
+        for route_method, pattern, handler_name in self.ROUTES:
+            match = pattern.match(path)
+            if match is None:
+                continue
+            if route_method != method:
+                allowed.append(route_method)
+                continue
+
+            try:
+                getattr(self, handler_name)(**match.groupdict())
+            except ServiceError as e:
+                self._send_json(e.status, {'error': str(e)})
+            return
+
+        if allowed:
+            self._send_json(405, {'error': f"{method} is not allowed for {path}"})
+        else:
+            self._send_json(404, {'error': f"No endpoint {path}"})
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def health(self):
+        self._send_json(200, {'status': 'ok', 'version': __version__, 'jobs': self.service.counts()})
+
+    def generate(self):
+        job = self.service.generate(self._read_json())
+
+        result = job.as_dict()
+        result['files'] = { name: data.decode('utf-8') for name, data in job.files.items() }
+        self._send_json(200 if job.status == STATUS_SUCCEEDED else 422, result)
+
+    def list_jobs(self):
+        self._send_json(200, [ job.as_dict() for job in self.service.list_jobs() ])
+
+    def submit_job(self):
+        job, _ = self.service.submit(self._read_json())
+        self._send_json(202, job.as_dict())
+
+    def get_job(self, job_id):
+        self._send_json(200, self.service.get(job_id).as_dict())
+
+    def forget_job(self, job_id):
+        self.service.forget(job_id)
+        self._send_json(200, {'job_id': job_id})
+
+    def job_events(self, job_id):
+        job = self.service.get(job_id)
+
+        # Without a Content-Length the response ends when the connection is closed
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+
+        index = 0
+        while True:
+            events, done = job.wait_events(index, timeout=EVENTS_POLL_SECONDS)
+            for event in events:
+                self.wfile.write(json.dumps(event).encode('utf-8') + b"\n")
+            self.wfile.flush()
+            index += len(events)
+
+            if done and index >= len(job.events):
+                break
+
+        self.close_connection = True
+
+    def _finished_job(self, job_id):
+        job = self.service.get(job_id)
+        if not job.done:
+            raise ServiceError(f"Job {job_id} has not finished", status=409)
+        return job
+
+    def job_artifact(self, job_id, name):
+        job = self._finished_job(job_id)
+        if name not in job.files:
+            raise ServiceError(f"Job {job_id} has no file {name}", status=404)
+
+        content_type = 'application/json' if name.endswith('.json') else 'application/x-yaml'
+        self._send(200, job.files[name], content_type)
+
+    def job_package(self, job_id):
+        job = self._finished_job(job_id)
+
+        output = io.BytesIO()
+        with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_DEFLATED) as zip_file:
+            sink = ZipSink(zip_file)
+            for name in sorted(job.files):
+                sink.write(name, job.files[name])
+
+        self._send(200, output.getvalue(), 'application/zip')
+
+class ServiceHTTPServer(http.server.ThreadingHTTPServer):
+    "HTTP server answering requests with a GenerationService"
+
+    daemon_threads = True
+
+    def __init__(self, server_address, service, handler_class=ServiceRequestHandler):
+        self.service = service
+        super().__init__(server_address, handler_class)
+
+class ServiceUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    "HTTP server listening on a Unix socket, only reachable by users allowed to open the socket file"
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, service, handler_class=ServiceRequestHandler):
+        self.service = service
+
+        # A socket file left behind by a previous server prevents binding
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+        super().__init__(socket_path, handler_class)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+def create_server(service, host=DEFAULT_HOST, port=DEFAULT_PORT, socket_path=None):
+    "HTTP server for service listening on the Unix socket socket_path if given, otherwise on host and port"
+
+    if socket_path is not None:
+        return ServiceUnixHTTPServer(socket_path, service)
+
+    return ServiceHTTPServer((host, port), service)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"Address to listen on, {DEFAULT_HOST} by default")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port to listen on, {DEFAULT_PORT} by default")
+    parser.add_argument("--socket", help="Listen on this Unix socket instead of a TCP port")
+    parser.add_argument("--workdir", help="Directory for clones and git mirrors, a temporary directory by default")
+    parser.add_argument("--mirror-cache", help="GitMirrorCache directory, inside the work directory by default")
+    parser.add_argument("--template-dir", help="Directory with the templates used for generation")
+    parser.add_argument("--max-jobs", type=int, default=DEFAULT_MAX_JOBS, help="Number of jobs running at the same time")
+    parser.add_argument("--max-queued", type=int, default=DEFAULT_MAX_QUEUED, help="Number of waiting jobs before new ones are refused")
+    parser.add_argument("--allow-local-sources", action="store_true", help="Accept jobs cloning paths and file:// URLs on this host")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Log debug messages")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    service = GenerationService(workdir=args.workdir, max_jobs=args.max_jobs, max_queued=args.max_queued,
+                                mirror_cache=GitMirrorCache(args.mirror_cache) if args.mirror_cache else None,
+                                template_dir=args.template_dir, allow_local_sources=args.allow_local_sources)
+    service.warm()
+
+    try:
+        server = create_server(service, host=args.host, port=args.port, socket_path=args.socket)
+    except OSError as e:
+        parser.error(str(e))
+
+    logger.info(f"Serving application package generation on {args.socket or f'http://{args.host}:{args.port}'}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown(wait=False)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+import os
+import json
+import logging
+import threading
+
+import yaml
+
+from .instrument import span
+
+try:
+    # Use the libyaml based loader when available, it is much faster than the pure Python one
+    from yaml import CSafeLoader as TemplateLoader
+except ImportError:
+    from yaml import SafeLoader as TemplateLoader
+
+logger = logging.getLogger(__name__)
+
+def copy_structure(value):
+    """Copies parsed JSON/YAML data made of dicts and lists.
+
+    Much cheaper than copy.deepcopy since other values in parsed templates are immutable.
+    """
+
+    if isinstance(value, dict):
+        return { key: copy_structure(item) for key, item in value.items() }
+    elif isinstance(value, list):
+        return [ copy_structure(item) for item in value ]
+    else:
+        return value
+
+class TemplateStore(object):
+    """Parses each template file once and hands out independent copies of the result.
+
+    Templates are parsed again when their modification time or size change. YAML templates
+    are parsed with the libyaml loader when available, .json files are parsed as JSON.
+    """
+
+    def __init__(self):
+
+        # Parsed templates keyed by absolute filename, along with the stat signature they were parsed from
+        self._templates = {}
+        self._lock = threading.Lock()
+
+    def _parse(self, template_fname):
+        with open(template_fname, 'r') as f:
+            if template_fname.endswith('.json'):
+                return json.load(f)
+            else:
+                return yaml.load(f, Loader=TemplateLoader)
+
+    def load(self, template_fname):
+        "Returns a copy of the parsed template that the caller is free to modify"
+
+        template_fname = os.path.abspath(template_fname)
+        stat = os.stat(template_fname)
+        signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+        cached = self._templates.get(template_fname)
+        if cached is None or cached[0] != signature:
+            logger.debug(f"Parsing template {template_fname}")
+            with span('template.load', template=template_fname):
+                parsed = self._parse(template_fname)
+
+            with self._lock:
+                self._templates[template_fname] = (signature, parsed)
+        else:
+            parsed = cached[1]
+
+        return copy_structure(parsed)
+
+    def preload(self, template_dir):
+        "Parses all templates inside template_dir ahead of their first use"
+
+        for fname in sorted(os.listdir(template_dir)):
+            if os.path.splitext(fname)[1] in ('.cwl', '.json', '.yml', '.yaml'):
+                self.load(os.path.join(template_dir, fname))
+
+    def clear(self):
+        with self._lock:
+            self._templates.clear()
+
+# Shared by all generators in this process
+TEMPLATE_STORE = TemplateStore()
+
+def load_template(template_fname):
+    "Returns an independent copy of a parsed template from the process wide template store"
+
+    return TEMPLATE_STORE.load(template_fname)
@@ -1,6 +1,50 @@
-import requests
-import datetime
-import yaml
+import os
+import time
+import logging
+import threading
+
+from .instrument import span
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+class FileLock(object):
+    """Exclusive lock on a file, shared between threads and processes.
+
+    Used as a context manager to serialize access to on-disk caches that may be
+    used concurrently by several CI workers.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._thread_lock = threading.Lock()
+        self._lock_file = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.filename)), exist_ok=True)
+            self._lock_file = open(self.filename, 'a+')
+            if fcntl is not None:
+                fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+        except BaseException:
+            self._thread_lock.release()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
+        finally:
+            self._thread_lock.release()
 
 class Util:
 
@@ -12,27 +56,39 @@ class Util:
         As this function does not utilize a decorator, it can
         be used to time any arbitrary function call as opposed
         to only the ones the programmer declares.
+
+        Returns the elapsed milliseconds and the function result. The call is also
+        recorded as a span, see instrument.span for structured timings.
         """
-        start = datetime.datetime.now()
-        ret = func(*args, **kwargs)
-        time_diff = datetime.datetime.now() - start
-        return time_diff.total_seconds() * 1000, ret
+        with span(getattr(func, '__qualname__', repr(func))):
+            start = time.perf_counter_ns()
+            ret = func(*args, **kwargs)
+            time_diff = time.perf_counter_ns() - start
+        return time_diff / 1e6, ret
 
 
     @staticmethod
-    def DownloadLink(url, default=None):
+    def DownloadLink(url, default=None, downloader=None):
         """Downloads the specified URL via a GET request.
 
         If url is not a valid link, or if the request fails, returns the [default]
         parameter instead.
+
+        Requests go through a shared download.Downloader, or the one given, which
+        pools connections, bounds the time spent waiting on the server, retries
+        failures and caches files on disk so unchanged files are not downloaded again.
         """
+        from .download import default_downloader
+
+        if downloader is None:
+            downloader = default_downloader()
+
         try:
-            response = requests.get(url)
+            response = downloader.get(url)
             if response.status_code == 404:
                 raise RuntimeError('<Response 404>')
             return response
         except Exception as e:
             if url.startswith('http://') or url.startswith('https://'):
-                print('Could not download assumed URL: \'' + url + '\'')
-                print(e)
+                logger.warning(f"Could not download assumed URL '{url}': {e}")
         return default
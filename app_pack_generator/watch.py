@@ -0,0 +1,235 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+
+from .loader import load_notebook
+from .application import ApplicationNotebook, find_parameters_cell, cell_source
+from .cwl import ProcessCWL, DataStagingCWL
+from .descriptor import Descriptor
+from .output import IncrementalDirectorySink
+from .batch import notebook_relpath
+
+logger = logging.getLogger(__name__)
+
+LOCAL_PATH = os.path.dirname(os.path.realpath(__file__))
+
+# Seconds without further changes before regenerating
+DEFAULT_DEBOUNCE_SECONDS = 0.5
+
+# Seconds between checks of the watched files when filesystem notifications are not available
+DEFAULT_POLL_SECONDS = 1.0
+
+# Templates and the generated file rendered from each of them
+TEMPLATE_OUTPUTS = {
+    'process.cwl': 'process.cwl',
+    'workflow.cwl': 'workflow.cwl',
+    'stage_in.cwl': 'stage_in.cwl',
+    'stage_out.cwl': 'stage_out.cwl',
+    'app_desc.json': 'applicationDescriptor.json',
+}
+
+# Generated files that depend on the notebook parameters
+PARAMETER_OUTPUTS = ('process.cwl', 'workflow.cwl', 'applicationDescriptor.json')
+
+def parameters_hash(notebook):
+    "Hash of the parameters cell of a loaded notebook, the only part of it used for generation"
+
+    parameters_cell = find_parameters_cell(notebook)
+    source = cell_source(parameters_cell) if parameters_cell is not None else ''
+
+    return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+class PackageWatcher(object):
+    """Keeps the application package of a notebook up to date while it is being edited.
+
+    The parsed notebook is kept in memory. When the notebook changes its parameters are
+    only extracted again if the parameters cell changed, and only the generated files
+    depending on the changed notebook or templates are emitted again. Generated files
+    whose contents stay the same are not rewritten.
+
+    Changes are picked up through the watchdog package when it is installed, otherwise
+    by polling the modification times of the watched files.
+    """
+
+    def __init__(self, notebook_filename, outdir, repo, dockerurl="undefined", template_dir=None,
+                 debounce=DEFAULT_DEBOUNCE_SECONDS, poll_interval=DEFAULT_POLL_SECONDS, polling=None):
+
+        self.notebook_filename = os.path.abspath(notebook_filename)
+        self.repo = repo
+        self.dockerurl = dockerurl
+        self.template_dir = os.path.abspath(template_dir or os.path.join(LOCAL_PATH, 'templates'))
+
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.polling = polling
+
+        self.sink = IncrementalDirectorySink(outdir)
+
+        self.app = None
+        self.parameters_hash = None
+
+        self._pending = set()
+        self._last_change = None
+        self._lock = threading.Lock()
+        self._signatures = {}
+
+    @property
+    def watched_files(self):
+        return [ self.notebook_filename ] + \
+               [ os.path.join(self.template_dir, template) for template in TEMPLATE_OUTPUTS ]
+
+    def _parse_notebook(self):
+        self.app = ApplicationNotebook(self.notebook_filename, streaming=True)
+        self.parameters_hash = parameters_hash(self.app.notebook)
+
+    def _affected_outputs(self, changed_files):
+        outputs = set()
+
+        for fname in changed_files:
+            fname = os.path.abspath(fname)
+
+            if fname == self.notebook_filename:
+                current_hash = parameters_hash(load_notebook(self.notebook_filename, skip_outputs=True))
+
+                if current_hash != self.parameters_hash:
+                    logger.info(f"Parameters of {self.notebook_filename} changed")
+                    self._parse_notebook()
+                    outputs.update(PARAMETER_OUTPUTS)
+                else:
+                    logger.debug(f"Parameters of {self.notebook_filename} are unchanged")
+
+            elif os.path.dirname(fname) == self.template_dir and os.path.basename(fname) in TEMPLATE_OUTPUTS:
+                outputs.add(TEMPLATE_OUTPUTS[os.path.basename(fname)])
+
+        return outputs
+
+    def update(self, changed_files=None):
+        """Emits the generated files affected by changed_files, or all of them when None.
+
+        Returns the names of the generated files that were rewritten.
+        """
+
+        if changed_files is None or self.app is None:
+            self._parse_notebook()
+            outputs = set(TEMPLATE_OUTPUTS.values())
+        else:
+            outputs = self._affected_outputs(changed_files)
+
+        app = self.app
+        template_dir = self.template_dir
+
+        emitters = {
+            'process.cwl': lambda: ProcessCWL(app, notebook_path=notebook_relpath(self.notebook_filename, self.repo.directory),
+                                              template_dir=template_dir).generate_process_cwl(self.sink, self.dockerurl),
+            'workflow.cwl': lambda: DataStagingCWL(app, template_dir=template_dir).generate_workflow_cwl(self.sink),
+            'stage_in.cwl': lambda: DataStagingCWL(app, template_dir=template_dir).generate_stage_in_cwl(self.sink),
+            'stage_out.cwl': lambda: DataStagingCWL(app, template_dir=template_dir).generate_stage_out_cwl(self.sink),
+            'applicationDescriptor.json': lambda: Descriptor(app, self.repo, templatedir=template_dir).generate_descriptor(self.sink, self.dockerurl),
+        }
+
+        self.sink.written = []
+        for output in TEMPLATE_OUTPUTS.values():
+            if output in outputs:
+                emitters[output]()
+
+        if len(self.sink.written) > 0:
+            logger.info(f"Regenerated {', '.join(self.sink.written)}")
+
+        return self.sink.written
+
+    def notify(self, fname):
+        "Records a change to fname, the update happens once no change was seen for the debounce period"
+
+        with self._lock:
+            self._pending.add(os.path.abspath(fname))
+            self._last_change = time.monotonic()
+
+    def _file_signature(self, fname):
+        try:
+            stat = os.stat(fname)
+            return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        except FileNotFoundError:
+            return None
+
+    def poll(self):
+        "Checks the watched files for changes since the last poll"
+
+        for fname in self.watched_files:
+            signature = self._file_signature(fname)
+
+            if fname in self._signatures and self._signatures[fname] != signature:
+                self.notify(fname)
+            self._signatures[fname] = signature
+
+    def _start_observer(self):
+        "Starts a watchdog observer notifying this watcher, returns None when watchdog is not installed"
+
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+        except ImportError:
+            return None
+
+        watched_files = set(self.watched_files)
+        watcher = self
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                # Editors often save by moving a temporary file over the original
+                for path in (event.src_path, getattr(event, 'dest_path', None)):
+                    if path and os.path.abspath(path) in watched_files:
+                        watcher.notify(path)
+
+        observer = Observer()
+        for directory in set([ os.path.dirname(fname) for fname in watched_files ]):
+            observer.schedule(Handler(), directory, recursive=False)
+        observer.start()
+
+        return observer
+
+    def _flush(self):
+        "Runs the update for pending changes once they have settled"
+
+        with self._lock:
+            if not self._pending or time.monotonic() - self._last_change < self.debounce:
+                return
+            changed_files, self._pending = self._pending, set()
+
+        try:
+            self.update(changed_files)
+        except Exception as e:
+            # The notebook is likely saved half way through an edit, wait for the next change
+            logger.error(f"Could not regenerate the package for {self.notebook_filename}: {e}")
+
+    def run(self, stop_event=None):
+        "Generates the package, then keeps it up to date until stop_event is set"
+
+        if stop_event is None:
+            stop_event = threading.Event()
+
+        # Start watching before the first update so that edits made during it are not missed
+        observer = None
+        if not self.polling:
+            observer = self._start_observer()
+
+        if observer is None:
+            logger.info(f"Polling {self.notebook_filename} and templates every {self.poll_interval} seconds")
+            self.poll()
+        else:
+            logger.info(f"Watching {self.notebook_filename} and templates for changes")
+
+        try:
+            self.update()
+
+            while not stop_event.is_set():
+                if observer is None:
+                    self.poll()
+                self._flush()
+
+                stop_event.wait(min(self.poll_interval, self.debounce) if observer is None else self.debounce / 2)
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
@@ -0,0 +1,205 @@
+"""Benchmarks notebook parsing and application package generation.
+
+Results, including throughput and peak traced memory, are stored as JSON so that runs from
+different releases can be compared:
+
+    python benchmarks/run_benchmarks.py --output results-1.1.0.json
+    python benchmarks/run_benchmarks.py --output results-new.json --compare results-1.1.0.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
+
+from app_pack_generator import ApplicationNotebook, ProcessCWL, DataStagingCWL, Descriptor, __version__
+from app_pack_generator.batch import RepositoryInfo
+from app_pack_generator.output import MemorySink, DirectorySink
+from app_pack_generator.template_store import TEMPLATE_STORE
+
+from synthetic import write_synthetic_notebook
+
+PACKAGE_ROOT = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..")
+TEMPLATE_DIR = os.path.join(PACKAGE_ROOT, "app_pack_generator", "templates")
+
+REPO = RepositoryInfo(name="benchmark", owner="unity-sds", commit_identifier="0123abcd", commit_message="Benchmark")
+
+# Notebook shapes exercised by the parsing benchmarks
+NOTEBOOK_SCENARIOS = {
+    "small": dict(num_cells=10, output_bytes=0, num_parameters=5),
+    "many_cells": dict(num_cells=2000, output_bytes=0, num_parameters=5),
+    "many_parameters": dict(num_cells=10, output_bytes=0, num_parameters=500),
+    "large_outputs": dict(num_cells=50, output_bytes=50 * 1024 * 1024, num_parameters=5),
+}
+
+def measure(func, min_time=1.0, max_iterations=1000):
+    """Calls func repeatedly for at least min_time seconds.
+
+    Returns the timing statistics along with the peak memory traced during a single call."""
+
+    tracemalloc.start()
+    func()
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings = []
+    total_start = time.perf_counter()
+    while len(timings) < max_iterations and time.perf_counter() - total_start < min_time:
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+
+    timings.sort()
+    return {
+        "iterations": len(timings),
+        "mean_seconds": sum(timings) / len(timings),
+        "median_seconds": timings[len(timings) // 2],
+        "min_seconds": timings[0],
+        "ops_per_second": len(timings) / sum(timings),
+        "peak_memory_bytes": peak_bytes,
+    }
+
+def notebook_benchmarks(workdir, min_time):
+    results = {}
+
+    for name, scenario in NOTEBOOK_SCENARIOS.items():
+        nb_filename = os.path.join(workdir, f"{name}.ipynb")
+        notebook_bytes = write_synthetic_notebook(nb_filename, **scenario)
+
+        app = ApplicationNotebook(nb_filename)
+
+        def cwl_types():
+            return [ param.cwl_type for param in app.notebook_parameters ]
+
+        def generate_process():
+            return ProcessCWL(app).generate_all(MemorySink(), dockerurl="benchmark/app:latest")
+
+        def generate_staging():
+            return DataStagingCWL(app).generate_all(MemorySink())
+
+        def generate_descriptor():
+            return Descriptor(app, REPO).generate_descriptor(MemorySink(), "benchmark/app:latest")
+
+        outdir = os.path.join(workdir, f"{name}-output")
+        def generate_to_disk():
+            sink = DirectorySink(outdir)
+            ProcessCWL(app).generate_all(sink, dockerurl="benchmark/app:latest")
+            DataStagingCWL(app).generate_all(sink)
+            Descriptor(app, REPO).generate_descriptor(sink, "benchmark/app:latest")
+
+        benchmarks = {
+            "parse_notebook": lambda: ApplicationNotebook(nb_filename, streaming=False),
+            "parse_notebook_streaming": lambda: ApplicationNotebook(nb_filename, streaming=True),
+            "cwl_type": cwl_types,
+            "process_cwl": generate_process,
+            "data_staging_cwl": generate_staging,
+            "descriptor": generate_descriptor,
+            "generate_to_disk": generate_to_disk,
+        }
+
+        for bench_name, func in benchmarks.items():
+            result = measure(func, min_time=min_time)
+            result["scenario"] = dict(scenario, notebook_bytes=notebook_bytes)
+            results[f"{bench_name}[{name}]"] = result
+
+            print(f"{bench_name}[{name}]: {result['median_seconds'] * 1000:.3f} ms median, "
+                  f"{result['ops_per_second']:.1f} ops/s, {result['peak_memory_bytes'] / 1024:.0f} KiB peak")
+
+    return results
+
+def template_benchmarks(min_time):
+    results = {}
+
+    template_fnames = [ os.path.join(TEMPLATE_DIR, fname) for fname in sorted(os.listdir(TEMPLATE_DIR))
+                        if fname.endswith((".cwl", ".json")) ]
+
+    def cold_load():
+        TEMPLATE_STORE.clear()
+        for fname in template_fnames:
+            TEMPLATE_STORE.load(fname)
+
+    def warm_load():
+        for fname in template_fnames:
+            TEMPLATE_STORE.load(fname)
+
+    for bench_name, func in [("template_load_cold", cold_load), ("template_load_warm", warm_load)]:
+        results[bench_name] = measure(func, min_time=min_time)
+        print(f"{bench_name}: {results[bench_name]['median_seconds'] * 1000:.3f} ms median")
+
+    return results
+
+# Statements timed in a fresh interpreter, as run by short lived CLI or serverless invocations
+IMPORT_SCENARIOS = {
+    "interpreter_startup": "pass",
+    "import_package": "import app_pack_generator",
+    "import_cwl": "from app_pack_generator import ApplicationNotebook, ProcessCWL, DataStagingCWL, Descriptor",
+    "import_all": "from app_pack_generator import *",
+}
+
+def import_benchmarks(min_time):
+    results = {}
+
+    env = dict(os.environ, PYTHONPATH=PACKAGE_ROOT)
+    for name, statement in IMPORT_SCENARIOS.items():
+        def run_interpreter():
+            subprocess.run([sys.executable, "-c", statement], env=env, check=True)
+
+        results[name] = measure(run_interpreter, min_time=min_time, max_iterations=100)
+        print(f"{name}: {results[name]['median_seconds'] * 1000:.3f} ms median")
+
+    return results
+
+def compare(results, baseline_fname, threshold):
+    "Prints benchmarks that are slower than in the baseline results by more than threshold"
+
+    with open(baseline_fname) as f:
+        baseline = json.load(f)["benchmarks"]
+
+    regressions = 0
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+
+        ratio = result["median_seconds"] / baseline[name]["median_seconds"]
+        if ratio > 1 + threshold:
+            regressions += 1
+            print(f"REGRESSION {name}: {ratio:.2f}x slower than baseline")
+
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file receiving the results")
+    parser.add_argument("--compare", help="Results JSON of a previous run to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Relative slowdown reported as a regression")
+    parser.add_argument("--min-time", type=float, default=1.0, help="Minimum seconds spent on each benchmark")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        results = notebook_benchmarks(workdir, args.min_time)
+    results.update(template_benchmarks(args.min_time))
+    results.update(import_benchmarks(args.min_time))
+
+    with open(args.output, "w") as f:
+        json.dump({
+            "version": __version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "benchmarks": results,
+        }, f, indent=4)
+
+    if args.compare is not None and compare(results, args.compare, args.threshold) > 0:
+        return 1
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
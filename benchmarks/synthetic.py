@@ -0,0 +1,80 @@
+"""Synthetic Jupyter notebooks for benchmarking notebook parsing and package generation."""
+
+import json
+import base64
+import random
+
+PARAMETER_TEMPLATES = [
+    "int_param_{i} = {i}",
+    "float_param_{i} = {i}.5 # Floating point parameter",
+    "string_param_{i} = 'value {i}' # type: string A string parameter",
+    "bool_param_{i} = True",
+    "list_param_{i} = [1, 2, {i}] # type: Any",
+    "none_param_{i} = None # type: string Optional value",
+]
+
+def parameters_source(num_parameters, stage_in=True, stage_out=True):
+    "Source code of a papermill parameters cell with num_parameters ordinary parameters"
+
+    lines = [ PARAMETER_TEMPLATES[i % len(PARAMETER_TEMPLATES)].format(i=i) for i in range(num_parameters) ]
+
+    if stage_in:
+        lines.append("input_stac_collection_file = 'stage_in/catalog.json' # type: stage-in")
+    if stage_out:
+        lines.append("output_stac_catalog_dir = 'process_results/' # type: stage-out")
+
+    return "\n".join(lines) + "\n"
+
+def synthetic_notebook(num_cells=10, output_bytes=0, num_parameters=10, nbformat_minor=5, seed=0):
+    """Builds a valid nbformat v4 notebook.
+
+    The first cell holds num_parameters parameters, followed by num_cells code cells that
+    share output_bytes of embedded base64 PNG data between their outputs.
+    """
+
+    rng = random.Random(seed)
+
+    def cell(index, source, tags=(), outputs=()):
+        nb_cell = {
+            "cell_type": "code",
+            "execution_count": index,
+            "metadata": {"tags": list(tags)},
+            "outputs": list(outputs),
+            "source": source.splitlines(keepends=True),
+        }
+        if nbformat_minor >= 5:
+            nb_cell["id"] = f"cell-{index}"
+        return nb_cell
+
+    per_cell_bytes = output_bytes // num_cells if num_cells > 0 else 0
+
+    cells = [cell(0, parameters_source(num_parameters), tags=["parameters"])]
+    for index in range(1, num_cells + 1):
+        outputs = []
+        if per_cell_bytes > 0:
+            payload = base64.b64encode(rng.randbytes(per_cell_bytes * 3 // 4)).decode('ascii')
+            outputs.append({
+                "output_type": "display_data",
+                "data": {"image/png": payload, "text/plain": ["<Figure>"]},
+                "metadata": {},
+            })
+        cells.append(cell(index, f"result_{index} = compute({index})\nplot(result_{index})\n", outputs=outputs))
+
+    return {
+        "cells": cells,
+        "metadata": {
+            "kernelspec": {"display_name": "Python 3", "language": "python", "name": "python3"},
+            "language_info": {"name": "python"},
+        },
+        "nbformat": 4,
+        "nbformat_minor": nbformat_minor,
+    }
+
+def write_synthetic_notebook(filename, **kwargs):
+    "Writes a synthetic notebook to filename, returns its size in bytes"
+
+    with open(filename, "w") as f:
+        json.dump(synthetic_notebook(**kwargs), f)
+
+    with open(filename, "rb") as f:
+        return len(f.read())
@@ -1,5 +1,210 @@
+import io
+import os
+import json
+import tarfile
+import threading
+import http.server
+
+import git
 import pytest
 
+MANIFEST_DIGEST = "sha256:" + "1" * 64
+CONFIG_DIGEST = "sha256:" + "2" * 64
+
+MANIFEST = json.dumps({
+    'schemaVersion': 2,
+    'mediaType': 'application/vnd.docker.distribution.manifest.v2+json',
+    'config': {'mediaType': 'application/vnd.docker.container.image.v1+json', 'digest': CONFIG_DIGEST, 'size': 100},
+    'layers': [],
+}).encode()
+
 @pytest.fixture(scope='session')
 def example_app_git_url():
     return "https://github.com/unity-sds/unity-example-application"
+
+def build_notebook(parameters_source, nbformat_minor=5, extra_cells=()):
+    "Builds a minimal nbformat v4 notebook with a cell tagged as papermill parameters"
+
+    def code_cell(source, tags=()):
+        cell = {
+            "cell_type": "code",
+            "execution_count": None,
+            "metadata": {"tags": list(tags)},
+            "outputs": [],
+            "source": source,
+        }
+        if nbformat_minor >= 5:
+            cell["id"] = f"cell-{abs(hash(source)) % 10**8}"
+        return cell
+
+    cells = [code_cell(parameters_source, tags=["parameters"])]
+    cells += [code_cell(source) for source in extra_cells]
+
+    return {
+        "cells": cells,
+        "metadata": {
+            "kernelspec": {"display_name": "Python 3", "language": "python", "name": "python3"},
+            "language_info": {"name": "python"},
+        },
+        "nbformat": 4,
+        "nbformat_minor": nbformat_minor,
+    }
+
+@pytest.fixture
+def notebook_json():
+    "Returns the function building a minimal notebook around a parameters cell source"
+
+    return build_notebook
+
+@pytest.fixture
+def write_notebook(tmp_path):
+    "Returns a function that writes a parameterized notebook and returns its filename"
+
+    def _write(parameters_source, filename="process.ipynb", **kwargs):
+        nb_filename = tmp_path / filename
+        nb_filename.parent.mkdir(parents=True, exist_ok=True)
+        nb_filename.write_text(json.dumps(build_notebook(parameters_source, **kwargs)))
+        return str(nb_filename)
+
+    return _write
+
+@pytest.fixture
+def init_notebook_repo():
+    """Returns a function that creates a git repository with one commit of notebooks, and returns it.
+
+    Notebooks map paths in the repository to a parameters cell source or to notebook contents,
+    by default a single process.ipynb is created from parameters_source. Notebooks inside
+    hidden directories, like Jupyter checkpoints, are left untracked.
+    """
+
+    def _init(path, parameters_source="a = 1", notebooks=None):
+        if notebooks is None:
+            notebooks = { "process.ipynb": parameters_source }
+
+        repo = git.Repo.init(path)
+
+        for relpath, notebook in notebooks.items():
+            if isinstance(notebook, str):
+                notebook = build_notebook(notebook)
+
+            fname = os.path.join(path, relpath)
+            os.makedirs(os.path.dirname(fname), exist_ok=True)
+            with open(fname, "w") as f:
+                json.dump(notebook, f)
+
+        repo.index.add([ relpath for relpath in notebooks if not relpath.startswith(".") ])
+        repo.index.commit("initial commit")
+
+        return repo
+
+    return _init
+
+@pytest.fixture(scope='session')
+def docker_client():
+    "Client for the local Docker daemon, skips tests needing Docker when it is not available"
+
+    docker = pytest.importorskip("docker")
+
+    try:
+        client = docker.from_env()
+        client.ping()
+    except docker.errors.DockerException as e:
+        pytest.skip(f"Docker daemon is not available: {e}")
+
+    return client
+
+@pytest.fixture(scope='session')
+def local_registry(docker_client):
+    "Runs a registry:2 container on a free local port, returns the registry host:port"
+
+    container = docker_client.containers.run("registry:2", detach=True, remove=True, ports={'5000/tcp': ('127.0.0.1', None)})
+    try:
+        container.reload()
+        host_port = container.attrs['NetworkSettings']['Ports']['5000/tcp'][0]['HostPort']
+        yield f"localhost:{host_port}"
+    finally:
+        container.stop()
+
+@pytest.fixture
+def scratch_image(docker_client):
+    "Builds a minimal image to push, returns its image reference"
+
+    context = io.BytesIO()
+    with tarfile.open(fileobj=context, mode="w") as tar:
+        for name, data in [("Dockerfile", b"FROM scratch\nCOPY data.txt /data.txt\n"), ("data.txt", b"app-pack-generator\n")]:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    context.seek(0)
+
+    image_reference = "app-pack-generator-test/scratch:latest"
+    docker_client.images.build(fileobj=context, custom_context=True, tag=image_reference)
+
+    yield image_reference
+
+    docker_client.images.remove(image_reference, force=True)
+
+class RegistryHandler(http.server.BaseHTTPRequestHandler):
+    "Minimal registry holding the manifests of ns/app:v1 and private/app:v1, requiring a bearer token for private/"
+
+    requests_seen = []
+
+    def log_message(self, *args):
+        pass
+
+    def _respond(self, status, headers=None, body=b""):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        RegistryHandler.requests_seen.append((self.command, self.path, dict(self.headers)))
+
+        if self.path.startswith("/token"):
+            return self._respond(200, {"Content-Type": "application/json"}, json.dumps({'token': 'secret'}).encode())
+
+        if self.path.startswith("/v2/private/") and self.headers.get("Authorization") != "Bearer secret":
+            realm = f"http://{self.headers['Host']}/token"
+            return self._respond(401, {"WWW-Authenticate": f'Bearer realm="{realm}",service="test",scope="repository:private/app:pull"'})
+
+        if self.path in ("/v2/ns/app/manifests/v1", "/v2/private/app/manifests/v1"):
+            return self._respond(200, {
+                "Content-Type": "application/vnd.docker.distribution.manifest.v2+json",
+                "Docker-Content-Digest": MANIFEST_DIGEST,
+            }, MANIFEST)
+
+        return self._respond(404)
+
+    do_GET = do_HEAD
+
+class FakeRegistry(object):
+    "Running RegistryHandler server, formats as its host:port"
+
+    manifest_digest = MANIFEST_DIGEST
+    config_digest = CONFIG_DIGEST
+
+    def __init__(self, host):
+        self.host = host
+
+    @property
+    def requests_seen(self):
+        return RegistryHandler.requests_seen
+
+    def __str__(self):
+        return self.host
+
+@pytest.fixture
+def fake_registry():
+    "Serves a RegistryHandler on a free local port"
+
+    RegistryHandler.requests_seen = []
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), RegistryHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield FakeRegistry(f"127.0.0.1:{server.server_address[1]}")
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,150 @@
+import json
+
+import pytest
+
+from app_pack_generator import ApplicationNotebook
+from app_pack_generator.application import ApplicationError, NotebookSchemaRegistry, SCHEMA_LIST, inspect_parameters
+
+EXAMPLE_PARAMETERS = """\
+example_argument_int = 1
+example_argument_float = 1.0
+example_argument_string = "string"
+example_argument_bool = True
+example_argument_empty = None # type: string Allow a null value or a string
+input_stac_collection_file = 'test/stage_in/stage_in_results.json' # type: stage-in
+output_stac_catalog_dir    = 'process_results/'                    # type: stage-out
+"""
+
+@pytest.mark.parametrize("nbformat_minor", range(0, 6))
+def test_schema_dispatch(nbformat_minor, notebook_json):
+
+    registry = NotebookSchemaRegistry()
+    notebook = notebook_json("a = 1", nbformat_minor=nbformat_minor)
+
+    assert registry.validate(notebook) == SCHEMA_LIST[nbformat_minor]
+
+    # Only the schema declared by the notebook should have been compiled
+    assert list(registry._validators.keys()) == [nbformat_minor]
+
+def test_schema_fallback(notebook_json):
+
+    registry = NotebookSchemaRegistry()
+
+    # Declares v4.5 but lacks the cell ids required by that version, the
+    # remaining schemas are then tried in order as before
+    notebook = notebook_json("a = 1", nbformat_minor=4)
+    notebook["nbformat_minor"] = 5
+    assert registry.validate(notebook) == SCHEMA_LIST[0]
+
+    # Version fields that can not be used for dispatch also fall back to trial
+    notebook = notebook_json("a = 1", nbformat_minor=4)
+    notebook["nbformat_minor"] = 99
+    assert registry.validate(notebook) == SCHEMA_LIST[0]
+
+    notebook = notebook_json("a = 1", nbformat_minor=4)
+    notebook["nbformat"] = 3
+    assert registry.validate(notebook) is None
+    assert list(registry._validators.keys()) == [5, 0, 1, 2, 3, 4]
+
+def test_schema_validator_reused():
+
+    registry = NotebookSchemaRegistry()
+
+    assert registry.validator(5) is registry.validator(5)
+
+def test_invalid_notebook(tmp_path):
+
+    nb_filename = tmp_path / "invalid.ipynb"
+    nb_filename.write_text(json.dumps({"cells": "not a list", "nbformat": 4, "nbformat_minor": 5}))
+
+    with pytest.raises(ApplicationError, match=r"Failed to validate"):
+        ApplicationNotebook(str(nb_filename))
+
+def test_inspect_parameters_matches_papermill(write_notebook):
+
+    papermill = pytest.importorskip("papermill")
+
+    parameters_source = EXAMPLE_PARAMETERS + """\
+# A comment line between parameters
+annotated: int = 5 # The help text
+quoted: "float" = 2.5
+"""
+    nb_filename = write_notebook(parameters_source)
+
+    with open(nb_filename) as f:
+        notebook = json.load(f)
+
+    assert inspect_parameters(notebook) == papermill.inspect_notebook(nb_filename)
+
+def test_inspect_parameters_hash_in_string(notebook_json):
+
+    params = inspect_parameters(notebook_json("value = 'with # inside' # type: string The help"))
+
+    assert params['value']['default'] == "'with # inside'"
+    assert params['value']['inferred_type_name'] == 'string'
+    assert params['value']['help'] == 'The help'
+
+def test_notebook_parameters(write_notebook):
+
+    app = ApplicationNotebook(write_notebook(EXAMPLE_PARAMETERS))
+
+    assert [ p.name for p in app.notebook_parameters ] == [
+        'example_argument_int', 'example_argument_float', 'example_argument_string',
+        'example_argument_bool', 'example_argument_empty',
+        'input_stac_collection_file', 'output_stac_catalog_dir' ]
+
+    assert app.stage_in_param.name == 'input_stac_collection_file'
+    assert app.stage_out_param.name == 'output_stac_catalog_dir'
+
+    assert [ (p.name, p.cwl_type, p.default) for p in app.arguments ] == [
+        ('example_argument_int', 'int', 1),
+        ('example_argument_float', 'float', 1.0),
+        ('example_argument_string', 'string', 'string'),
+        ('example_argument_bool', 'boolean', True),
+        ('example_argument_empty', 'string', None),
+    ]
+    assert app.arguments[-1].help == 'Allow a null value or a string'
+
+def test_multiline_parameter(write_notebook):
+
+    app = ApplicationNotebook(write_notebook("values = [\n    1, # first\n    2,\n] # type: Any list of values\n"))
+
+    param = app.notebook_parameters[0]
+    assert param.default == [1, 2]
+    assert param.inferred_type == 'Any'
+    assert param.help == 'list of values'
+
+def test_no_parameters_cell(tmp_path, notebook_json):
+
+    notebook = notebook_json("a = 1")
+    notebook["cells"][0]["metadata"]["tags"] = []
+
+    assert inspect_parameters(notebook) == {}
+
+def test_inspect_parameters_non_ascii(notebook_json):
+
+    params = inspect_parameters(notebook_json("label = 'température' # Étiquette\nvalues = ['α',\n  'β']\n"))
+
+    assert params['label']['default'] == "'température'"
+    assert params['values']['default'] == "['α',\n  'β']"
+
+def test_inspect_parameters_ipython_lines(notebook_json):
+
+    params = inspect_parameters(notebook_json("%matplotlib inline\n!pip install x\ncount = 3 # type: int\n  %time pass\nname = 'a'\n"))
+
+    assert list(params) == ['count', 'name']
+    assert params['count']['inferred_type_name'] == 'int' and params['count']['default'] == '3'
+
+    with pytest.raises(ApplicationError):
+        inspect_parameters(notebook_json("%matplotlib inline\ncount = (\n"))
+
+def test_parameter_default_not_executed(tmp_path, write_notebook):
+
+    marker = tmp_path / "executed"
+    app = ApplicationNotebook(write_notebook(f"path = open({str(marker)!r}, 'w').name\nratio = -2.5\nsizes: list = (1, 2)\n"))
+
+    path, ratio, sizes = app.notebook_parameters
+    assert not marker.exists()
+    assert (path.default, path.inferred_type, path.cwl_type) == (None, None, 'string')
+    assert (ratio.default, ratio.cwl_type) == (-2.5, 'float')
+    assert (sizes.default, sizes.inferred_type, sizes.cwl_type) == ((1, 2), 'list', 'Any')
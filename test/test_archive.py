@@ -0,0 +1,137 @@
+import io
+import os
+import tracemalloc
+
+import git
+import pytest
+
+from app_pack_generator import GitManager, DockerUtil
+from app_pack_generator.archive import write_archive, read_archive, verify_archive, file_digest
+from app_pack_generator.archive import ArchiveManifest, ArchiveDigestError, ArchiveError
+
+CHUNK = bytes(range(256)) * 4096
+
+def chunks(count=8):
+    for index in range(count):
+        yield CHUNK[index:] + CHUNK[:index]
+
+@pytest.mark.parametrize("compression", [None, "gzip", "zstd"])
+def test_archive_round_trip(compression):
+
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+
+    output = io.BytesIO()
+    sha256, size, uncompressed_size = write_archive(chunks(), output, compression)
+
+    assert uncompressed_size == 8 * len(CHUNK)
+    assert size == len(output.getvalue())
+    assert (sha256, size) == file_digest(io.BytesIO(output.getvalue()))
+    assert b"".join(read_archive(io.BytesIO(output.getvalue()), compression, chunk_size=1000)) == b"".join(chunks())
+
+def test_unsupported_compression():
+
+    with pytest.raises(ArchiveError):
+        write_archive(chunks(), io.BytesIO(), "lz4")
+
+def test_archive_streaming_memory(tmp_path):
+
+    tracemalloc.start()
+    try:
+        with open(tmp_path / "image.tar.gz", "wb") as f:
+            write_archive(chunks(64), f, "gzip")
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    # Only a few chunks at a time, not the whole 64 MiB archive
+    assert peak_bytes < 8 * len(CHUNK)
+
+def test_verify_archive():
+
+    output = io.BytesIO()
+    sha256, size, _ = write_archive(chunks(), output, "gzip")
+    manifest = ArchiveManifest(image_reference="owner/app:tag", image_id="sha256:abc", compression="gzip", sha256=sha256, size=size)
+
+    verify_archive(io.BytesIO(output.getvalue()), manifest)
+
+    tampered = bytearray(output.getvalue())
+    tampered[100] ^= 0xff
+    with pytest.raises(ArchiveDigestError):
+        verify_archive(io.BytesIO(bytes(tampered)), manifest)
+
+class FakeArchiveImage(object):
+    id = "sha256:0123456789abcdef"
+
+    def __init__(self):
+        self.tags = []
+
+    def save(self, chunk_size=None, named=False):
+        assert not named
+        return chunks()
+
+    def tag(self, repository, tag=None):
+        self.tags.append((repository, tag))
+
+class FakeArchiveImages(object):
+    def __init__(self):
+        self.image = FakeArchiveImage()
+        self.loaded = None
+
+    def get(self, image_reference):
+        return self.image
+
+    def load(self, data):
+        self.loaded = b"".join(data)
+        return [self.image]
+
+class FakeArchiveClient(object):
+    def __init__(self):
+        self.images = FakeArchiveImages()
+
+class UnseekableFile(object):
+    def __init__(self, f):
+        self.f = f
+
+    def read(self, size=-1):
+        return self.f.read(size)
+
+    def seekable(self):
+        return False
+
+def test_export_import_image(tmp_path):
+
+    repo = git.Repo.init(str(tmp_path / "repo"))
+    client = FakeArchiveClient()
+    docker_util = DockerUtil(GitManager(repo.working_tree_dir), docker_client=client)
+
+    archive_fname = str(tmp_path / "image.tar.gz")
+    manifest = docker_util.export_image(archive_fname, image_reference="registry:5000/owner/app:tag")
+
+    assert manifest.image_id == FakeArchiveImage.id
+    assert os.path.exists(archive_fname + ".manifest.json")
+    assert not os.path.exists(archive_fname + ".partial")
+
+    image = docker_util.import_image(archive_fname)
+    assert client.images.loaded == b"".join(chunks())
+    assert image.tags == [("registry:5000/owner/app", "tag")]
+
+    # Archives that are not seekable, like pipes, are verified before loading as well
+    client.images.loaded = None
+    with open(archive_fname, "rb") as f:
+        docker_util.import_image(UnseekableFile(f), manifest=manifest)
+    assert client.images.loaded == b"".join(chunks())
+
+    # Corrupted archives are never loaded
+    client.images.loaded = None
+    with open(archive_fname, "r+b") as f:
+        f.seek(50)
+        f.write(b"corrupted")
+
+    with pytest.raises(ArchiveDigestError):
+        docker_util.import_image(archive_fname)
+    assert client.images.loaded is None
+
+    with open(archive_fname, "rb") as f, pytest.raises(ArchiveDigestError):
+        docker_util.import_image(UnseekableFile(f), manifest=manifest)
+    assert client.images.loaded is None
@@ -0,0 +1,59 @@
+import os
+import json
+
+import yaml
+
+from app_pack_generator import GitManager, generate_packages
+from app_pack_generator.batch import discover_notebooks
+
+PACKAGE_FILES = ['process.cwl', 'workflow.cwl', 'stage_in.cwl', 'stage_out.cwl', 'applicationDescriptor.json']
+
+# Notebooks of the test repository, including one that is invalid and a checkpoint that is not tracked
+NOTEBOOKS = {
+    "process.ipynb": "a = 1\nb = 'text' # type: stage-in",
+    "nested/other.ipynb": "c = 2.5 # type: stage-out",
+    "broken.ipynb": {"cells": "invalid"},
+    ".ipynb_checkpoints/process-checkpoint.ipynb": "a = 1",
+}
+
+def test_discover_notebooks(tmp_path, init_notebook_repo):
+
+    init_notebook_repo(str(tmp_path), notebooks=NOTEBOOKS)
+
+    assert discover_notebooks(str(tmp_path)) == [
+        str(tmp_path / "broken.ipynb"),
+        str(tmp_path / "nested" / "other.ipynb"),
+        str(tmp_path / "process.ipynb"),
+    ]
+
+def test_generate_packages(tmp_path, init_notebook_repo):
+
+    repo_path = str(tmp_path / "repo")
+    output_path = str(tmp_path / "output")
+
+    init_notebook_repo(repo_path, notebooks=NOTEBOOKS)
+    git_mgr = GitManager(repo_path)
+
+    batch = generate_packages(git_mgr, output_path, dockerurl="example/repo:latest", max_workers=2)
+
+    assert not batch.success
+    assert [ os.path.basename(r.notebook) for r in batch.succeeded ] == ["other.ipynb", "process.ipynb"]
+
+    assert len(batch.failed) == 1
+    assert batch.failed[0].notebook == os.path.join(repo_path, "broken.ipynb")
+    assert batch.failed[0].error.startswith("ApplicationError")
+
+    for result, outdir in zip(batch.succeeded, ["nested/other", "process"]):
+        assert result.outdir == os.path.join(output_path, outdir)
+        assert sorted(os.listdir(result.outdir)) == sorted(PACKAGE_FILES)
+
+        # Each package runs its own notebook from where repo2docker places the repository
+        with open(os.path.join(result.outdir, "process.cwl")) as f:
+            process_cwl = yaml.safe_load(f)
+        assert process_cwl['baseCommand'][:2] == ["papermill", f"/home/jovyan/{outdir}.ipynb"]
+
+    with open(os.path.join(output_path, "process", "applicationDescriptor.json")) as f:
+        descriptor = json.load(f)
+
+    assert descriptor['processDescription']['process']['id'].endswith(f"repo.{git_mgr.commit_identifier}")
+    assert [ i['id'] for i in descriptor['processDescription']['process']['inputs'] ] == ['a', 'b']
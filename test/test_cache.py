@@ -0,0 +1,125 @@
+import os
+
+import pytest
+
+from app_pack_generator import GenerationCache, generate_package
+from app_pack_generator import batch
+from app_pack_generator.batch import RepositoryInfo
+from app_pack_generator.output import MemorySink
+
+PACKAGE_FILES = ['applicationDescriptor.json', 'process.cwl', 'stage_in.cwl', 'stage_out.cwl', 'workflow.cwl']
+
+@pytest.fixture
+def repo_info():
+    return RepositoryInfo(name="example", owner="owner", commit_identifier="abcdef12", commit_message="message")
+
+def test_cache_hit(tmp_path, write_notebook, repo_info, monkeypatch):
+
+    cache = GenerationCache(str(tmp_path / "cache"))
+    nb_filename = write_notebook("a = 1 # type: stage-in")
+
+    generated = generate_package(nb_filename, repo_info, str(tmp_path / "first"), cache=cache)
+    assert sorted(os.path.basename(f) for f in generated) == PACKAGE_FILES
+
+    # A cache hit must not parse the notebook at all
+    def fail(*args, **kwargs):
+        raise AssertionError("Notebook was parsed despite a cache hit")
+    monkeypatch.setattr(batch, "ApplicationNotebook", fail)
+
+    cached = generate_package(nb_filename, repo_info, str(tmp_path / "second"), cache=cache)
+    assert sorted(os.path.basename(f) for f in cached) == PACKAGE_FILES
+
+    for fname in PACKAGE_FILES:
+        assert (tmp_path / "first" / fname).read_bytes() == (tmp_path / "second" / fname).read_bytes()
+
+def test_cache_sink(tmp_path, write_notebook, repo_info, monkeypatch):
+
+    cache = GenerationCache(str(tmp_path / "cache"))
+    nb_filename = write_notebook("a = 1 # type: stage-in")
+
+    first = MemorySink()
+    assert sorted(generate_package(nb_filename, repo_info, first, cache=cache)) == PACKAGE_FILES
+
+    def fail(*args, **kwargs):
+        raise AssertionError("Notebook was parsed despite a cache hit")
+    monkeypatch.setattr(batch, "ApplicationNotebook", fail)
+
+    # Entries stored from a sink serve sinks and directories alike
+    second = MemorySink()
+    assert sorted(generate_package(nb_filename, repo_info, second, cache=cache)) == PACKAGE_FILES
+    assert second.files == first.files
+
+    generate_package(nb_filename, repo_info, str(tmp_path / "output"), cache=cache)
+    for fname in PACKAGE_FILES:
+        assert (tmp_path / "output" / fname).read_bytes() == first.files[fname]
+
+def test_cache_key(write_notebook, repo_info, tmp_path):
+
+    cache = GenerationCache(str(tmp_path / "cache"))
+
+    key = cache.key(write_notebook("a = 1"), repo_info, "image:tag")
+
+    # Cells other than the parameters cell do not affect the key
+    assert cache.key(write_notebook("a = 1", extra_cells=["print(a)"]), repo_info, "image:tag") == key
+
+    assert cache.key(write_notebook("a = 2"), repo_info, "image:tag") != key
+    assert cache.key(write_notebook("a = 1"), repo_info, "image:other") != key
+
+    repo_info.commit_identifier = "12345678"
+    assert cache.key(write_notebook("a = 1"), repo_info, "image:tag") != key
+
+def test_cache_notebook_path(write_notebook, tmp_path):
+
+    cache = GenerationCache(str(tmp_path / "cache"))
+    repo_info = RepositoryInfo(name="example", commit_identifier="abcdef12", directory=str(tmp_path))
+
+    # Notebooks of the same repository with identical parameters cells
+    process_nb = write_notebook("a = 1", filename="process.ipynb")
+    other_nb = write_notebook("a = 1", filename="nested/other.ipynb")
+
+    assert cache.key(process_nb, repo_info, "image:tag") != cache.key(other_nb, repo_info, "image:tag")
+
+    generate_package(process_nb, repo_info, str(tmp_path / "process"), cache=cache)
+    generate_package(other_nb, repo_info, str(tmp_path / "other"), cache=cache)
+
+    assert "/home/jovyan/nested/other.ipynb" in (tmp_path / "other" / "process.cwl").read_text()
+
+def test_cache_template_change(write_notebook, repo_info, tmp_path):
+
+    cache = GenerationCache(str(tmp_path / "cache"))
+    nb_filename = write_notebook("a = 1")
+
+    template_dir = tmp_path / "templates"
+    template_dir.mkdir()
+    (template_dir / "process.cwl").write_text("inputs: {}\n")
+
+    key = cache.key(nb_filename, repo_info, "image:tag", str(template_dir))
+
+    (template_dir / "process.cwl").write_text("inputs: {input: Directory}\n")
+    assert cache.key(nb_filename, repo_info, "image:tag", str(template_dir)) != key
+
+def test_cache_eviction(tmp_path):
+
+    cache = GenerationCache(str(tmp_path / "cache"), max_bytes=250)
+
+    for index in range(3):
+        fname = tmp_path / f"file{index}.cwl"
+        fname.write_bytes(b"x" * 100)
+        cache.store(f"key{index}", [str(fname)])
+
+        # Use the first entry so that it becomes the most recently used
+        assert cache.lookup("key0", str(tmp_path / "out")) is not None
+
+    assert cache.lookup("key1", str(tmp_path / "out")) is None
+    assert cache.lookup("key2", str(tmp_path / "out")) is not None
+
+def test_cache_link(tmp_path):
+
+    cache = GenerationCache(str(tmp_path / "cache"), link=True)
+
+    fname = tmp_path / "process.cwl"
+    fname.write_text("cwlVersion: v1.2\n")
+    cache.store("key", [str(fname)])
+
+    linked = cache.lookup("key", str(tmp_path / "out"))
+    assert os.stat(linked[0]).st_nlink == 2
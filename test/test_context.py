@@ -0,0 +1,111 @@
+import os
+
+import git
+
+from app_pack_generator import GitManager, DockerUtil
+from app_pack_generator.context import prepare_build_context
+
+def write_files(directory, files):
+    for fname, contents in files.items():
+        path = os.path.join(directory, fname)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(contents)
+
+def context_files(context):
+    return sorted(context.files)
+
+def test_minimized_context(tmp_path):
+
+    source_dir = str(tmp_path / "repo")
+    write_files(source_dir, {
+        "environment.yml": "dependencies: [papermill]\n",
+        "requirements.txt": "-r requirements/base.txt\nnumpy\n",
+        "requirements/base.txt": "-c constraints.txt\npapermill\n",
+        "requirements/constraints.txt": "papermill<3\n",
+        "process.ipynb": "{}",
+        "other.ipynb": "{}",
+        "helpers/util.py": "",
+        "helpers/__pycache__/util.cpython-311.pyc": "",
+        "data/large.bin": "x" * 10000,
+        ".git/HEAD": "ref: refs/heads/main\n",
+    })
+
+    context = prepare_build_context(source_dir, str(tmp_path / "context"), notebooks=["process.ipynb"], include=["helpers/"])
+
+    assert context_files(context) == [ os.path.normpath(f) for f in [
+        "environment.yml", "helpers/util.py", "process.ipynb", "requirements.txt",
+        "requirements/base.txt", "requirements/constraints.txt"] ]
+    assert not context.full_context
+    assert context.context_bytes < context.source_bytes
+
+    # Files are hard linked rather than copied
+    assert os.stat(os.path.join(source_dir, "process.ipynb")).st_ino == \
+           os.stat(os.path.join(context.context_dir, "process.ipynb")).st_ino
+
+    context = prepare_build_context(source_dir, str(tmp_path / "all_notebooks"), ignore=[".git", "*.pyc", "requirements/constraints.txt"])
+    assert "other.ipynb" in context.files
+    assert os.path.normpath("requirements/constraints.txt") not in context.files
+
+def test_binder_directory(tmp_path):
+
+    source_dir = str(tmp_path / "repo")
+    write_files(source_dir, {
+        "binder/environment.yml": "dependencies: [papermill]\n",
+        "binder/postBuild": "echo done\n",
+        "environment.yml": "not used by repo2docker\n",
+        "process.ipynb": "{}",
+    })
+
+    context = prepare_build_context(source_dir, str(tmp_path / "context"))
+    assert context_files(context) == [ os.path.normpath(f) for f in ["binder/environment.yml", "binder/postBuild", "process.ipynb"] ]
+
+def test_full_context(tmp_path):
+
+    source_dir = str(tmp_path / "repo")
+    write_files(source_dir, {
+        "setup.py": "from setuptools import setup\nsetup()\n",
+        "package/__init__.py": "",
+        "process.ipynb": "{}",
+        ".git/HEAD": "ref: refs/heads/main\n",
+    })
+
+    context = prepare_build_context(source_dir, str(tmp_path / "context"))
+    assert context.full_context
+    assert context_files(context) == [ os.path.normpath(f) for f in ["package/__init__.py", "process.ipynb", "setup.py"] ]
+
+    # Requirements installing the repository itself
+    os.remove(os.path.join(source_dir, "setup.py"))
+    write_files(source_dir, {"requirements.txt": "-e .\n"})
+    assert prepare_build_context(source_dir, str(tmp_path / "context2")).full_context
+
+    # As do environments and postBuild scripts installing it
+    os.remove(os.path.join(source_dir, "requirements.txt"))
+    for index, files in enumerate([
+            {"environment.yml": "dependencies:\n  - pip\n  - pip:\n    - -e .[extra]\n"},
+            {"postBuild": "#!/bin/bash\nset -e\npython -m pip install --no-deps .\n"},
+            {"postBuild": "pip install -e ./\n"}]):
+        write_files(source_dir, files)
+        assert prepare_build_context(source_dir, str(tmp_path / f"installs{index}")).full_context
+        os.remove(os.path.join(source_dir, *files))
+
+    write_files(source_dir, {"environment.yml": "dependencies:\n  - pip:\n    - numpy\n    - papermill\n",
+                             "postBuild": "pip install papermill\njupyter lab build\n"})
+    assert prepare_build_context(source_dir, str(tmp_path / "no_install")).full_context is False
+
+def test_docker_util_context(tmp_path):
+
+    repo = git.Repo.init(str(tmp_path / "repo"))
+    write_files(repo.working_tree_dir, {"requirements.txt": "papermill\n", "process.ipynb": "{}", "data.csv": "1,2\n"})
+    repo.index.add(["requirements.txt", "process.ipynb", "data.csv"])
+    repo.index.commit("initial")
+
+    git_mgr = GitManager(repo.working_tree_dir)
+    full_key = DockerUtil(git_mgr, docker_client=object()).content_key
+
+    docker_util = DockerUtil(git_mgr, docker_client=object(), minimize_context=True, context_dir=str(tmp_path / "staging"))
+    staging_dir = docker_util._prepare_context()
+
+    assert sorted(os.listdir(staging_dir)) == ["process.ipynb", "requirements.txt"]
+    assert docker_util.build_context.source_files > 2
+    assert docker_util.content_key != full_key
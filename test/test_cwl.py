@@ -0,0 +1,132 @@
+import os
+import io
+import json
+import zipfile
+
+import yaml
+
+from app_pack_generator import ApplicationNotebook, ProcessCWL, DataStagingCWL, Descriptor
+from app_pack_generator.cwl import dump_cwl
+from app_pack_generator.batch import RepositoryInfo
+from app_pack_generator.output import MemorySink, ZipSink
+from app_pack_generator.template_store import TemplateStore
+
+PARAMETERS = """\
+example_argument_int = 1
+input_stac_collection_file = 'stage_in_results.json' # type: stage-in
+output_stac_catalog_dir = 'process_results/' # type: stage-out
+"""
+
+def read_cwl(fname):
+    with open(fname) as f:
+        return yaml.safe_load(f)
+
+def test_process_cwl(tmp_path, write_notebook):
+
+    app = ApplicationNotebook(write_notebook(PARAMETERS))
+    process_cwl = read_cwl(ProcessCWL(app).generate_process_cwl(str(tmp_path / "out"), "example/app:tag"))
+
+    assert process_cwl['requirements']['DockerRequirement']['dockerPull'] == "example/app:tag"
+    assert process_cwl['inputs']['example_argument_int'] == {'type': 'int', 'default': 1}
+    assert process_cwl['inputs']['input'] == 'Directory'
+    assert process_cwl['arguments'] == [
+        '-p', 'input_stac_collection_file', '$(inputs.input.path)',
+        '-p', 'output_stac_catalog_dir', '$(runtime.outdir)',
+    ]
+
+def test_repeated_generation(tmp_path, write_notebook):
+
+    app = ApplicationNotebook(write_notebook("example_argument_int = 1"))
+
+    process = ProcessCWL(app)
+    staging = DataStagingCWL(app)
+
+    first = [ read_cwl(f) for f in process.generate_all(str(tmp_path / "first")) + staging.generate_all(str(tmp_path / "first")) ]
+    second = [ read_cwl(f) for f in process.generate_all(str(tmp_path / "second")) + staging.generate_all(str(tmp_path / "second")) ]
+
+    assert first == second
+
+    # Without stage-in/out the related sections are removed from the generated files only
+    assert 'stage_in' not in first[1]['steps']
+    assert 'stage_in' in staging.workflow_cwl['steps']
+    assert 'output' in process.process_cwl['outputs']
+
+def test_template_store(tmp_path):
+
+    template_fname = tmp_path / "template.cwl"
+    template_fname.write_text("inputs:\n  input: Directory\n")
+
+    store = TemplateStore()
+
+    first = store.load(str(template_fname))
+    first['inputs']['other'] = 'string'
+
+    # Copies are independent of each other
+    assert store.load(str(template_fname)) == {'inputs': {'input': 'Directory'}}
+
+    # Templates are parsed again once modified
+    template_fname.write_text("inputs:\n  input: File\n")
+    os.utime(template_fname, ns=(0, 0))
+    assert store.load(str(template_fname)) == {'inputs': {'input': 'File'}}
+
+def generate_to(app, outdir):
+    repo = RepositoryInfo(name="example", owner="owner", commit_identifier="abcdef12", commit_message="message")
+
+    generated = ProcessCWL(app).generate_all(outdir, dockerurl="example/app:tag")
+    generated += DataStagingCWL(app).generate_all(outdir)
+    generated.append(Descriptor(app, repo).generate_descriptor(outdir, "example/app:tag"))
+
+    return generated
+
+def test_memory_sink(tmp_path, write_notebook):
+
+    app = ApplicationNotebook(write_notebook(PARAMETERS))
+
+    generated = generate_to(app, str(tmp_path / "out"))
+
+    sink = MemorySink()
+    assert generate_to(app, sink) == [ os.path.basename(f) for f in generated ]
+
+    for fname in generated:
+        with open(fname, 'rb') as f:
+            assert sink.files[os.path.basename(fname)] == f.read()
+
+    # Output is reproducible
+    second_sink = MemorySink()
+    generate_to(app, second_sink)
+    assert second_sink.files == sink.files
+
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zip_file:
+        generate_to(app, ZipSink(zip_file, prefix="package/"))
+
+    with zipfile.ZipFile(buffer) as zip_file:
+        assert zip_file.read("package/process.cwl") == sink.files["process.cwl"]
+
+def test_dump_cwl_tuple():
+
+    assert dump_cwl({'default': (1, 2)}) == b"#!/usr/bin/env cwl-runner\ndefault:\n- 1\n- 2\n"
+
+def test_dump_cwl_containers():
+
+    assert dump_cwl({'default': {"b", "a"}}) == b"#!/usr/bin/env cwl-runner\ndefault:\n- a\n- b\n"
+    assert dump_cwl({'default': frozenset([2, 1])}) == b"#!/usr/bin/env cwl-runner\ndefault:\n- 1\n- 2\n"
+
+    # Values without a safe representation still produce a document
+    assert dump_cwl({'default': complex(1, 2)}).startswith(b"#!/usr/bin/env cwl-runner\ndefault: !!python/complex")
+
+def test_relative_outdir(tmp_path, write_notebook, monkeypatch):
+
+    app = ApplicationNotebook(write_notebook("example_argument_int = 1"))
+
+    monkeypatch.chdir(tmp_path)
+    fname = ProcessCWL(app).generate_process_cwl("out", "example/app:tag")
+    assert fname == str(tmp_path / "out" / "process.cwl")
+
+def test_descriptor_defaults(write_notebook):
+
+    app = ApplicationNotebook(write_notebook("example_argument_int = 1"))
+
+    sink = MemorySink()
+    Descriptor(app, RepositoryInfo(name="example")).generate_descriptor(sink, "example/app:tag")
+    assert json.loads(sink.files["applicationDescriptor.json"])['processDescription']['process']['id'] == "example"
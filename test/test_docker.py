@@ -1,9 +1,14 @@
 import os
+import sys
 
+import git
 import docker
 import pytest
 
 from app_pack_generator import GitManager, DockerUtil
+from app_pack_generator.docker import content_key, StreamingBuild, DockerBuildError, DockerPushError
+from app_pack_generator.docker import PrunePolicy, GENERATED_LABEL, CONTENT_KEY_LABEL
+from app_pack_generator import docker as docker_module
 
 def test_docker_build(tmp_path, example_app_git_url):
     
@@ -14,3 +19,383 @@ def test_docker_build(tmp_path, example_app_git_url):
     docker_util.repo2docker()
 
     assert docker_util.docker_client.images.get(docker_util.image_tag)
+
+def commit_files(repo, files):
+    for fname, contents in files.items():
+        path = os.path.join(repo.working_tree_dir, fname)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(contents)
+
+    repo.index.add(list(files.keys()))
+    repo.index.commit("update files")
+
+def test_content_key(tmp_path):
+
+    repo = git.Repo.init(str(tmp_path / "repo"))
+    commit_files(repo, {"requirements.txt": "papermill\n", "process.ipynb": "{}", "README.md": "Readme"})
+
+    git_mgr = GitManager(repo.working_tree_dir)
+    key = content_key(git_mgr)
+
+    # Documentation only changes reuse the same key
+    commit_files(repo, {"README.md": "Updated readme", "docs/index.rst": "Docs"})
+    assert content_key(git_mgr) == key
+
+    # Changes to the environment produce a new key
+    commit_files(repo, {"requirements.txt": "papermill\nnumpy\n"})
+    new_key = content_key(git_mgr)
+    assert new_key != key
+
+    # As does the repo2docker configuration
+    config_fname = tmp_path / "repo2docker_config.py"
+    config_fname.write_text("c.Repo2Docker.base_image = 'example'\n")
+    assert content_key(git_mgr, str(config_fname)) != new_key
+
+    assert content_key(git_mgr, ignore=[]) != new_key
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+
+# Prints a build log, then exits with the given status
+REPLAY_SCRIPT = "import sys; sys.stdout.write(open(sys.argv[1]).read()); sys.exit(int(sys.argv[2]))"
+
+def replay_build(log_name, returncode=0, **kwargs):
+    log_fname = os.path.join(DATA_DIR, log_name)
+    with open(log_fname) as f:
+        lines = f.read().splitlines()
+
+    return StreamingBuild([sys.executable, "-c", REPLAY_SCRIPT, log_fname, str(returncode)], **kwargs), lines
+
+@pytest.mark.parametrize("log_name", ["repo2docker_build.log", "repo2docker_buildkit.log"])
+def test_streaming_build(log_name):
+
+    events = []
+    build, lines = replay_build(log_name)
+    phase_times = build.run(events.append)
+
+    assert [ e.line for e in events ] == lines
+    assert events[-1].elapsed >= events[0].elapsed
+
+    phases = { e.line: e.phase for e in events }
+
+    # The Dockerfile printed by --debug mentions conda and pip before any build step
+    assert phases["ENV CONDA_DIR ${APP_BASE}/conda"] == "prepare"
+    assert phases['RUN ${KERNEL_PYTHON_PREFIX}/bin/pip install --no-cache-dir -r "requirements.txt"'] == "prepare"
+
+    first_step = next(e for e in events if e.line.startswith(("Step 1/", "#3 [ 1/")))
+    assert first_step.phase == "fetch_base_image"
+
+    install_step = next(e for e in events if "install-base-env" in e.line and e.line.startswith(("Step", "#")))
+    assert install_step.phase == "install_environment"
+
+    assert events[-1].phase == "commit_layers"
+    assert list(phase_times.keys()) == ["prepare", "fetch_base_image", "install_environment", "commit_layers"]
+
+def test_streaming_build_failure():
+
+    build, lines = replay_build("repo2docker_build.log", returncode=3, tail_lines=10)
+
+    with pytest.raises(DockerBuildError) as exc_info:
+        build.run()
+
+    assert exc_info.value.returncode == 3
+    assert exc_info.value.output.splitlines() == lines[-10:]
+    assert "commit_layers" in exc_info.value.phase_times
+
+class FakeImage(object):
+    id = "sha256:0123456789abcdef"
+    short_id = "sha256:012345"
+
+    def __init__(self, repo_digests=(), labels=None):
+        self.tags = []
+        self.labels = labels or {}
+        self.attrs = {'RepoDigests': list(repo_digests)}
+
+    def tag(self, repository, tag=None):
+        self.tags.append(f"{repository}:{tag}" if tag is not None else repository)
+        return True
+
+class FakeImages(object):
+
+    def __init__(self, failing_registries):
+        self.image = FakeImage()
+        self.failing_registries = failing_registries
+        self.pushed = []
+        self.removed = []
+
+        # Images held by the daemon other than image, and by registries keyed by reference
+        self.local = []
+        self.registry = {}
+
+    def get(self, reference):
+        return self.image
+
+    def list(self, filters=None):
+        label, _, value = filters['label'].partition("=")
+        return [ image for image in self.local if image.labels.get(label) == value ]
+
+    def pull(self, reference):
+        if reference not in self.registry:
+            raise docker.errors.NotFound(f"manifest for {reference} not found")
+        return self.registry[reference]
+
+    def push(self, reference, stream=False, decode=False):
+        self.pushed.append(reference)
+        yield {'status': 'Preparing'}
+        if reference.split("/")[0] in self.failing_registries:
+            yield {'errorDetail': {'message': 'denied'}, 'error': 'denied'}
+        else:
+            yield {'status': 'Pushed'}
+
+    def remove(self, image_id, force=False):
+        self.removed.append(image_id)
+
+    def prune(self):
+        pass
+
+class FakeContainers(object):
+
+    def prune(self):
+        pass
+
+class FakeRegistryClient(object):
+    "Registries holding the manifest and config digests given per image reference"
+
+    def __init__(self, manifests={}):
+        self.manifests = manifests
+
+    def manifest_digest(self, reference):
+        return self.manifests.get(reference, (None, None))[0]
+
+    def config_digest(self, reference):
+        return self.manifests.get(reference, (None, None))[1]
+
+class FakeDockerClient(object):
+
+    def __init__(self, failing_registries=(), image_usage=()):
+        self.images = FakeImages(failing_registries)
+        self.containers = FakeContainers()
+        self.image_usage = list(image_usage)
+
+    def df(self):
+        images = [ i for i in self.image_usage if i['Id'] not in self.images.removed ]
+        return {
+            'LayersSize': sum(i['Size'] - max(i['SharedSize'], 0) for i in images),
+            'Images': images,
+        }
+
+def test_push_images_aggregates_errors(tmp_path):
+
+    repo = git.Repo.init(str(tmp_path / "repo"))
+    commit_files(repo, {"requirements.txt": "papermill\n"})
+
+    client = FakeDockerClient(failing_registries=["bad.example.com"])
+    docker_util = DockerUtil(GitManager(repo.working_tree_dir), docker_client=client, registry_client=FakeRegistryClient())
+
+    registries = ["mirror.example.com", "bad.example.com", "ades.example.com"]
+
+    with pytest.raises(DockerPushError, match=r"Error pushing .* to bad.example.com/.*denied") as exc_info:
+        docker_util.push_images(registries, image_reference="owner/app:tag")
+
+    results = exc_info.value.results
+    assert [ r.destination for r in results ] == [ f"{r}/owner/app:tag" for r in registries ]
+    assert [ r.success for r in results ] == [True, False, True]
+    assert sorted(client.images.pushed) == sorted(r.destination for r in results)
+
+    # Cleanup is skipped so that failed pushes can be retried
+    assert client.images.removed == []
+
+    client = FakeDockerClient()
+    docker_util = DockerUtil(GitManager(repo.working_tree_dir), docker_client=client, registry_client=FakeRegistryClient())
+
+    results = docker_util.push_images(registries, image_reference="owner/app:tag", max_workers=2)
+    assert all(r.success for r in results)
+    assert client.images.removed == [FakeImage.id]
+
+class FakeBuild(object):
+    "Stands in for StreamingBuild, records repo2docker command lines instead of running them"
+
+    commands = []
+
+    def __init__(self, cmd):
+        FakeBuild.commands.append(cmd)
+
+    def run(self, progress_callback=None):
+        return {'build': 0.0}
+
+def content_docker_util(tmp_path, client, **kwargs):
+    repo = git.Repo.init(str(tmp_path / "repo"))
+    commit_files(repo, {"requirements.txt": "papermill\n"})
+
+    return DockerUtil(GitManager(repo.working_tree_dir), do_prune=False, docker_client=client, use_content_key=True,
+                      registry_client=FakeRegistryClient(), **kwargs)
+
+def test_build_image_reuses_local_image(tmp_path, monkeypatch):
+
+    FakeBuild.commands = []
+    monkeypatch.setattr(docker_module, "StreamingBuild", FakeBuild)
+
+    client = FakeDockerClient()
+    docker_util = content_docker_util(tmp_path, client)
+
+    local_image = FakeImage(labels={CONTENT_KEY_LABEL: docker_util.content_key})
+    client.images.local.append(local_image)
+
+    assert docker_util.build_image() == docker_util.image_reference
+    assert local_image.tags == [docker_util.image_reference]
+    assert FakeBuild.commands == []
+
+def test_build_image_reuses_registry_image(tmp_path, monkeypatch):
+
+    FakeBuild.commands = []
+    monkeypatch.setattr(docker_module, "StreamingBuild", FakeBuild)
+
+    client = FakeDockerClient()
+    docker_util = content_docker_util(tmp_path, client, cache_registry="cache.example.com")
+
+    registry_image = FakeImage(labels={CONTENT_KEY_LABEL: docker_util.content_key})
+    client.images.registry[f"cache.example.com/{docker_util.content_image_reference}"] = registry_image
+
+    assert docker_util.build_image() == docker_util.image_reference
+    assert registry_image.tags == [docker_util.image_reference]
+    assert FakeBuild.commands == []
+
+    # An image under the content tag built from other content is not reused
+    registry_image.labels[CONTENT_KEY_LABEL] = "other"
+    docker_util.build_image()
+    assert len(FakeBuild.commands) == 1
+
+def test_build_image_shares_build(tmp_path, monkeypatch):
+
+    FakeBuild.commands = []
+    monkeypatch.setattr(docker_module, "StreamingBuild", FakeBuild)
+
+    client = FakeDockerClient()
+    docker_util = content_docker_util(tmp_path, client, cache_registry="cache.example.com")
+
+    assert docker_util.build_image() == docker_util.image_reference
+    assert len(FakeBuild.commands) == 1
+    assert f"{CONTENT_KEY_LABEL}={docker_util.content_key}" in FakeBuild.commands[0]
+
+    # The new build is pushed under its content tag so that later builds can pull it
+    content_destination = f"cache.example.com/{docker_util.content_image_reference}"
+    assert client.images.pushed == [content_destination]
+    assert content_destination in client.images.image.tags
+
+def test_push_images_skips_existing(tmp_path):
+
+    repo = git.Repo.init(str(tmp_path / "repo"))
+    commit_files(repo, {"requirements.txt": "papermill\n"})
+
+    client = FakeDockerClient()
+    client.images.image = FakeImage(repo_digests=["mirror.example.com/owner/app@sha256:pushed"])
+
+    registry_client = FakeRegistryClient({
+        # Pushed before by this daemon
+        "mirror.example.com/owner/app:tag": ("sha256:pushed", None),
+        # Pushed by another host, matched through the image configuration
+        "ades.example.com/owner/app:tag": ("sha256:elsewhere", FakeImage.id),
+        # A different image under the same reference
+        "old.example.com/owner/app:tag": ("sha256:old", "sha256:other"),
+    })
+    docker_util = DockerUtil(GitManager(repo.working_tree_dir), docker_client=client, registry_client=registry_client)
+
+    registries = ["mirror.example.com", "ades.example.com", "old.example.com", "new.example.com"]
+    results = docker_util.push_images(registries, image_reference="owner/app:tag", skip_existing=True)
+
+    assert [ r.status for r in results ] == ["skipped", "skipped", "pushed", "pushed"]
+    assert sorted(client.images.pushed) == ["new.example.com/owner/app:tag", "old.example.com/owner/app:tag"]
+    assert all(r.seconds >= r.check_seconds for r in results)
+
+    # Existing images are only looked for when asked to
+    client.images.pushed = []
+    results = docker_util.push_images(registries, image_reference="owner/app:tag")
+    assert [ r.status for r in results ] == ["pushed"] * 4
+    assert len(client.images.pushed) == 4
+
+def test_push_images_fake_registry(tmp_path, fake_registry):
+
+    repo = git.Repo.init(str(tmp_path / "repo"))
+    commit_files(repo, {"requirements.txt": "papermill\n"})
+
+    client = FakeDockerClient()
+    client.images.image = FakeImage(repo_digests=[f"{fake_registry}/ns/app@{fake_registry.manifest_digest}"])
+    docker_util = DockerUtil(GitManager(repo.working_tree_dir), do_prune=False, docker_client=client)
+
+    results = docker_util.push_images([f"{fake_registry}/ns", f"{fake_registry}/other"], image_reference="app:v1",
+                                      skip_existing=True)
+
+    assert [ r.status for r in results ] == ["skipped", "pushed"]
+    assert client.images.pushed == [f"{fake_registry}/other/app:v1"]
+
+def test_push_images_local_registry(tmp_path, docker_client, local_registry, scratch_image):
+
+    repo = git.Repo.init(str(tmp_path / "repo"))
+    commit_files(repo, {"requirements.txt": "papermill\n"})
+
+    docker_util = DockerUtil(GitManager(repo.working_tree_dir), do_prune=False, docker_client=docker_client)
+
+    # Use two repository names within the same registry as stand-ins for separate registries
+    destinations = [f"{local_registry}/mirror", f"{local_registry}/ades"]
+    results = docker_util.push_images(destinations, image_reference=scratch_image)
+
+    assert all(r.success for r in results)
+    for result in results:
+        assert docker_client.images.get_registry_data(result.destination)
+
+def test_push_images_local_registry_skips_existing(tmp_path, docker_client, local_registry, scratch_image):
+
+    repo = git.Repo.init(str(tmp_path / "repo"))
+    commit_files(repo, {"requirements.txt": "papermill\n"})
+
+    docker_util = DockerUtil(GitManager(repo.working_tree_dir), do_prune=False, docker_client=docker_client)
+
+    destination = f"{local_registry}/rerun"
+    assert docker_util.push_images([destination], image_reference=scratch_image, skip_existing=True)[0].status == "pushed"
+
+    # Re-running the release finds the same manifest in the registry
+    result = docker_util.push_images([destination], image_reference=scratch_image, skip_existing=True)[0]
+    assert result.status == "skipped"
+    assert result.success
+
+def image_usage(image_id, size, created, generated=True, tags=()):
+    return {
+        'Id': image_id,
+        'Size': size,
+        'SharedSize': 0,
+        'Created': created,
+        'RepoTags': list(tags),
+        'Labels': { GENERATED_LABEL: 'true' } if generated else None,
+    }
+
+def test_prune_policy(tmp_path):
+
+    import time
+    now = time.time()
+
+    usage = [
+        image_usage("base", 500, now - 10000, generated=False, tags=["buildpack-deps:jammy"]),
+        image_usage("oldest", 100, now - 9000),
+        image_usage("older", 100, now - 8000),
+        image_usage("protected", 100, now - 7000, tags=["owner/keep:latest"]),
+        image_usage("recent", 100, now - 60),
+    ]
+    client = FakeDockerClient(image_usage=usage)
+
+    policy = PrunePolicy(max_bytes=800, protect=["*/keep:*"], state_file=str(tmp_path / "usage.json"))
+
+    # Using the oldest image makes it the most recently used
+    policy.touch("oldest")
+    policy.protect_seconds = 0
+
+    assert policy.enforce(client) == ["older"]
+    assert client.df()['LayersSize'] == 800
+
+    # Within budget nothing is evicted
+    assert policy.enforce(client) == []
+
+    policy.max_bytes = 0
+    assert policy.enforce(client) == ["recent", "oldest"]
+
+    # The usage record is shared through the state file
+    assert "oldest" in PrunePolicy(0, state_file=str(tmp_path / "usage.json"))._load_state()
@@ -0,0 +1,120 @@
+import time
+import threading
+import http.server
+
+import pytest
+import requests
+
+from app_pack_generator.util import Util
+from app_pack_generator.download import Downloader
+
+CONFIG = b"c.Repo2Docker.base_image = 'example'\n"
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    requests_seen = []
+    failures_left = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        Handler.requests_seen.append((self.path, dict(self.headers)))
+
+        if self.path == "/slow":
+            time.sleep(0.5)
+        elif self.path == "/flaky" and Handler.failures_left > 0:
+            Handler.failures_left -= 1
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        elif self.path == "/missing":
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if self.path == "/config.py" and self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(CONFIG)))
+        if self.path == "/config.py":
+            self.send_header("ETag", '"v1"')
+        elif self.path == "/fresh.py":
+            self.send_header("Cache-Control", "max-age=3600")
+        self.end_headers()
+        self.wfile.write(CONFIG)
+
+@pytest.fixture
+def http_server():
+    Handler.requests_seen = []
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+def test_conditional_download(tmp_path, http_server):
+
+    downloader = Downloader(cache_dir=str(tmp_path / "cache"))
+
+    response = downloader.get(f"{http_server}/config.py")
+    assert response.content == CONFIG and not response.from_cache
+
+    response = downloader.get(f"{http_server}/config.py")
+    assert response.content == CONFIG and response.from_cache
+    assert response.text == CONFIG.decode()
+    assert Handler.requests_seen[-1][1]["If-None-Match"] == '"v1"'
+
+    # A new downloader with the same cache directory, as used by a later build
+    response = Downloader(cache_dir=str(tmp_path / "cache")).get(f"{http_server}/config.py")
+    assert response.from_cache
+
+def test_fresh_download(tmp_path, http_server):
+
+    downloader = Downloader(cache_dir=str(tmp_path / "cache"))
+    downloader.get(f"{http_server}/fresh.py")
+    response = downloader.get(f"{http_server}/fresh.py")
+
+    assert response.from_cache
+    assert len(Handler.requests_seen) == 1
+
+def test_download_retries_and_timeout(tmp_path, http_server):
+
+    downloader = Downloader(cache_dir=None, retries=2, backoff=0, timeout=0.1)
+
+    Handler.failures_left = 2
+    assert downloader.get(f"{http_server}/flaky").status_code == 200
+
+    with pytest.raises(requests.exceptions.ConnectionError):
+        downloader.get(f"{http_server}/slow")
+
+def test_offline_cached_download(tmp_path):
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    url = f"http://127.0.0.1:{server.server_address[1]}/config.py"
+    downloader = Downloader(cache_dir=str(tmp_path / "cache"), retries=0, timeout=0.5)
+    try:
+        downloader.get(url)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    response = downloader.get(url)
+    assert response.from_cache and response.content == CONFIG
+
+def test_download_link(tmp_path, http_server):
+
+    downloader = Downloader(cache_dir=str(tmp_path / "cache"), retries=0)
+
+    assert Util.DownloadLink(f"{http_server}/config.py", downloader=downloader).content == CONFIG
+    assert Util.DownloadLink(f"{http_server}/missing", default="default", downloader=downloader) == "default"
+    assert Util.DownloadLink("not a url", default="default", downloader=downloader) == "default"
@@ -0,0 +1,67 @@
+import os
+import json
+
+import yaml
+import pytest
+
+from app_pack_generator.fleet import FleetManifest, FleetBuilder, FleetError, build_concurrency, main
+from app_pack_generator.fleet import BUILD_MEMORY_BYTES
+
+def write_manifest(tmp_path, repositories, **kwargs):
+    manifest_fname = tmp_path / "manifest.yml"
+    manifest_fname.write_text(yaml.safe_dump(dict(kwargs, repositories=repositories)))
+    return str(manifest_fname)
+
+def test_build_concurrency():
+
+    assert build_concurrency(cpus=16, memory_bytes=64 * 1024 ** 3) == 8
+    assert build_concurrency(cpus=16, memory_bytes=2 * BUILD_MEMORY_BYTES) == 2
+    assert build_concurrency(cpus=1, memory_bytes=1024) == 1
+
+def test_manifest_errors(tmp_path):
+
+    with pytest.raises(FleetError, match="unique"):
+        FleetManifest.read(write_manifest(tmp_path, [{"source": "a/repo"}, {"source": "b/repo.git"}]))
+
+    with pytest.raises(FleetError, match="Unknown keys"):
+        FleetManifest.read(write_manifest(tmp_path, [{"source": "a/repo", "notebok": "typo.ipynb"}]))
+
+    # Names can not escape the work directory
+    for name in ["../x", "a/b", ".."]:
+        with pytest.raises(FleetError, match="names can not be paths"):
+            FleetManifest.read(write_manifest(tmp_path, [{"source": "a/repo", "name": name}]))
+
+def test_fleet_resume(tmp_path, init_notebook_repo):
+
+    for name in ["first", "second"]:
+        init_notebook_repo(str(tmp_path / "sources" / name), f"{name}_value = 1")
+
+    repositories = [
+        {"source": f"file://{tmp_path}/sources/first"},
+        {"source": f"file://{tmp_path}/sources/second"},
+        {"name": "broken", "source": f"file://{tmp_path}/sources/first", "notebook": "missing.ipynb"},
+    ]
+    manifest_fname = write_manifest(tmp_path, repositories, workdir="work",
+                                    defaults={"build": False, "dockerurl": "example/app:tag"})
+
+    builder = FleetBuilder(FleetManifest.read(manifest_fname))
+    runs = builder.run()
+
+    assert { name: run.success for name, run in runs.items() } == {"first": True, "second": True, "broken": False}
+    assert os.path.exists(tmp_path / "work" / "packages" / "second" / "process.cwl")
+
+    with open(tmp_path / "work" / "fleet-state.json") as f:
+        state = json.load(f)
+    assert state["first"]["status"] == "succeeded"
+    assert state["broken"]["status"] == "failed"
+    assert "missing.ipynb" in state["broken"]["stages"]["parse"]["error"]
+
+    # Only the failed entry and entries that changed are processed again
+    repositories[1]["dockerurl"] = "example/app:new"
+    write_manifest(tmp_path, repositories, workdir="work", defaults={"build": False, "dockerurl": "example/app:tag"})
+
+    builder = FleetBuilder(FleetManifest.read(manifest_fname))
+    assert sorted(builder.run().keys()) == ["broken", "second"]
+    assert "example/app:new" in (tmp_path / "work" / "packages" / "second" / "process.cwl").read_text()
+
+    assert main([manifest_fname, "--limit", "clone=1"]) == 1
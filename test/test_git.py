@@ -3,7 +3,7 @@ import git
 
 import pytest
 
-from app_pack_generator import GitManager, GitRepoError
+from app_pack_generator import GitManager, GitMirrorCache, GitRepoError
 
 def init_empty_repo(path):
     repo = git.Repo.init(path)
@@ -91,3 +91,133 @@ def test_clone_local(tmp_path):
     git_mgr = GitManager(source_path, dest_path)
 
     check_empty_repo(git_mgr, dest_path)
+
+def init_history_repo(path):
+    "Repository with several commits, a tag and a branch that allows partial and on demand fetches"
+
+    repo = git.Repo.init(path)
+    with repo.config_writer() as config:
+        config.set_value("uploadpack", "allowFilter", "true")
+        config.set_value("uploadpack", "allowAnySHA1InWant", "true")
+
+    os.makedirs(os.path.join(path, "data"))
+    commits = []
+    for index in range(3):
+        for fname in ["process.ipynb", "environment.yml", "data/large.bin"]:
+            with open(os.path.join(path, fname), "w") as f:
+                f.write(f"{fname} version {index}\n")
+
+        repo.index.add(["process.ipynb", "environment.yml", "data/large.bin"])
+        commits.append(repo.index.commit(f"commit {index}"))
+
+    repo.create_tag("v1", ref=commits[1])
+
+    return repo, commits
+
+def test_shallow_clone(tmp_path):
+
+    source_repo, commits = init_history_repo(str(tmp_path / "source"))
+
+    git_mgr = GitManager(f"file://{tmp_path / 'source'}", str(tmp_path / "dest"), depth=1)
+
+    assert git_mgr.is_shallow
+    assert git_mgr.repo.git.rev_list("--count", "HEAD") == "1"
+    assert git_mgr.commit_identifier == commits[-1].hexsha[:8]
+    assert git_mgr.commit_message == "commit 2"
+
+    # Refs outside of the shallow history are fetched on demand
+    git_mgr.checkout(commits[0].hexsha)
+    assert git_mgr.commit_identifier == commits[0].hexsha[:8]
+
+    git_mgr.checkout("v1")
+    assert git_mgr.commit_message == "commit 1"
+
+def test_partial_sparse_clone(tmp_path):
+
+    source_repo, commits = init_history_repo(str(tmp_path / "source"))
+
+    git_mgr = GitManager(f"file://{tmp_path / 'source'}", str(tmp_path / "dest"),
+                         blob_filter="blob:none", sparse_paths=["/*.ipynb", "/environment.yml"])
+
+    assert git_mgr.repo.git.config("remote.origin.partialclonefilter") == "blob:none"
+    assert sorted(os.listdir(git_mgr.directory)) == [".git", "environment.yml", "process.ipynb"]
+    assert not git_mgr.is_shallow
+
+    git_mgr.checkout(commits[1].hexsha)
+    assert git_mgr.commit_message == "commit 1"
+    assert not os.path.exists(os.path.join(git_mgr.directory, "data"))
+
+    with open(os.path.join(git_mgr.directory, "process.ipynb")) as f:
+        assert f.read() == "process.ipynb version 1\n"
+
+def test_mirror_cache(tmp_path):
+
+    source_repo, commits = init_history_repo(str(tmp_path / "source"))
+    source_url = f"file://{tmp_path / 'source'}"
+
+    mirror_cache = GitMirrorCache(str(tmp_path / "mirrors"))
+
+    first_mgr = GitManager(source_url, str(tmp_path / "first"), mirror_cache=mirror_cache)
+    mirror_path = mirror_cache.mirror_path(source_url)
+
+    assert os.path.isdir(mirror_path)
+    assert first_mgr.commit_identifier == commits[-1].hexsha[:8]
+    assert first_mgr.repo.remote("origin").url == source_url
+
+    # Objects are borrowed from the mirror rather than copied
+    with open(os.path.join(first_mgr.repo.git_dir, "objects", "info", "alternates")) as f:
+        assert os.path.realpath(f.read().strip()) == os.path.realpath(os.path.join(mirror_path, "objects"))
+
+    # Further clones reuse the mirror without fetching when refreshes are turned off
+    mirror_head = os.path.getmtime(os.path.join(mirror_path, "packed-refs"))
+    second_mgr = GitManager(source_url, str(tmp_path / "second"), mirror_cache=mirror_cache, refresh_mirror=False)
+    second_mgr.checkout("v1")
+    assert second_mgr.commit_message == "commit 1"
+    assert os.path.getmtime(os.path.join(mirror_path, "packed-refs")) == mirror_head
+
+    # Refs created after the mirror are fetched into it on demand
+    source_repo.create_head("feature", commits[0])
+    with open(os.path.join(source_repo.working_tree_dir, "process.ipynb"), "w") as f:
+        f.write("new version\n")
+    source_repo.index.add(["process.ipynb"])
+    new_commit = source_repo.index.commit("commit 3")
+
+    second_mgr.checkout(new_commit.hexsha)
+    assert second_mgr.commit_message == "commit 3"
+
+    second_mgr.checkout("feature")
+    assert second_mgr.commit_identifier == commits[0].hexsha[:8]
+
+def test_mirror_refresh(tmp_path):
+
+    source_repo, commits = init_history_repo(str(tmp_path / "source"))
+    source_url = f"file://{tmp_path / 'source'}"
+
+    mirror_cache = GitMirrorCache(str(tmp_path / "mirrors"))
+    first_mgr = GitManager(source_url, str(tmp_path / "first"), mirror_cache=mirror_cache)
+
+    with open(os.path.join(source_repo.working_tree_dir, "process.ipynb"), "w") as f:
+        f.write("new version\n")
+    source_repo.index.add(["process.ipynb"])
+    new_commit = source_repo.index.commit("commit 3")
+
+    # New clones of the default branch see commits made after the mirror was created
+    second_mgr = GitManager(source_url, str(tmp_path / "second"), mirror_cache=mirror_cache)
+    assert second_mgr.commit_identifier == new_commit.hexsha[:8]
+
+    # As do checkouts of branches in existing clones, which end on a local tracking branch
+    branch = source_repo.active_branch.name
+    first_mgr.checkout(branch)
+    assert first_mgr.commit_identifier == new_commit.hexsha[:8]
+    assert first_mgr.repo.active_branch.name == branch
+    assert first_mgr.repo.active_branch.tracking_branch().name == f"origin/{branch}"
+
+    # Tags are checked out detached
+    first_mgr.checkout("v1")
+    assert first_mgr.repo.head.is_detached and first_mgr.commit_message == "commit 1"
+
+    # Full commit hashes never move and do not refresh the mirror
+    mirror_head = os.path.getmtime(os.path.join(mirror_cache.mirror_path(source_url), "FETCH_HEAD"))
+    first_mgr.checkout(commits[0].hexsha)
+    assert first_mgr.commit_identifier == commits[0].hexsha[:8]
+    assert os.path.getmtime(os.path.join(mirror_cache.mirror_path(source_url), "FETCH_HEAD")) == mirror_head
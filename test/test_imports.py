@@ -0,0 +1,47 @@
+import os
+import sys
+import json
+import subprocess
+
+import app_pack_generator
+
+
+PACKAGE_ROOT = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..")
+
+# Dependencies that should only be imported by the functionality needing them
+HEAVY_MODULES = ['docker', 'git', 'giturlparse', 'requests', 'jsonschema', 'tabulate', 'papermill']
+
+def loaded_modules(code):
+    "Runs code in a new interpreter and returns the heavy modules it imported"
+
+    script = code + f"\nimport sys\nprint(','.join([ m for m in {HEAVY_MODULES!r} if m in sys.modules ]))\n"
+    env = dict(os.environ, PYTHONPATH=PACKAGE_ROOT)
+    output = subprocess.check_output([sys.executable, "-c", script], env=env, cwd=PACKAGE_ROOT, text=True)
+    return [ m for m in output.strip().split(',') if m ]
+
+def test_import_package():
+
+    assert loaded_modules("import app_pack_generator") == []
+
+def test_generate_cwl(tmp_path, notebook_json):
+
+    nb_filename = tmp_path / "process.ipynb"
+    nb_filename.write_text(json.dumps(notebook_json("example_argument_int = 1")))
+
+    loaded = loaded_modules(f"""
+from app_pack_generator import ApplicationNotebook, ProcessCWL, DataStagingCWL
+from app_pack_generator.output import MemorySink
+
+app = ApplicationNotebook({str(nb_filename)!r})
+ProcessCWL(app).generate_all(MemorySink(), dockerurl="example/app:tag")
+DataStagingCWL(app).generate_all(MemorySink())
+""")
+
+    # Validating the notebook is the only part needing a heavy dependency
+    assert loaded == ['jsonschema']
+
+def test_public_names():
+
+    for name in app_pack_generator.__all__:
+        assert getattr(app_pack_generator, name) is not None
+        assert name in dir(app_pack_generator)
@@ -0,0 +1,93 @@
+import io
+import json
+import threading
+
+import pytest
+
+from app_pack_generator import ApplicationNotebook, ProcessCWL
+from app_pack_generator.util import Util
+from app_pack_generator import instrument
+from app_pack_generator.instrument import span, add_sink, remove_sink, MemoryCollector, JsonLinesSink
+
+@pytest.fixture
+def collector():
+    sink = add_sink(MemoryCollector())
+    yield sink
+    remove_sink(sink)
+    instrument.disable_profiling()
+
+def test_no_sink():
+
+    with span('unused') as current:
+        assert current is None
+
+def test_nested_spans(collector):
+
+    with span('outer', key='value') as outer:
+        with span('inner') as inner:
+            pass
+
+    inner_span, outer_span = collector.spans
+    assert outer_span.name == 'outer' and outer_span.attributes == {'key': 'value'}
+    assert inner_span.parent_id == outer_span.span_id
+    assert inner_span.depth == 1 and outer_span.depth == 0
+    assert outer_span.duration_ns >= inner_span.duration_ns > 0
+
+def test_span_error(collector):
+
+    with pytest.raises(ValueError):
+        with span('failing'):
+            raise ValueError("failed")
+
+    assert collector.spans[0].error == 'ValueError'
+
+def test_threads_are_separate(collector):
+
+    with span('main'):
+        def worker():
+            with span('worker'):
+                pass
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+
+    assert collector.by_name('worker')[0].parent_id is None
+
+def test_profiling(collector):
+
+    instrument.enable_profiling('profiled', cpu=True, memory=True)
+
+    with span('profiled'):
+        data = [ str(i) for i in range(10000) ]
+
+    profiled = collector.spans[0]
+    assert 'function calls' in profiled.profile
+    assert profiled.memory_peak_bytes > 0
+
+def test_json_lines_sink():
+
+    output = io.StringIO()
+    sink = add_sink(JsonLinesSink(output))
+    try:
+        with span('logged', count=3):
+            pass
+    finally:
+        remove_sink(sink)
+
+    record = json.loads(output.getvalue())
+    assert record['name'] == 'logged' and record['attributes'] == {'count': 3}
+
+def test_time_function(collector):
+
+    elapsed, value = Util.TimeFunction(sum, [1, 2, 3])
+
+    assert value == 6 and elapsed >= 0
+    assert collector.spans[0].name == 'sum'
+
+def test_library_spans(collector, tmp_path, write_notebook):
+
+    app = ApplicationNotebook(write_notebook("example_argument_int = 1"))
+    ProcessCWL(app).generate_process_cwl(str(tmp_path), "example/app:tag")
+
+    names = set([ s.name for s in collector.spans ])
+    assert set(['notebook.load', 'notebook.validate', 'notebook.parameters', 'cwl.emit']) <= names
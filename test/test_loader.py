@@ -0,0 +1,73 @@
+import io
+import json
+import tracemalloc
+
+import pytest
+
+from app_pack_generator import ApplicationNotebook
+from app_pack_generator.loader import stream_notebook, load_notebook, NotebookLoadError
+
+@pytest.fixture
+def notebook_with_outputs(notebook_json):
+    "Returns a function building a notebook whose cells have outputs of about output_bytes each"
+
+    def _build(output_bytes):
+        notebook = notebook_json("example_argument_int = 1 # type: int", extra_cells=["print('done')"])
+
+        for cell in notebook["cells"]:
+            cell["outputs"] = [
+                {"output_type": "stream", "name": "stdout", "text": ["a \"quoted\" ] } [ {\\ line\n", "é\n"]},
+                {"output_type": "display_data", "metadata": {}, "data": {"image/png": "A" * output_bytes}},
+            ]
+        notebook["cells"][0]["attachments"] = {"plot.png": {"image/png": "Zm9v"}}
+
+        return notebook
+
+    return _build
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+def test_stream_notebook(chunk_size, notebook_with_outputs):
+
+    text = json.dumps(notebook_with_outputs(1000), indent=1)
+    notebook = stream_notebook(io.StringIO(text), chunk_size=chunk_size)
+
+    expected = json.loads(text)
+    for cell in expected["cells"]:
+        cell["outputs"] = []
+        cell.pop("attachments", None)
+
+    assert notebook == expected
+
+def test_stream_invalid_json():
+
+    with pytest.raises(NotebookLoadError):
+        stream_notebook(io.StringIO('{"cells": [{"source": "a = 1"'))
+
+    with pytest.raises(NotebookLoadError):
+        stream_notebook(io.StringIO('{"cells": []} []'))
+
+def test_streaming_memory_ceiling(tmp_path, notebook_with_outputs):
+
+    output_bytes = 8 * 1024 * 1024
+    nb_filename = tmp_path / "large.ipynb"
+    nb_filename.write_text(json.dumps(notebook_with_outputs(output_bytes)))
+
+    tracemalloc.start()
+    try:
+        notebook = load_notebook(str(nb_filename), skip_outputs=True)
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert peak_bytes < 1024 * 1024
+    assert notebook["cells"][0]["outputs"] == []
+
+def test_streaming_application(tmp_path, notebook_with_outputs):
+
+    nb_filename = tmp_path / "large.ipynb"
+    nb_filename.write_text(json.dumps(notebook_with_outputs(1000)))
+
+    app = ApplicationNotebook(str(nb_filename), streaming=True)
+
+    assert [ p.name for p in app.notebook_parameters ] == ['example_argument_int']
+    assert app.notebook["cells"][1]["outputs"] == []
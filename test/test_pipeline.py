@@ -0,0 +1,135 @@
+import os
+import asyncio
+
+from app_pack_generator.pipeline import AsyncPackager, PackagingJob, StageSkipped, package_repositories
+from app_pack_generator.instrument import span, add_sink, remove_sink, MemoryCollector
+
+def test_pipeline(tmp_path, init_notebook_repo):
+
+    jobs = []
+    for index in range(3):
+        source = str(tmp_path / f"source{index}")
+        init_notebook_repo(source, f"value_{index} = {index}")
+        jobs.append(PackagingJob(source=f"file://{source}", dest=str(tmp_path / f"clone{index}"),
+                                 outdir=str(tmp_path / f"output{index}"), build=False, dockerurl="example/app:tag"))
+
+    runs = package_repositories(jobs, stage_limits={'clone': 2, 'parse': 1})
+
+    for index, run in enumerate(runs):
+        assert run.success
+        assert list(run.timings.keys()) == ['clone', 'parse', 'generate']
+
+        generated = run.tasks['generate'].result().value
+        assert sorted(os.path.basename(f) for f in generated) == [
+            'applicationDescriptor.json', 'process.cwl', 'stage_in.cwl', 'stage_out.cwl', 'workflow.cwl']
+
+        with open(os.path.join(tmp_path, f"output{index}", "process.cwl")) as f:
+            assert f"value_{index}" in f.read()
+
+def test_pipeline_failure(tmp_path, init_notebook_repo):
+
+    source = str(tmp_path / "source")
+    init_notebook_repo(source)
+
+    async def run_jobs():
+        packager = AsyncPackager()
+
+        run = packager.submit(PackagingJob(source=f"file://{source}", dest=str(tmp_path / "clone"),
+                                           outdir=str(tmp_path / "output"), notebook="missing.ipynb", build=False))
+
+        # Individual stages can be awaited as soon as they finish
+        clone_result = await run.clone
+        assert clone_result.success
+        assert clone_result.value.commit_message == "initial commit"
+
+        results = await run
+        packager.shutdown()
+        return results
+
+    results = asyncio.run(run_jobs())
+
+    assert set(results.keys()) == {'clone', 'parse', 'generate'}
+    assert not results['parse'].success
+    assert isinstance(results['generate'].error, StageSkipped)
+
+def test_pipeline_retries(tmp_path, init_notebook_repo):
+
+    source = str(tmp_path / "source")
+    init_notebook_repo(source)
+
+    class FlakyPackager(AsyncPackager):
+        clone_calls = 0
+
+        def _clone(self, job):
+            FlakyPackager.clone_calls += 1
+            if FlakyPackager.clone_calls == 1:
+                raise ConnectionError("Connection reset")
+            return super()._clone(job)
+
+    async def run_job():
+        packager = FlakyPackager(stage_retries={'clone': 1}, retry_delay=0)
+        results = await packager.submit(PackagingJob(source=f"file://{source}", dest=str(tmp_path / "clone"),
+                                                     outdir=str(tmp_path / "output"), build=False))
+        packager.shutdown()
+        return results
+
+    results = asyncio.run(run_job())
+
+    assert results['clone'].success and results['clone'].attempts == 2
+    assert results['generate'].success
+
+def test_pipeline_push_retries(tmp_path, init_notebook_repo):
+
+    from app_pack_generator.docker import PushResult
+
+    source = str(tmp_path / "source")
+    init_notebook_repo(source)
+
+    pushed_to = []
+
+    class FlakyDockerUtil(object):
+        image_reference = "owner/app:tag"
+
+        def build_image(self):
+            return self.image_reference
+
+        def push_images(self, registry_urls, image_reference=None, raise_on_error=True):
+            pushed_to.append(list(registry_urls))
+            return [ PushResult(registry_url=url, destination=f"{url}/{image_reference}",
+                                error="unavailable" if url == "flaky.example.com" and len(pushed_to) == 1 else None)
+                     for url in registry_urls ]
+
+    class FlakyPackager(AsyncPackager):
+        def _docker_util(self, job, git_mgr):
+            return FlakyDockerUtil()
+
+    async def run_job():
+        packager = FlakyPackager(stage_retries={'push': 1}, retry_delay=0)
+        results = await packager.submit(PackagingJob(source=f"file://{source}", dest=str(tmp_path / "clone"),
+                                                     outdir=str(tmp_path / "output"),
+                                                     registries=["stable.example.com", "flaky.example.com"]))
+        packager.shutdown()
+        return results
+
+    results = asyncio.run(run_job())
+
+    # Only the registry that failed is pushed to again
+    assert results['push'].success and results['push'].attempts == 2
+    assert pushed_to == [["stable.example.com", "flaky.example.com"], ["flaky.example.com"]]
+    assert [ r.registry_url for r in results['push'].value ] == ["stable.example.com", "flaky.example.com"]
+
+def test_pipeline_spans(tmp_path, init_notebook_repo):
+
+    source = str(tmp_path / "source")
+    init_notebook_repo(source)
+
+    collector = add_sink(MemoryCollector())
+    try:
+        # Spans recorded in executor threads stay nested in the span of the caller
+        with span('packaging') as outer:
+            package_repositories([PackagingJob(source=f"file://{source}", dest=str(tmp_path / "clone"),
+                                               outdir=str(tmp_path / "output"), build=False)])
+    finally:
+        remove_sink(collector)
+
+    assert collector.by_name('git.clone')[0].parent_id == outer.span_id
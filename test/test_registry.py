@@ -0,0 +1,50 @@
+import pytest
+
+from app_pack_generator.registry import RegistryClient, RegistryError, parse_reference, DOCKER_HUB_HOST
+
+def test_parse_reference():
+
+    assert parse_reference("localhost:5000/ns/app:v1") == ("localhost:5000", "ns/app", "v1")
+    assert parse_reference("localhost:5000/app") == ("localhost:5000", "app", "latest")
+    assert parse_reference("ghcr.io/org/app:1.0") == ("ghcr.io", "org/app", "1.0")
+    assert parse_reference("org/app:1.0") == (DOCKER_HUB_HOST, "org/app", "1.0")
+    assert parse_reference("python:3.11") == (DOCKER_HUB_HOST, "library/python", "3.11")
+    assert parse_reference("docker.io/org/app") == (DOCKER_HUB_HOST, "org/app", "latest")
+
+def test_manifest_digest(fake_registry):
+
+    client = RegistryClient()
+
+    assert client.manifest_digest(f"{fake_registry}/ns/app:v1") == fake_registry.manifest_digest
+    assert client.manifest_digest(f"{fake_registry}/ns/app:v2") is None
+
+    # Local registries are contacted over http once https fails, which is then remembered
+    assert client._schemes[fake_registry.host] == "http"
+
+    method, path, headers = fake_registry.requests_seen[0]
+    assert method == "HEAD" and path == "/v2/ns/app/manifests/v1"
+    assert "application/vnd.oci.image.index.v1+json" in headers["Accept"]
+
+def test_config_digest(fake_registry):
+
+    client = RegistryClient()
+
+    assert client.config_digest(f"{fake_registry}/ns/app:v1") == fake_registry.config_digest
+    assert client.config_digest(f"{fake_registry}/ns/app:v2") is None
+
+def test_bearer_token(fake_registry):
+
+    client = RegistryClient()
+
+    assert client.manifest_digest(f"{fake_registry}/private/app:v1") == fake_registry.manifest_digest
+    assert "/token?scope=repository%3Aprivate%2Fapp%3Apull&service=test" in [ path for _, path, _ in fake_registry.requests_seen ]
+
+    # The token is reused for the following requests
+    fake_registry.requests_seen.clear()
+    assert client.manifest_digest(f"{fake_registry}/private/app:v1") == fake_registry.manifest_digest
+    assert len(fake_registry.requests_seen) == 1
+
+def test_unreachable_registry():
+
+    with pytest.raises(RegistryError):
+        RegistryClient(timeout=1).manifest_digest("127.0.0.1:9/ns/app:v1")
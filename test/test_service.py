@@ -0,0 +1,207 @@
+import io
+import json
+import socket
+import zipfile
+import threading
+import http.client
+
+import pytest
+
+from app_pack_generator.service import GenerationService, ServiceError, create_server, check_job_request, is_local_source
+from app_pack_generator.service import STATUS_SUCCEEDED, STATUS_FAILED
+
+
+@pytest.fixture
+def service(tmp_path):
+    service = GenerationService(workdir=str(tmp_path / "service"), max_jobs=2, allow_local_sources=True)
+    service.warm()
+    yield service
+    service.shutdown()
+
+@pytest.fixture
+def server_address(service):
+    server = create_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.server_address
+    server.shutdown()
+    server.server_close()
+
+def request(address, method, path, body=None):
+    connection = http.client.HTTPConnection(*address, timeout=30)
+    connection.request(method, path, body=json.dumps(body) if body is not None else None,
+                       headers={"Content-Type": "application/json"})
+    response = connection.getresponse()
+    data = response.read()
+    connection.close()
+    return response.status, response.getheader("Content-Type"), data
+
+def test_generate(server_address, notebook_json):
+
+    status, _, data = request(server_address, "POST", "/generate",
+                              {"notebook": notebook_json("count = 1\nlabel = 'x'"), "name": "app", "dockerurl": "example/app:1"})
+    assert status == 200
+
+    result = json.loads(data)
+    assert result["status"] == STATUS_SUCCEEDED
+    assert "count" in result["files"]["process.cwl"]
+    assert "example/app:1" in result["files"]["process.cwl"]
+    descriptor = json.loads(result["files"]["applicationDescriptor.json"])
+    assert descriptor["processDescription"]["process"]["id"].startswith("app.")
+
+    status, _, data = request(server_address, "POST", "/generate",
+                              {"notebook": notebook_json("count = 1"), "name": "app", "owner": "org", "commit": "v1"})
+    descriptor = json.loads(json.loads(data)["files"]["applicationDescriptor.json"])
+    assert descriptor["processDescription"]["process"]["id"] == "org.app.v1"
+
+    status, _, data = request(server_address, "POST", "/generate", {"notebook": {"cells": []}})
+    assert status == 422
+    assert json.loads(data)["status"] == STATUS_FAILED
+
+def test_bad_requests(server_address, notebook_json):
+
+    assert request(server_address, "POST", "/generate", {"notebook": notebook_json("a = 1"), "build": True})[0] == 400
+    assert request(server_address, "POST", "/jobs", {"unknown": 1})[0] == 400
+    assert request(server_address, "POST", "/jobs", {"source": "file:///tmp/repo", "owner": "org"})[0] == 400
+    assert request(server_address, "GET", "/jobs/missing")[0] == 404
+    assert request(server_address, "PUT", "/jobs")[0] == 501
+    assert request(server_address, "DELETE", "/health")[0] == 405
+
+def test_check_job_request():
+
+    assert not is_local_source("https://github.com/org/repo")
+    assert not is_local_source("git@github.com:org/repo.git")
+    assert is_local_source("file:///srv/repo")
+    assert is_local_source("/srv/repo")
+    assert is_local_source("ext::sh -c touch% /tmp/owned")
+
+    check_job_request({"source": "https://github.com/org/repo", "notebook": "nested/process.ipynb"})
+
+    for job_request in [{"source": "file:///srv/repo"}, {"source": "/srv/repo"},
+                        {"source": "https://github.com/org/repo", "notebook": "/etc/passwd"},
+                        {"source": "https://github.com/org/repo", "notebook": "../other/process.ipynb"},
+                        {"source": "https://github.com/org/repo", "notebook": "nested/../../process.ipynb"}]:
+        with pytest.raises(ServiceError):
+            check_job_request(job_request)
+
+    check_job_request({"source": "/srv/repo"}, allow_local_sources=True)
+
+def test_repository_job(tmp_path, server_address, init_notebook_repo):
+
+    source = str(tmp_path / "source")
+    source_repo = init_notebook_repo(source, "threshold = 0.5")
+
+    status, _, data = request(server_address, "POST", "/jobs", {"source": f"file://{source}", "dockerurl": "example/app:1"})
+    assert status == 202
+    job_id = json.loads(data)["job_id"]
+
+    # Streams the events of the job until it finished
+    status, content_type, data = request(server_address, "GET", f"/jobs/{job_id}/events")
+    assert status == 200 and content_type == "application/x-ndjson"
+
+    events = [ json.loads(line) for line in data.splitlines() ]
+    assert [ e["event"] for e in events ] == ["queued", "running", "cloned", "parsed", "generated", STATUS_SUCCEEDED]
+    assert events[2]["commit"] == source_repo.head.commit.hexsha[:8]
+    assert events[3]["parameters"] == ["threshold"]
+
+    job = json.loads(request(server_address, "GET", f"/jobs/{job_id}")[2])
+    assert job["status"] == STATUS_SUCCEEDED
+    assert "process.cwl" in job["files"]
+
+    status, _, data = request(server_address, "GET", f"/jobs/{job_id}/artifacts/process.cwl")
+    assert status == 200 and b"threshold" in data
+
+    status, content_type, data = request(server_address, "GET", f"/jobs/{job_id}/package.zip")
+    assert status == 200 and content_type == "application/zip"
+    assert sorted(zipfile.ZipFile(io.BytesIO(data)).namelist()) == sorted(job["files"])
+
+    assert request(server_address, "DELETE", f"/jobs/{job_id}")[0] == 200
+    assert request(server_address, "GET", f"/jobs/{job_id}")[0] == 404
+
+def test_mirror_refresh(tmp_path, service, notebook_json, init_notebook_repo):
+
+    source = str(tmp_path / "source")
+    source_repo = init_notebook_repo(source, "a = 1")
+
+    job = service.generate({"source": f"file://{source}"})
+    assert job.status == STATUS_SUCCEEDED
+
+    # A new commit on the branch is picked up once the mirror is due for a refresh
+    with open(f"{source}/process.ipynb", "w") as f:
+        json.dump(notebook_json("b = 2"), f)
+    source_repo.index.add(["process.ipynb"])
+    source_repo.index.commit("change parameters")
+
+    service.mirror_refresh = 0
+    job = service.generate({"source": f"file://{source}"})
+    assert job.status == STATUS_SUCCEEDED
+    assert job.events[2]["commit"] == source_repo.head.commit.hexsha[:8]
+    assert job.events[3]["parameters"] == ["b"]
+
+def test_failed_mirror_refresh(tmp_path, service):
+
+    source = f"file://{tmp_path / 'missing'}"
+    job = service.generate({"source": source})
+    assert job.status == STATUS_FAILED
+
+    # The next job fetches again instead of waiting for the refresh interval
+    assert source not in service._mirror_fetched
+
+def test_bounded_queue(tmp_path, notebook_json):
+
+    service = GenerationService(workdir=str(tmp_path / "service"), max_jobs=1, max_queued=1)
+
+    release = threading.Event()
+    running = threading.Event()
+    original_execute = service._execute
+
+    def blocking_execute(job, job_dir):
+        running.set()
+        release.wait(10)
+        return original_execute(job, job_dir)
+
+    service._execute = blocking_execute
+
+    try:
+        job_request = {"notebook": notebook_json("a = 1")}
+        _, first = service.submit(job_request)
+        running.wait(10)
+
+        # One job runs, one waits and the next one is refused
+        _, second = service.submit(job_request)
+        with pytest.raises(ServiceError) as exc_info:
+            service.submit(job_request)
+        assert exc_info.value.status == 503
+
+        release.set()
+        assert first.result(10).status == STATUS_SUCCEEDED
+        assert second.result(10).status == STATUS_SUCCEEDED
+    finally:
+        release.set()
+        service.shutdown()
+
+def test_unix_socket(tmp_path, service):
+
+    socket_path = str(tmp_path / "service.sock")
+    server = create_server(service, socket_path=socket_path)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(socket_path)
+            client.sendall(b"GET /health HTTP/1.0\r\n\r\n")
+
+            response = b""
+            while True:
+                data = client.recv(4096)
+                if not data:
+                    break
+                response += data
+
+        head, _, body = response.partition(b"\r\n\r\n")
+        assert head.startswith(b"HTTP/1.0 200")
+        assert json.loads(body)["status"] == "ok"
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,73 @@
+import os
+import shutil
+import threading
+
+import pytest
+
+from app_pack_generator.watch import PackageWatcher, LOCAL_PATH
+from app_pack_generator.batch import RepositoryInfo
+
+REPO = RepositoryInfo(name="example", owner="unity-sds", commit_identifier="0123abcd", commit_message="Example")
+
+def output_mtimes(outdir):
+    return { fname: os.stat(os.path.join(outdir, fname)).st_mtime_ns for fname in os.listdir(outdir) }
+
+@pytest.fixture
+def template_dir(tmp_path):
+    template_dir = tmp_path / "templates"
+    shutil.copytree(os.path.join(LOCAL_PATH, "templates"), template_dir)
+    return str(template_dir)
+
+def test_incremental_update(tmp_path, write_notebook, template_dir):
+
+    outdir = str(tmp_path / "out")
+    nb_filename = write_notebook("example_argument_int = 1")
+    watcher = PackageWatcher(nb_filename, outdir, REPO, template_dir=template_dir)
+
+    assert sorted(watcher.update()) == ['applicationDescriptor.json', 'process.cwl', 'stage_in.cwl', 'stage_out.cwl', 'workflow.cwl']
+    initial_mtimes = output_mtimes(outdir)
+
+    # Changes outside of the parameters cell
+    write_notebook("example_argument_int = 1", extra_cells=["print('hello')"])
+    assert watcher.update([nb_filename]) == []
+
+    # Changing a default only changes process.cwl
+    write_notebook("example_argument_int = 2")
+    assert watcher.update([nb_filename]) == ['process.cwl']
+
+    write_notebook("example_argument_int = 2\nexample_argument_float = 1.5")
+    assert sorted(watcher.update([nb_filename])) == ['applicationDescriptor.json', 'process.cwl', 'workflow.cwl']
+
+    with open(os.path.join(template_dir, "stage_in.cwl"), "a") as f:
+        f.write("doc: Changed template\n")
+    assert watcher.update([os.path.join(template_dir, "stage_in.cwl")]) == ['stage_in.cwl']
+
+    assert output_mtimes(outdir)['stage_out.cwl'] == initial_mtimes['stage_out.cwl']
+
+def test_run_polling(tmp_path, write_notebook, template_dir):
+
+    outdir = str(tmp_path / "out")
+    nb_filename = write_notebook("example_argument_int = 1")
+    watcher = PackageWatcher(nb_filename, outdir, REPO, template_dir=template_dir,
+                             debounce=0.05, poll_interval=0.01, polling=True)
+
+    stop_event = threading.Event()
+    thread = threading.Thread(target=watcher.run, args=(stop_event,))
+    thread.start()
+    try:
+        for _ in range(200):
+            if os.path.exists(os.path.join(outdir, "process.cwl")):
+                break
+            stop_event.wait(0.01)
+
+        write_notebook("example_argument_int = 1\nexample_argument_string = 'changed'")
+        for _ in range(500):
+            if watcher.app.notebook_parameters[-1].name == 'example_argument_string':
+                break
+            stop_event.wait(0.01)
+    finally:
+        stop_event.set()
+        thread.join()
+
+    with open(os.path.join(outdir, "process.cwl")) as f:
+        assert 'example_argument_string' in f.read()